@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Compare the speed and accuracy of thumbnail histogram modes.
+
+For a random sample of thumbnails, time each histogram mode and
+measure how far its (normalised) histograms are from those of the
+full mode, after rebinning the full histograms to the same number of
+bins.  The distance is the L1 distance averaged over images and
+channels, so 0 is identical and 2 is disjoint.
+
+"""
+
+from __future__ import print_function
+from lib_gtd import gtd_data_img_directory, get_image_filenames
+from lib_gtd import image_to_histograms, histogram_mode_name, FULL_HISTOGRAM_MODE
+import argparse
+import numpy as np
+import random
+import time
+
+def normalised(histograms, bins):
+    """Return histograms as a (3, bins) array of distributions.
+    """
+    stacked = np.stack([np.ravel(hist) for hist in histograms]).astype(np.float64)
+    stacked = stacked.reshape(3, bins, -1).sum(axis=2)
+    return stacked / stacked.sum(axis=1, keepdims=True)
+
+def bench_histograms(image_dir, num_images, scales, bin_counts):
+    """Time each histogram mode on a sample of images and print the results.
+    """
+    image_filenames = get_image_filenames(image_dir)
+    image_filenames = random.sample(image_filenames,
+                                    min(num_images, len(image_filenames)))
+    print('Sampled {n} images'.format(n=len(image_filenames)))
+    # Read everything once so that we compare decoding, not disk access.
+    full = [image_to_histograms(filename) for filename in image_filenames]
+    print('{mode:>20} {t:>12} {d:>10}'.format(
+        mode='mode', t='ms/image', d='distance'))
+    for scale in scales:
+        for bins in bin_counts:
+            mode = histogram_mode_name(scale, bins)
+            start_time = time.time()
+            reduced = [image_to_histograms(filename, mode)
+                       for filename in image_filenames]
+            time_diff = time.time() - start_time
+            distances = [np.abs(normalised(full_hist, bins)
+                                - normalised(reduced_hist, bins)).sum(axis=1).mean()
+                         for full_hist, reduced_hist in zip(full, reduced)]
+            print('{mode:>20} {t:12.3f} {d:10.4f}{full}'.format(
+                mode=mode, t=1000 * time_diff / len(image_filenames),
+                d=np.mean(distances),
+                full=' (full)' if mode == FULL_HISTOGRAM_MODE else ''))
+
+def main():
+    """Do what we do."""
+    parser = argparse.ArgumentParser()
+    named_args = parser.add_argument_group('arguments')
+    named_args.add_argument('--image-dir', type=str, default=None,
+                            help='Directory of thumbnails (default: the gtd-img directory)')
+    named_args.add_argument('-n', '--num-images', type=int, default=1000,
+                            help='Number of thumbnails to sample')
+    named_args.add_argument('--scales', type=str, default='1,2,4,8',
+                            help='Comma-separated list of decode scales to try')
+    named_args.add_argument('--bins', type=str, default='256,64,16',
+                            help='Comma-separated list of bin counts to try')
+    args = parser.parse_args()
+    image_dir = args.image_dir
+    if image_dir is None:
+        image_dir = gtd_data_img_directory()
+    bench_histograms(image_dir, args.num_images,
+                     [int(scale) for scale in args.scales.split(',')],
+                     [int(bins) for bins in args.bins.split(',')])
+
+if __name__ == '__main__':
+    main()
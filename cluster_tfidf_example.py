@@ -6,7 +6,7 @@
 
 from __future__ import print_function
 
-from lib_gtd import gtd_load
+from lib_gtd import gtd_load, gtd_data_store
 from sklearn import metrics
 from sklearn.decomposition import TruncatedSVD
 from sklearn.feature_extraction.text import HashingVectorizer
@@ -31,12 +31,12 @@ def load_data(input_filename):
     window was in front).
 
     """
-    dframe = gtd_load(input_filename, 'tasks')
+    titles, counts = gtd_load(input_filename).used_titles()
     print('Got {cnt} text labels, of which {ucnt} unique'.format(
-        cnt=len(dframe.label),
-        ucnt=len(dframe.label.unique())
+        cnt=counts.sum(),
+        ucnt=len(titles)
     ))
-    return dframe.label.unique()
+    return np.array(titles, dtype=object)
 
 def do_cluster(opts, args):
     """
@@ -143,8 +143,8 @@ def main():
 
     op = OptionParser()
     op.add_option("--input-filename", dest="input_filename",
-                  help="Name of file for input (without .tasks suffix)",
-                  default="/tmp/gtd-data",
+                  help="Path and filename prefix to data file",
+                  default=gtd_data_store(),
                   metavar="FILE")
     op.add_option("--lsa",
                   dest="n_components", type="int",
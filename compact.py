@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""Merge the segments of the database into one.
+
+Each refresh, follow.py dump, and labeling session adds a segment to
+the database (see lib_gtd_store), and loading it costs a merge per
+segment.  This merges them all into one.  It is safe to run while
+other programs use the database, and refresh.py and follow.py start
+it in the background when segments pile up.
+
+With --codec, the merged segment is compressed, in blocks so that
+reading a few days only decompresses those.  That makes the database
+several times smaller, at the cost of decompressing it to load all of
+it.
+
+"""
+
+from __future__ import print_function
+from lib_gtd import gtd_data_store, gtd_compact
+from lib_gtd_store import CODECS
+import argparse
+
+def main():
+    """Compact the database."""
+    parser = argparse.ArgumentParser()
+    named_args = parser.add_argument_group('arguments')
+    named_args.add_argument('--store', type=str, default=gtd_data_store(),
+                            help='Database directory to compact')
+    named_args.add_argument('--codec', type=str, choices=sorted(CODECS) + ['none'],
+                            help='Compress the merged segment with this codec '
+                            '(default: as the oldest segment is)')
+    named_args.add_argument('--level', type=int,
+                            help='Compression level (default: the codec\'s own)')
+    args = parser.parse_args()
+    gtd_compact(args.store, args.codec, args.level)
+
+if __name__ == '__main__':
+    main()
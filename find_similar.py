@@ -9,8 +9,9 @@ history to show.  The default is ten.
 
 from __future__ import print_function
 import argparse
-from lib_gtd import gtd_load
+from lib_gtd import gtd_load, gtd_data_store
 from operator import itemgetter
+import numpy as np
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -20,8 +21,8 @@ def find_similar(input_filename, target):
     """Find some phrases similar to target.
 
     """
-    dataframe = gtd_load(input_filename, 'tasks')
-    labels = dataframe.label.unique()
+    titles, _ = gtd_load(input_filename).used_titles()
+    labels = np.array(titles, dtype=object)
     print('Got {n} labels.'.format(n=len(labels)))
 
     max_score = .5
@@ -66,8 +67,8 @@ def main():
     parser = argparse.ArgumentParser()
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('--input-filename', type=str,
-                            default='/tmp/gtd-data',
-                            help='Path and filename prefix to pickled data file')
+                            default=gtd_data_store(),
+                            help='Path to the database')
     named_args.add_argument('--target', type=str,
                             help='Target phrase for finding similar phrases')
     # parser.add_argument('--verbose', dest='verbose', action='store_true')
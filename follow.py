@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""Follow the raw gtd data and add new events to the database as they
+arrive, so that plots can be nearly up to date without running
+refresh.py.
+
+We start by catching up, exactly as refresh.py would.  Then we poll:
+the active window title file of each host is read from where we left
+off (see the manifest in lib_gtd), and the thumbnail directory is only
+listed again when its mtime says something was added.  Polling costs a
+few stat() calls when nothing has happened.  (Python has no portable
+inotify, and polling every few seconds is cheap enough.)  What a poll
+reads is only buffered in the store, and merged into it when we next
+write it, so a poll costs the same however large the database is.
+
+Thumbnail histograms are computed in the database's mode, and looked
+up in the histogram cache, as refresh.py does.
+
+What is new is written to the database, as a new segment, no more
+often than --dump-interval, and once more when we are interrupted.
+When --compact-after segments have piled up, they are compacted in
+the background.
+
+"""
+
+from __future__ import print_function
+from lib_gtd import gtd_data_store, gtd_data_directory, gtd_data_img_directory
+from lib_gtd import gtd_load, gtd_read, gtd_dump, start_compaction
+from lib_gtd import gtd_manifest_store, gtd_manifest_load, gtd_manifest_dump
+from lib_gtd import index_window_title_files, select_title_files, read_window_titles
+from lib_gtd import index_image_files, scan_window_thumbnails
+from lib_gtd import gtd_histogram_cache_store, histogram_cache_load, histogram_cache_dump
+from lib_gtd import add_ingest_arguments, ingest_histogram_mode
+import argparse
+import os
+import signal
+import time
+
+# Thumbnails younger than this (by the time in their name) may still be
+# being written, so we leave them for a later poll.
+IMAGE_SETTLE_SECONDS = 2
+
+def dump(filename, gtd_data, manifest_filename, manifest,
+         cache_filename, histogram_cache):
+    """Write what we have read, as refresh.py does.
+
+    Counting the events merges those read since the last dump into the
+    store, which costs a copy of its timestamps, so we only do it here
+    rather than at every poll.
+
+    """
+    print('Now {n} points'.format(n=len(gtd_data)))
+    histogram_cache_dump(cache_filename, histogram_cache)
+    gtd_dump(filename, gtd_data)
+    gtd_manifest_dump(manifest_filename, manifest)
+
+def follow(interval, dump_interval, jobs, compact_after, gtd_data,
+           histogram_mode, use_digest):
+    """Catch up, then poll for new raw data every interval seconds.
+
+    Gtd_data is the store loaded from gtd_data_store(), and
+    histogram_mode that of its histograms (see store_histogram_mode()).
+
+    """
+    filename = gtd_data_store()
+    manifest_filename = gtd_manifest_store()
+    cache_filename = gtd_histogram_cache_store()
+    data_dir = gtd_data_directory()
+    data_img_dir = gtd_data_img_directory()
+    manifest = gtd_manifest_load(manifest_filename)
+    histogram_cache = histogram_cache_load(cache_filename)
+    gtd_data = gtd_read(data_dir, data_img_dir, gtd_data, manifest, jobs,
+                        histogram_cache, use_digest, histogram_mode)
+    dump(filename, gtd_data, manifest_filename, manifest,
+         cache_filename, histogram_cache)
+    last_dump = time.time()
+    dirty = False
+
+    title_dir_mtime = os.stat(data_dir).st_mtime
+    title_files = index_window_title_files(data_dir, verbose=False)
+    image_dir_mtime = os.stat(data_img_dir).st_mtime
+    if image_dir_mtime >= time.time() - IMAGE_SETTLE_SECONDS:
+        # Look again at the next poll, in case gtd_read() caught an image
+        # in the middle of being written.
+        image_dir_mtime = None
+    last_poll = time.time()
+    try:
+        while True:
+            time.sleep(interval)
+            poll_start = time.time()
+            mtime = os.stat(data_dir).st_mtime
+            if mtime != title_dir_mtime:
+                # A new session has started somewhere, or files have
+                # been copied in from another machine.  The manifest
+                # skips those we have already read.
+                title_dir_mtime = mtime
+                title_files = index_window_title_files(data_dir, verbose=False)
+                active_files = title_files
+            else:
+                # Only sessions that may have run since the last poll.
+                active_files = select_title_files(title_files, start_time=last_poll)
+            num_read = read_window_titles(active_files, gtd_data, manifest,
+                                          verbose=False)
+            mtime = os.stat(data_img_dir).st_mtime
+            num_scanned = 0
+            if mtime != image_dir_mtime:
+                settled = int(poll_start) - IMAGE_SETTLE_SECONDS
+                # Not only images newer than the last: some may have
+                # been copied in late.  The manifest skips those we
+                # have already read.
+                image_files = index_image_files(data_img_dir, end_time=settled,
+                                                verbose=False)
+                num_scanned = scan_window_thumbnails(
+                    image_files, gtd_data, manifest, jobs, histogram_cache,
+                    use_digest, histogram_mode, verbose=False)
+                if mtime < settled:
+                    # Otherwise we have left images for the next poll.
+                    image_dir_mtime = mtime
+            last_poll = poll_start
+            if num_read or num_scanned:
+                dirty = True
+            if dirty and time.time() - last_dump >= dump_interval:
+                dump(filename, gtd_data, manifest_filename, manifest,
+                     cache_filename, histogram_cache)
+                start_compaction(filename, compact_after)
+                last_dump = time.time()
+                dirty = False
+    except KeyboardInterrupt:
+        print('Interrupted.')
+    if dirty:
+        dump(filename, gtd_data, manifest_filename, manifest,
+             cache_filename, histogram_cache)
+
+def terminate(signum, frame):
+    """Treat SIGTERM like ^C, so that we save what we have."""
+    raise KeyboardInterrupt()
+
+def main():
+    """Follow the raw data until interrupted."""
+    parser = argparse.ArgumentParser()
+    named_args = parser.add_argument_group('arguments')
+    named_args.add_argument('--interval', type=float, default=5,
+                            help='Seconds between polls of the raw data')
+    named_args.add_argument('--dump-interval', type=float, default=60,
+                            help='Minimum seconds between writes to the database')
+    add_ingest_arguments(named_args, compact_after=20)
+    args = parser.parse_args()
+    gtd_data = gtd_load(gtd_data_store())
+    histogram_mode = ingest_histogram_mode(parser, args, gtd_data)
+    signal.signal(signal.SIGTERM, terminate)
+    follow(args.interval, args.dump_interval, args.jobs, args.compact_after,
+           gtd_data, histogram_mode, args.digest)
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,15 @@
 
 """Select a point at random and offer to label it.
 
-We maintain a file of labels indexed by hostname and time.
+We maintain a file of labels indexed by hostname and time.  Each
+label is saved as soon as it is given (see gtd_save_label()), so the
+store itself is not rewritten.
 """
 
 from __future__ import print_function
-from lib_gtd import gtd_load, gtd_dump, gtd_data_store
+from lib_gtd import gtd_load, gtd_save_label, gtd_data_store, NO_VALUE
 import argparse
+import numpy as np
 import os
 import random
 
@@ -21,19 +24,48 @@ def get_label():
         return None
     return label
 
-def label_one_point(unlabeled_data):
-    """Pick an unlabeled point at random and ask for a label.
+def random_unlabeled_row(gtd_data, rows):
+    """Return a row at random among rows (None for all) that lacks a label.
+
+    Most points are unlabeled, so we pick at random until we find
+    one rather than list them all.  Return None if there are none.
+
+    """
+    for _ in range(1000):
+        if rows is None:
+            row = random.randrange(len(gtd_data))
+        else:
+            row = rows[random.randrange(len(rows))]
+        if gtd_data.title_label[row] == NO_VALUE or \
+           gtd_data.thumbnail_label[row] == NO_VALUE:
+            return row
+    # Few are left, so look at them all.
+    if rows is None:
+        rows = np.arange(len(gtd_data))
+    unlabeled = rows[(gtd_data.title_label[rows] == NO_VALUE) |
+                     (gtd_data.thumbnail_label[rows] == NO_VALUE)]
+    if len(unlabeled) == 0:
+        return None
+    return unlabeled[random.randrange(len(unlabeled))]
+
+def label_one_point(filename, gtd_data, rows):
+    """Pick an unlabeled point at random among rows and ask for a label.
 
     Return true if we should continue, false to terminate.
     """
-    key = random.choice(unlabeled_data.keys())
-    value = unlabeled_data[key]
+    row = random_unlabeled_row(gtd_data, rows)
+    if row is None:
+        print('No unlabeled points left.')
+        return False
+    key = (gtd_data.hosts[gtd_data.host[row]], int(gtd_data.timestamp[row]))
+    # We only need the thumbnail filename, not its histograms.
+    value = gtd_data.event(row, histograms=False)
     if 'ground_truth_window_title_label' not in value:
         print(value['window_title'])
         label = get_label()
         if None == label:
             return False
-        value['ground_truth_window_title_label'] = label
+        gtd_save_label(filename, gtd_data, key, 'title', label)
     if 'ground_truth_window_thumbnail_label' not in value and \
        'window_thumbnail_filename' in value:
         os.system('geeqie --remote {fn}'.format(
@@ -41,34 +73,32 @@ def label_one_point(unlabeled_data):
         label = get_label()
         if None == label:
             return False
-        value['ground_truth_window_thumbnail_label'] = label
+        gtd_save_label(filename, gtd_data, key, 'thumbnail', label)
     return True
 
 def label_points(filename, images):
     """Load data, query for labels until an empty label.
 
     Load data, filter to unlabeled points, and query for labels until
-    the user provides an empty label.  Save the dataset.
+    the user provides an empty label.
 
     """
     gtd_data = gtd_load(filename)
-    s = set()
-    for v in gtd_data.values():
-        s = s.union(v.keys())
-    print('Key set: ', s)
-    unlabeled_data = {k: v for k, v in gtd_data.iteritems() if
-                      'ground_truth_window_title_label' not in v or
-                      'ground_truth_window_thumbnail_label' not in v}
-    print('Found {n} unlabeled points'.format(n=len(unlabeled_data)))
+    # The labeled points are in the store's index.
+    labeled = np.intersect1d(gtd_data.labeled_rows('title'),
+                             gtd_data.labeled_rows('thumbnail'), assume_unique=True)
+    num_unlabeled = len(gtd_data) - len(labeled)
+    print('Found {n} unlabeled points'.format(n=num_unlabeled))
+    rows = None
     if images:
-        unlabeled_data = {k: v for k, v in unlabeled_data.iteritems()
-                          if 'window_thumbnail_filename' in v}
-        print('With images: found {n} unlabeled points'.format(n=len(unlabeled_data)))
-    # The slice is not deep, so modifying the values will modify in
-    # the original gtd_data as well.  So we can persist.
-    while label_one_point(unlabeled_data):
+        rows = np.setdiff1d(np.flatnonzero(gtd_data.thumbnail != NO_VALUE), labeled,
+                            assume_unique=True)
+        num_unlabeled = len(rows)
+        print('With images: found {n} unlabeled points'.format(n=num_unlabeled))
+    if num_unlabeled == 0:
+        return
+    while label_one_point(filename, gtd_data, rows):
         pass
-    gtd_dump(filename, gtd_data)
 
 def main():
     """Pick a point at random and offer to label it.
@@ -80,7 +110,7 @@ def main():
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-f', '--filename', type=str,
                             default=gtd_data_store(),
-                            help='Path and filename prefix to pickled data file')
+                            help='Path to the database')
     named_args.add_argument('-i', '--images', dest='images',
                             action='store_true',
                             help='Filter to events with thumbnails')
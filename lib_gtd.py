@@ -3,196 +3,2290 @@
 """Functions for reading and simple manipulation of gtd data."""
 
 from __future__ import print_function
-from glob import glob
 from os import getenv
+import calendar
+import collections
 import cv2
 import datetime
+import functools
+import hashlib
+import lib_gtd_store
+import multiprocessing
+import numbers
 import numpy as np
 import os
+import pandas as pd
 import pickle
 import re
+import subprocess
+import sys
 import time
+import zlib
+
+def first_of_n_last_days(num_days):
+    """Return the first of the most recent n days, as a numpy datetime64[D].
+
+    If n is 0, that's today.
+
+    """
+    return np.datetime64(datetime.date.today()) - \
+        np.timedelta64(max(num_days - 1, 0), 'D')
 
 def filter_n_last_days(data_gtd, num_days):
-    """Select the rows of df_tasks in the most recent n days.
+    """Select the events of data_gtd (a GtdStore) in the most recent n days.
+
+    If n is 0, select today's tasks.
+
+    Return the first day in the selection and the selection itself as
+    a new GtdStore (see GtdStore.events_between(), so that's a binary
+    search and views of the columns).  To avoid loading more than the
+    last days in the first place, pass first_of_n_last_days() to
+    gtd_load().
+
+    """
+    first_day = first_of_n_last_days(num_days)
+    return first_day, data_gtd.events_between(first_day)
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+def list_directory(path):
+    """Return a list of (name, path) of the regular files in path.
+
+    Use os.scandir() if we have it: it gets the file type along with
+    the name, so we don't stat every file.
+
+    """
+    if scandir is None:
+        return [(name, os.path.join(path, name)) for name in os.listdir(path)
+                if os.path.isfile(os.path.join(path, name))]
+    return [(entry.name, entry.path) for entry in scandir(path)
+            if entry.is_file()]
+
+# A window title file, host__YYYY-MM-DD_HHMMSS, with the session
+# start parsed to seconds since the epoch (or None if we can't).
+TitleFile = collections.namedtuple('TitleFile', ['path', 'host', 'session_start'])
+
+# A window thumbnail file, host_timestamp.png.
+ImageFile = collections.namedtuple('ImageFile', ['path', 'host', 'timestamp'])
+
+def parse_session_start(session):
+    """Return the session start YYYY-MM-DD_HHMMSS in seconds since the epoch.
+
+    The session start is in local time.  Return None if it doesn't parse.
+
+    """
+    try:
+        return int(time.mktime(time.strptime(session, '%Y-%m-%d_%H%M%S')))
+    except ValueError:
+        return None
+
+def index_window_title_files(path, hosts=None, start_time=None, end_time=None,
+                             verbose=True):
+    """Return a list of TitleFile for the window title files in path.
+
+    If hosts is provided, only return files for those hosts.  If
+    start_time or end_time (seconds since the epoch) are provided,
+    only return files that may contain events in that range.  A
+    session runs from its start to the start of the host's next
+    session, so we can decide that without opening any file.
+
+    The list is sorted by host and session start.  Unless verbose, we
+    print nothing.
+
+    """
+    if verbose:
+        print('path', path)
+    title_pattern = re.compile('^(.*)__(.*)$')
+    title_files = []
+    for name, file_path in list_directory(path):
+        title_match = title_pattern.match(name)
+        if title_match is not None:
+            host, session = title_match.groups()
+            if hosts is None or host in hosts:
+                title_files.append(
+                    TitleFile(file_path, host, parse_session_start(session)))
+    title_files.sort(key=lambda title_file: (
+        title_file.host, title_file.session_start or 0, title_file.path))
+    # Technically, we probably don't need to do anything more here.
+    # But it's maybe interesting to know how many hosts if it doesn't
+    # cost too much.
+    all_hosts = set(title_file.host for title_file in title_files)
+    all_hosts.discard('gtd')
+    if verbose:
+        print('Got {n} window title filenames and {h} hostnames'.format(
+            n=len(title_files), h=len(all_hosts)))
+        print('Hostnames={h}'.format(h=', '.join(all_hosts)))
+    if start_time is None and end_time is None:
+        return title_files
+    selected = select_title_files(title_files, start_time, end_time)
+    if verbose:
+        print('Selected {n} window title files in the time range'.format(
+            n=len(selected)))
+    return selected
+
+def select_title_files(title_files, start_time=None, end_time=None):
+    """Return the TitleFiles that may contain events in [start_time, end_time).
+
+    Title_files must be sorted by host and session start, as
+    index_window_title_files() returns them.  A session runs from its
+    start to the start of the host's next session.
+
+    """
+    selected = []
+    for index, title_file in enumerate(title_files):
+        if title_file.session_start is None:
+            # We don't know when it ran, so we had better read it.
+            selected.append(title_file)
+            continue
+        if end_time is not None and title_file.session_start >= end_time:
+            continue
+        if start_time is not None and index + 1 < len(title_files):
+            next_file = title_files[index + 1]
+            if next_file.host == title_file.host and \
+               next_file.session_start is not None and \
+               next_file.session_start <= start_time:
+                continue
+        selected.append(title_file)
+    return selected
+
+def get_window_title_filenames(path):
+    """Return a list of all data files participating in gtd window titles.
+    """
+    return [title_file.path for title_file in index_window_title_files(path)]
+
+host_map = {
+    'lorax': 'laptop',
+    'nantes': 'laptop',
+    'birdsong': 'desktop',
+    'starshine': 'laptop',
+    'siegfried': 'desktop'
+}
+def get_host_class(hostname):
+    """Return laptop or desktop.
+    """
+    try:
+        return host_map[hostname]
+    except KeyError:
+        return 'unknown_host_class'
+
+def index_image_files(path, hosts=None, start_time=None, end_time=None,
+                      verbose=True):
+    """Return a list of ImageFile for the window thumbnails in path.
+
+    If hosts is provided, only return images for those hosts.  If
+    start_time or end_time (seconds since the epoch) are provided,
+    only return images in [start_time, end_time).  Unless verbose, we
+    only print the names we fail to parse.
+
+    """
+    image_pattern = re.compile('^([a-z]*)_([0-9]*)\\.[a-z]*$')
+    image_files = []
+    num_parse_errors = 0
+    for name, file_path in list_directory(path):
+        if not name.endswith('png'):
+            continue
+        image_match = image_pattern.match(name)
+        if image_match is None:
+            print('Failed to parse filename: {fn}'.format(fn=file_path))
+            num_parse_errors += 1
+            continue
+        host = image_match.groups()[0]
+        timestamp = int(image_match.groups()[1])
+        if hosts is not None and host not in hosts:
+            continue
+        if start_time is not None and timestamp < start_time:
+            continue
+        if end_time is not None and timestamp >= end_time:
+            continue
+        image_files.append(ImageFile(file_path, host, timestamp))
+    if verbose:
+        print('Got {n} image filenames, {pe} parse errors'.format(
+            n=len(image_files), pe=num_parse_errors))
+    return image_files
+
+def get_image_filenames(path):
+    """Return a list of all image filenames participating in gtd.
+    """
+    return [image_file.path for image_file in index_image_files(path)]
+
+def basic_event_info(host_class, timestamp_int):
+    """Return a dict with basic event info.
+    """
+    bei = {}
+    timestamp = datetime.datetime.fromtimestamp(timestamp_int)
+    bei['timestamp'] = timestamp
+    bei['weekday'] = timestamp.isoweekday()
+    bei['hours'] = timestamp.hour
+    bei['minutes'] = timestamp.hour * 60 + timestamp.minute
+    bei['seconds'] = timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+    bei['date'] = timestamp.date()
+    bei['host_class'] = host_class
+    return bei
+
+def local_utc_offsets(timestamps):
+    """Return an array of local UTC offsets (seconds) at each timestamp.
+
+    Time zone offsets only change on quarter hour boundaries, so we ask
+    the C library once per quarter hour present rather than once per
+    timestamp.
+
+    """
+    quarters, quarter_index = np.unique(np.asarray(timestamps) // 900,
+                                        return_inverse=True)
+    quarter_offsets = np.array(
+        [calendar.timegm(time.localtime(quarter * 900)) - quarter * 900
+         for quarter in quarters.tolist()], dtype=np.int64)
+    return quarter_offsets[quarter_index]
+
+EVENT_INFO_FIELDS = ('timestamp', 'weekday', 'hours', 'minutes', 'seconds', 'date')
+def event_info_arrays(timestamps):
+    """Compute basic_event_info() for an array of timestamps at once.
+
+    Return a dict mapping each of EVENT_INFO_FIELDS to an array with
+    one entry per timestamp.  The timestamp and date arrays are numpy
+    datetime64 (in local time, like basic_event_info()), the others
+    are ints.
+
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    local_seconds = timestamps + local_utc_offsets(timestamps)
+    days, seconds = np.divmod(local_seconds, 86400)
+    return {
+        'timestamp': local_seconds.astype('datetime64[s]'),
+        # 1 January 1970 was a Thursday.
+        'weekday': (days + 3) % 7 + 1,
+        'hours': seconds // 3600,
+        'minutes': seconds // 60,
+        'seconds': seconds,
+        'date': days.astype('datetime64[D]'),
+    }
+
+def calendar_arrays(dates):
+    """Return calendar features of dates, an array of numpy datetime64[D].
+
+    That's a dict of int arrays: day_number (days since 1 January
+    1970), day_of_month, and iso_week (the ISO 8601 week number).
+
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    day_number = dates.astype(np.int64)
+    # ISO weeks start on Monday, and belong to the year of their Thursday.
+    thursdays = day_number - (day_number + 3) % 7 + 3
+    year_starts = thursdays.astype('datetime64[D]').astype('datetime64[Y]') \
+                           .astype('datetime64[D]').astype(np.int64)
+    return {
+        'day_number': day_number,
+        'day_of_month': (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1,
+        'iso_week': (thursdays - year_starts) // 7 + 1,
+    }
+
+NO_VALUE = -1
+EVENT_COLUMNS = ('timestamp', 'host', 'title', 'thumbnail',
+                 'title_label', 'thumbnail_label')
+EVENT_COLUMN_TYPES = {
+    'timestamp': np.int64,
+    'host': np.int32,
+    'title': np.int32,
+    'thumbnail': np.int32,
+    'title_label': np.int32,
+    'thumbnail_label': np.int32,
+}
+STRING_TABLES = ('hosts', 'titles', 'labels', 'thumbnail_filenames')
+# Which string table each coded column indexes.
+COLUMN_TABLES = {
+    'host': 'hosts',
+    'title': 'titles',
+    'thumbnail': 'thumbnail_filenames',
+    'title_label': 'labels',
+    'thumbnail_label': 'labels',
+}
+LABEL_COLUMNS = {
+    'title': 'title_label',
+    'thumbnail': 'thumbnail_label',
+}
+HOST_BITS = 16
+# The parts of GtdStore.index(), and their arrays.
+INDEX_ARRAYS = collections.OrderedDict((
+    ('host', ('host_rows', 'host_offsets', 'host_timestamps')),
+    ('title', ('title_rows', 'title_offsets')),
+    ('title_labeled', ('title_labeled_rows',)),
+    ('thumbnail_labeled', ('thumbnail_labeled_rows',)),
+))
+# The columns whose merges the index follows.
+INDEX_COLUMNS = ('timestamp', 'host', 'title', 'title_label', 'thumbnail_label')
+
+class GtdStore(object):
+    """The events that gtd_read() finds, stored column by column.
+
+    Each event is a row, identified by (hostname, timestamp).  The
+    columns, numpy arrays named in EVENT_COLUMNS, are the timestamp
+    (seconds since the epoch) and codes into the string tables:
+    hosts, titles, labels, and thumbnail_filenames.  A code of
+    NO_VALUE means the event doesn't have that field.  The thumbnail
+    code also indexes histograms, an array of shape (thumbnails, 3,
+    bins) holding the red, green, and blue histograms of each
+    thumbnail, computed as described by histogram_mode.  On disk,
+    histograms are in the order of the events they belong to, as the
+    smallest unsigned integers that hold them; see histogram_matrix().
+
+    Rows are kept sorted by timestamp and then host.  Events added
+    with add_events() are buffered and merged in when next we need
+    the columns; events already present are updated, keeping any field
+    the new event doesn't have.
+
+    Time fields (date, hours, ...) are not stored, since they are
+    cheap to compute from the timestamp with event_info().
+
+    We also keep the number of events with each title, so that the
+    titles in use are a lookup away; see title_counts().
+
+    The heavy fields, histograms and thumbnail_filenames, of a store
+    read from disk are only read when first used, and thumbnails
+    added or merged in are only joined to them then, so that tools
+    that only look at titles never touch them.
+
+    Since rows are in time order, the events of each (local) day are
+    a contiguous run of rows, which we call a partition.  A store
+    read from disk has a catalog of its partitions, partitions, so
+    that days() can select a few days without looking at the rest.
+    Secondary indexes by host, title, and label (see index()) are
+    likewise written with the store, and updated with the events
+    merged in since rather than rebuilt.
+
+    If changes is a GtdStore rather than None, every event added and
+    every field set is also recorded there, so that gtd_dump() need
+    only write what changed since gtd_load().
+
+    For the benefit of code written when gtd_read() returned a dict,
+    a GtdStore also behaves as a read-only dict mapping (hostname,
+    timestamp) to a dict of fields as described in gtd_read().
+
+    """
+
+    def __init__(self):
+        self._lazy = {}
+        self._pending_histograms = []
+        self._pending_thumbnail_filenames = []
+        for name in STRING_TABLES:
+            setattr(self, name, [])
+        for name in EVENT_COLUMNS:
+            setattr(self, name, np.zeros(0, dtype=EVENT_COLUMN_TYPES[name]))
+        self.histograms = None
+        self.histogram_mode = None
+        self.changes = None
+        self.partitions = None
+        self._pending = []
+        self._title_counts = np.zeros(0, dtype=np.int64)
+        self._indexes = None
+        self._index_updates = []
+        self._index_applied = {}
+        self._codes = {}
+        self._keys = None
+
+    def __getattr__(self, name):
+        # Only called for attributes we don't have, such as heavy
+        # fields not loaded yet (see _set_lazy()).
+        lazy = self.__dict__.get('_lazy')
+        if not lazy or name not in lazy:
+            raise AttributeError(name)
+        value = lazy.pop(name)()
+        setattr(self, name, value)
+        return value
+
+    def _set_lazy(self, name, load):
+        """Have the attribute name set to load() when first used.
+        """
+        self.__dict__.pop(name, None)
+        self._lazy[name] = load
+
+    @property
+    def histograms(self):
+        """The (thumbnails, 3, bins) histograms, or None if we have no thumbnails.
+        """
+        if self._pending_histograms:
+            pending = self._pending_histograms
+            if self._histograms is not None:
+                pending = [self._histograms] + pending
+            self._histograms = np.concatenate(pending)
+            self._pending_histograms = []
+        return self._histograms
+
+    @histograms.setter
+    def histograms(self, value):
+        self._histograms = value
+        self._pending_histograms = []
+        self._lazy.pop('_histograms', None)
+
+    @property
+    def thumbnail_filenames(self):
+        """The string table of thumbnail filenames.
+        """
+        if self._pending_thumbnail_filenames:
+            table = self._mutable_table('_thumbnail_filenames')
+            for filenames in self._pending_thumbnail_filenames:
+                table.extend(filenames)
+            self._pending_thumbnail_filenames = []
+        return self._thumbnail_filenames
+
+    @thumbnail_filenames.setter
+    def thumbnail_filenames(self, value):
+        self._thumbnail_filenames = value
+        self._pending_thumbnail_filenames = []
+        self._lazy.pop('_thumbnail_filenames', None)
+
+    def __getstate__(self):
+        self._flush()
+        # Pickles have everything.
+        for name in EVENT_COLUMNS + ('histograms', 'thumbnail_filenames'):
+            setattr(self, name, getattr(self, name))
+        state = dict(self.__dict__)
+        # These are rebuilt as needed.
+        state['_lazy'] = {}
+        state['_indexes'] = None
+        state['_index_updates'] = []
+        state['_index_applied'] = {}
+        state['_codes'] = {}
+        state['_keys'] = None
+        state['changes'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Stores pickled by older versions lack newer attributes, and
+        # have the heavy fields as plain attributes.
+        self.__dict__.update(type(self)().__dict__)
+        self._title_counts = None
+        for name in ('histograms', 'thumbnail_filenames'):
+            if name in state:
+                state['_' + name] = state.pop(name)
+        self.__dict__.update(state)
+
+    def code(self, table_name, value):
+        """Return the code of value in the named string table, adding it if new.
+        """
+        codes = self._codes_of(table_name)
+        value_code = codes.get(value)
+        if value_code is None:
+            value_code = len(codes)
+            codes[value] = value_code
+            self._mutable_table(table_name).append(value)
+        return value_code
+
+    def _mutable_table(self, table_name):
+        """Return the named string table, as a list we may append to.
+
+        Tables loaded from disk are read-only StringTables until then.
+
+        """
+        table = getattr(self, table_name)
+        if not isinstance(table, list):
+            table = list(table)
+            setattr(self, table_name, table)
+        return table
+
+    def _mutable_column(self, name):
+        """Return the named column, as an array we may modify in place.
+
+        Columns loaded from disk are read-only memory maps until then.
+
+        """
+        column = getattr(self, name)
+        if not column.flags.writeable:
+            column = np.array(column)
+            setattr(self, name, column)
+        return column
+
+    def _new_events(self, hostname, timestamps):
+        """Return columns for events of hostname at timestamps with no fields.
+
+        Hostname may also be a parallel list of hostnames.
+
+        """
+        events = {name: np.full(len(timestamps), NO_VALUE, dtype=EVENT_COLUMN_TYPES[name])
+                  for name in EVENT_COLUMNS}
+        events['timestamp'] = np.asarray(timestamps, dtype=np.int64)
+        events['host'][:] = self._host_codes(hostname)
+        return events
+
+    def _host_codes(self, hostname):
+        """Return the code of hostname, or an array of those of a list of hostnames.
+        """
+        if not isinstance(hostname, (list, tuple)):
+            return self.code('hosts', hostname)
+        codes = {}
+        for name in hostname:
+            if name not in codes:
+                codes[name] = self.code('hosts', name)
+        return np.array([codes[name] for name in hostname], dtype=np.int32)
+
+    def _string_codes(self, table_name, values):
+        """Return the codes of values (or NO_VALUE for None) in the named table.
+        """
+        return np.array([NO_VALUE if value is None else self.code(table_name, value)
+                         for value in values], dtype=np.int32)
+
+    def add_events(self, hostname, timestamps, titles=None, labels=None):
+        """Add events for hostname at timestamps.
+
+        Titles, if provided, is a parallel list of window titles (or
+        None).  Labels, if provided, maps a kind of label ('title' or
+        'thumbnail') to a parallel list of labels (or None).
+
+        """
+        if len(timestamps) == 0:
+            return
+        events = self._new_events(hostname, timestamps)
+        if titles is not None:
+            events['title'] = self._string_codes('titles', titles)
+        for kind, kind_labels in (labels or {}).items():
+            events[LABEL_COLUMNS[kind]] = self._string_codes('labels', kind_labels)
+        self._pending.append(events)
+        if self.changes is not None:
+            self.changes.add_events(hostname, timestamps, titles, labels)
+
+    def _flush(self):
+        """Merge pending events into the columns.
+
+        Only the pending events are sorted.  Those we have already
+        update our rows, and the rest are inserted among them, which is
+        an append when, as usual, they are all newer.  The timestamp
+        and host columns are merged now, the others only when first
+        used (see ColumnMerge), so that a column no one looks at is
+        never copied.
+
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        columns = {name: np.concatenate([events[name] for events in pending])
+                   for name in EVENT_COLUMNS}
+        if len(columns['timestamp']) == 0:
+            return
+        keys = event_keys(columns['host'], columns['timestamp'])
+        # A stable sort, so that of events with the same key, the last
+        # added is last.
+        order = np.argsort(keys, kind='mergesort')
+        keys, columns = collapse_duplicates(
+            keys[order], {name: column[order] for name, column in columns.items()})
+        stored_keys = self._stored_keys()
+        if len(stored_keys) == 0 or keys[0] > stored_keys[-1]:
+            positions = np.full(len(keys), len(stored_keys), dtype=np.int64)
+            found = np.zeros(len(keys), dtype=bool)
+        else:
+            positions = np.searchsorted(stored_keys, keys)
+            found = positions < len(stored_keys)
+            found[found] = stored_keys[positions[found]] == keys[found]
+        insert_at = positions[~found]
+        update_rows = positions[found]
+        updated_titles = columns['title'][found]
+        retitled = updated_titles != NO_VALUE
+        previous_titles = None
+        if retitled.any() and (self._title_counts is not None or self._has_indexes()):
+            previous_titles = self.title[update_rows[retitled]]
+
+        counts = self._title_counts
+        if counts is not None:
+            counts = resized_counts(counts, len(self.titles)) + title_bincount(
+                columns['title'][~found], len(self.titles))
+            if previous_titles is not None:
+                counts -= title_bincount(previous_titles, len(counts))
+                counts += title_bincount(updated_titles[retitled], len(counts))
+
+        if len(stored_keys) == 0:
+            # A new store, with nothing to merge into.
+            for name in EVENT_COLUMNS:
+                self._lazy.pop(name, None)
+                setattr(self, name, columns[name])
+        else:
+            for name in EVENT_COLUMNS[:2]:
+                setattr(self, name, np.insert(getattr(self, name), insert_at,
+                                              columns[name][~found]))
+            for name in EVENT_COLUMNS[2:]:
+                merge = self._lazy.get(name)
+                if not isinstance(merge, ColumnMerge):
+                    merge = ColumnMerge(merge or functools.partial(np.asarray,
+                                                                   getattr(self, name)))
+                self._set_lazy(name, merge.then(insert_at, columns[name][~found],
+                                                update_rows, columns[name][found]))
+        self._note_index_update({
+            'insert_at': insert_at,
+            'inserted': {name: columns[name][~found] for name in INDEX_COLUMNS},
+            'update_rows': update_rows,
+            'updated': {name: columns[name][found] for name in INDEX_COLUMNS[2:]},
+            'previous_titles': previous_titles,
+        })
+        self._keys = np.insert(stored_keys, insert_at, keys[~found])
+        self._title_counts = counts
+        self.partitions = None
+
+    def title_counts(self):
+        """Return the number of events with each title, parallel to titles.
+
+        The counts are kept up to date as events are added and merged,
+        and written with the store, so this rarely costs more than a
+        lookup.
+
+        """
+        self._flush()
+        if self._title_counts is None:
+            self._title_counts = title_bincount(self.title, len(self.titles))
+        elif len(self._title_counts) < len(self.titles):
+            self._title_counts = resized_counts(self._title_counts, len(self.titles))
+        return self._title_counts
+
+    def _drop_indexes(self):
+        """Forget the secondary indexes, which no longer match the rows.
+        """
+        self._lazy.pop('_indexes', None)
+        self._indexes = None
+        self._index_updates = []
+        self._index_applied = {}
+
+    def _has_indexes(self):
+        """Return true if we have secondary indexes, loaded or not.
+        """
+        return self.__dict__.get('_indexes') is not None or '_indexes' in self._lazy
+
+    def _note_index_update(self, update):
+        """Note an update of the rows, to apply to the secondary indexes.
+
+        Update is a dict, as _flush() makes.  We only note updates if
+        there are indexes to apply them to; see index().
+
+        """
+        if self._has_indexes():
+            self._index_updates.append(update)
+
+    def _note_label(self, kind, row):
+        """Note that the event at row now has a label of kind, as _note_index_update() does.
+
+        Labels set one after the other (by join_labels(), say) are
+        noted as one update.
+
+        """
+        if not self._has_indexes():
+            return
+        updates = self._index_updates
+        if not updates or 'labeled' not in updates[-1] or \
+           len(updates) in self._index_applied.values():
+            updates.append({'labeled': {name: [] for name in LABEL_COLUMNS.values()}})
+        updates[-1]['labeled'][LABEL_COLUMNS[kind]].append(row)
+
+    def index(self, parts=None):
+        """Return the secondary indexes of the store, bringing them up to date.
+
+        That's a dict of arrays.  host_rows holds the rows of each
+        host's events in time order, host by host, those of host code
+        starting at host_offsets[code] and ending at
+        host_offsets[code + 1], and host_timestamps holds their
+        timestamps, so that each host's are sorted.  title_rows and
+        title_offsets are the same by title.  title_labeled_rows and
+        thumbnail_labeled_rows are the rows of the events with each
+        kind of label.
+
+        Parts, a list of keys of INDEX_ARRAYS, says which of those we
+        need (by default, all), and only they are brought up to date.
+        Indexes read with the store are updated with the events merged
+        since (see _note_index_update()), which costs about as much as
+        those events, and the rest are built from scratch.
+
+        """
+        self._flush()
+        if self._indexes is None:
+            self._indexes = {}
+        index = self._indexes
+        updates = self._index_updates
+        for part in INDEX_ARRAYS if parts is None else parts:
+            if INDEX_ARRAYS[part][0] not in index:
+                index.update(self._built_index(part))
+            else:
+                for update in updates[self._index_applied.get(part, 0):]:
+                    index.update(self._updated_index(part, update))
+            self._index_applied[part] = len(updates)
+        if all(self._index_applied.get(part, 0) == len(updates)
+               for part, names in INDEX_ARRAYS.items() if names[0] in index):
+            self._index_updates = []
+            self._index_applied = {}
+        return index
+
+    def _built_index(self, part):
+        """Return the arrays of part (a key of INDEX_ARRAYS) of index(), built from scratch.
+        """
+        if part == 'host':
+            rows, offsets = code_index(self.host, title_bincount(self.host, len(self.hosts)))
+            return {'host_rows': rows, 'host_offsets': offsets,
+                    'host_timestamps': self.timestamp[rows]}
+        if part == 'title':
+            rows, offsets = code_index(self.title, self.title_counts())
+            return {'title_rows': rows, 'title_offsets': offsets}
+        kind = part[:-len('_labeled')]
+        return {part + '_rows': np.flatnonzero(getattr(self, LABEL_COLUMNS[kind]) != NO_VALUE)}
+
+    def _updated_index(self, part, update):
+        """Return the arrays of part of index() with update (see _note_index_update()) applied.
+        """
+        index = self._indexes
+        if 'labeled' in update:
+            if part in ('host', 'title'):
+                return {}
+            rows = update['labeled'][LABEL_COLUMNS[part[:-len('_labeled')]]]
+            return {part + '_rows': np.union1d(index[part + '_rows'], rows)}
+        insert_at = update['insert_at']
+        renumbered = functools.partial(shifted_rows, insert_at=insert_at)
+        inserted_rows = insert_at + np.arange(len(insert_at))
+        update_rows = renumbered(update['update_rows'])
+        inserted = update['inserted']
+        if part == 'host':
+            rows, offsets, positions, order = code_index_inserted(
+                renumbered(index['host_rows']), index['host_offsets'], len(self.hosts),
+                inserted['host'], inserted_rows)
+            timestamps = np.insert(index['host_timestamps'], positions,
+                                   inserted['timestamp'][order])
+            return {'host_rows': rows, 'host_offsets': offsets,
+                    'host_timestamps': timestamps}
+        if part == 'title':
+            rows, offsets = renumbered(index['title_rows']), index['title_offsets']
+            updated_titles = update['updated']['title']
+            retitled = updated_titles != NO_VALUE
+            if update['previous_titles'] is not None:
+                had_title = update['previous_titles'] != NO_VALUE
+                rows, offsets = code_index_removed(
+                    rows, offsets, update['previous_titles'][had_title],
+                    update_rows[retitled][had_title])
+            rows, offsets, _, _ = code_index_inserted(
+                rows, offsets, len(self.titles),
+                np.concatenate((inserted['title'], updated_titles[retitled])),
+                np.concatenate((inserted_rows, update_rows[retitled])))
+            return {'title_rows': rows, 'title_offsets': offsets}
+        name = LABEL_COLUMNS[part[:-len('_labeled')]]
+        labeled = np.concatenate((inserted_rows[inserted[name] != NO_VALUE],
+                                  update_rows[update['updated'][name] != NO_VALUE]))
+        return {part + '_rows': np.union1d(renumbered(index[part + '_rows']), labeled)}
+
+    def rows_of(self, name, codes):
+        """Return the rows, in order, of the events whose column name is one of codes.
+
+        Name is 'host' or 'title'.  This is a lookup in index().
+
+        """
+        index = self.index([name])
+        rows, offsets = index[name + '_rows'], index[name + '_offsets']
+        # Codes too new to be in the index have no events.
+        pieces = [rows[offsets[code]:offsets[code + 1]] for code in codes
+                  if 0 <= code < len(offsets) - 1]
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(pieces))
+
+    def host_rows(self, hostname, first_timestamp=None, last_timestamp=None):
+        """Return the rows, in order, of the events of hostname.
+
+        If first_timestamp or last_timestamp is given, only those from
+        first_timestamp to last_timestamp (included), found by binary
+        search of the host's timestamps.  The rows are a view of the
+        index.
+
+        """
+        index = self.index(['host'])
+        offsets = index['host_offsets']
+        host_code = self._codes_of('hosts').get(hostname)
+        if host_code is None or host_code >= len(offsets) - 1:
+            return np.zeros(0, dtype=np.int64)
+        first, last = offsets[host_code], offsets[host_code + 1]
+        timestamps = index['host_timestamps'][first:last]
+        start, stop = 0, len(timestamps)
+        if first_timestamp is not None:
+            start = np.searchsorted(timestamps, first_timestamp)
+        if last_timestamp is not None:
+            stop = np.searchsorted(timestamps, last_timestamp, side='right')
+        return index['host_rows'][first + start:first + max(start, stop)]
+
+    def rows_between(self, start=None, end=None):
+        """Return the slice of rows of the events from start (included) to end (excluded).
+
+        Start and end are local times, anything numpy.datetime64
+        accepts, or seconds since the epoch; None means no limit.
+        Rows are in time order, so that's two binary searches.
+
+        """
+        self._flush()
+        first, stop = 0, len(self.timestamp)
+        if start is not None:
+            first = np.searchsorted(self.timestamp, local_timestamp(start))
+        if end is not None:
+            stop = np.searchsorted(self.timestamp, local_timestamp(end))
+        return slice(int(first), int(max(first, stop)))
+
+    def events_between(self, start=None, end=None, hosts=None):
+        """Return a GtdStore (see subset()) of the events from start to end.
+
+        Start and end are as for rows_between().  If hosts is given,
+        only the events of those hosts, found in the index of each
+        host's timestamps.  Otherwise (or for a single host) the
+        selection costs two binary searches, and the columns are views
+        of ours, not copies, however many years they span.
+
+        """
+        rows = self.rows_between(start, end)
+        if hosts is not None:
+            first_timestamp = None if start is None else local_timestamp(start)
+            last_timestamp = None if end is None else local_timestamp(end) - 1
+            pieces = [self.host_rows(hostname, first_timestamp, last_timestamp)
+                      for hostname in hosts]
+            if len(pieces) == 1:
+                rows = pieces[0]
+                if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+                    # Contiguous, so a slice will do.
+                    rows = slice(int(rows[0]), int(rows[-1]) + 1)
+            else:
+                rows = np.sort(np.concatenate(pieces)) if pieces else \
+                    np.zeros(0, dtype=np.int64)
+        return self.subset(rows)
+
+    def labeled_rows(self, kind=None):
+        """Return the rows, in order, of the events with a label of kind.
+
+        Kind is 'title' or 'thumbnail', or None for either.
+
+        """
+        if kind is not None:
+            return self.index([kind + '_labeled'])[kind + '_labeled_rows']
+        index = self.index(['title_labeled', 'thumbnail_labeled'])
+        return np.union1d(index['title_labeled_rows'], index['thumbnail_labeled_rows'])
+
+    def used_titles(self):
+        """Return the titles some event has, each once, and their title_counts().
+        """
+        counts = self.title_counts()
+        used = np.flatnonzero(counts)
+        return [self.titles[code] for code in used], counts[used]
+
+    def keys_array(self):
+        """Return the sorted array of event keys (see event_keys()).
+        """
+        self._flush()
+        return self._stored_keys()
+
+    def _stored_keys(self):
+        """Return the keys of the rows we have, leaving pending events pending.
+        """
+        if self._keys is None:
+            self._keys = event_keys(self.host, self.timestamp)
+        return self._keys
+
+    def find_rows(self, hostname, timestamps):
+        """Return the rows of the events for hostname at timestamps.
+
+        Events we don't have are NO_VALUE.
+
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        host_code = self._codes_of('hosts').get(hostname)
+        if host_code is None:
+            return np.full(len(timestamps), NO_VALUE, dtype=np.int64)
+        return self._find_keys(event_keys(host_code, timestamps))
+
+    def _find_keys(self, keys):
+        """Return the rows of the events with keys (see event_keys()), or NO_VALUE.
+        """
+        rows = np.full(len(keys), NO_VALUE, dtype=np.int64)
+        all_keys = self.keys_array()
+        if len(all_keys) == 0:
+            return rows
+        positions = np.searchsorted(all_keys, keys)
+        positions = np.minimum(positions, len(all_keys) - 1)
+        found = all_keys[positions] == keys
+        rows[found] = positions[found]
+        return rows
+
+    def _has_keys(self, keys):
+        """Return whether we have events with keys (see event_keys()), pending or not.
+
+        Unlike _find_keys(), this doesn't flush.
+
+        """
+        stored_keys = self._stored_keys()
+        found = np.zeros(len(keys), dtype=bool)
+        if len(stored_keys):
+            positions = np.searchsorted(stored_keys, keys)
+            found = stored_keys[np.minimum(positions, len(stored_keys) - 1)] == keys
+        if self._pending:
+            found |= np.isin(keys, np.concatenate(
+                [event_keys(events['host'], events['timestamp'])
+                 for events in self._pending]))
+        return found
+
+    def _codes_of(self, table_name):
+        """Return the dict from value to code for the named string table.
+        """
+        if table_name not in self._codes:
+            table = getattr(self, table_name)
+            self._codes[table_name] = dict(zip(table, range(len(table))))
+        return self._codes[table_name]
+
+    def add_thumbnails(self, hostname, timestamps, filenames, histograms, mode):
+        """Attach thumbnails to the events of hostname at timestamps.
+
+        Hostname may also be a parallel list of hostnames, so that the
+        thumbnails of several hosts are looked up in one go.
+        Histograms is a parallel list of (red, green, blue) triples
+        computed as described by mode, which must be the same for all
+        thumbnails in the store.
+
+        A thumbnail goes with the event at its timestamp or, failing
+        that, the second before: the snapshot may have happened a
+        smidgeon after the window label was recorded.  This race
+        condition can no longer happen, but it used to be able to
+        happen.  Otherwise it becomes an event of its own.
+
+        Return the number of thumbnails found at first, at -1, and
+        missed.
+
+        Like add_events(), this only adds pending events, so it costs
+        the same however many events we have.
+
+        """
+        num_images = len(timestamps)
+        if num_images == 0:
+            return 0, 0, 0
+        stacked = np.array([np.ravel(hist) for triple in histograms for hist in triple],
+                           dtype=np.float32).reshape(num_images, 3, -1)
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        keys = event_keys(self._host_codes(hostname), timestamps)
+        found = self._has_keys(keys)
+        # The key of the same host a second earlier.
+        found_minus = ~found & self._has_keys(keys - (1 << HOST_BITS))
+        missed = ~found & ~found_minus
+        # Pending events, which the next flush merges into those they
+        # go with, if any.
+        attached_timestamps = timestamps - found_minus
+        self._add_thumbnail_events(hostname, attached_timestamps, filenames, stacked, mode)
+        if self.changes is not None:
+            self.changes._add_thumbnail_events(hostname, attached_timestamps,
+                                               filenames, stacked, mode)
+        return found.sum(), found_minus.sum(), missed.sum()
+
+    def _add_thumbnail_data(self, filenames, stacked, mode):
+        """Add thumbnail filenames and their (thumbnails, 3, bins) histograms.
+
+        Return their thumbnail codes.
+
+        """
+        # Callers check the mode up front (see store_histogram_mode()).
+        assert self.histogram_mode in (None, mode), (self.histogram_mode, mode)
+        self.histogram_mode = mode
+        first_thumbnail = len(self._thumbnail_filenames) + sum(
+            len(pending) for pending in self._pending_thumbnail_filenames)
+        self._pending_histograms.append(stacked)
+        self._pending_thumbnail_filenames.append(list(filenames))
+        return np.arange(first_thumbnail, first_thumbnail + len(filenames),
+                         dtype=np.int32)
+
+    def _add_thumbnail_events(self, hostname, timestamps, filenames, stacked, mode):
+        """Add events of hostname at timestamps having just these thumbnails.
+        """
+        events = self._new_events(hostname, timestamps)
+        events['thumbnail'] = self._add_thumbnail_data(filenames, stacked, mode)
+        self._pending.append(events)
+
+    def merge(self, other):
+        """Add the events of another GtdStore to this one.
+
+        As with add_events(), fields of other's events win over ours.
+
+        """
+        other._flush()
+        if len(other.timestamp) == 0:
+            return
+        events = {'timestamp': other.timestamp}
+        for name in EVENT_COLUMNS[1:]:
+            # Only the strings other's events use, since other may be a
+            # few days of a store with years of strings.
+            column = getattr(other, name)
+            used, translate = code_translation(column)
+            table_name = COLUMN_TABLES[name]
+            table = getattr(other, table_name) if len(used) else None
+            if len(used) == 0:
+                pass
+            elif table_name == 'thumbnail_filenames':
+                translate[used] = self._add_thumbnail_data(
+                    [table[code] for code in used], np.asarray(other.histograms[used]),
+                    other.histogram_mode)
+            else:
+                translate[used] = self._string_codes(
+                    table_name, [table[code] for code in used])
+            events[name] = translate[column]
+        self._pending.append(events)
+
+    def set_label(self, key, kind, label):
+        """Set the label of kind 'title' or 'thumbnail' of the event at key.
+        """
+        hostname, timestamp = key
+        row = self.find_rows(hostname, [timestamp])[0]
+        if row == NO_VALUE:
+            raise KeyError(key)
+        self._mutable_column(LABEL_COLUMNS[kind])[row] = self.code('labels', label)
+        self._note_label(kind, row)
+        if self.changes is not None:
+            self.changes.add_events(hostname, [timestamp], labels={kind: [label]})
+
+    def join_labels(self, records):
+        """Set the labels of records made by gtd_save_label(), oldest first.
+
+        They are not noted as changes, since they are saved already.
+        Labels of events we don't have are ignored.
+
+        """
+        changes, self.changes = self.changes, None
+        try:
+            for record in records:
+                try:
+                    self.set_label((record['host'], record['timestamp']),
+                                   record['kind'], record['label'])
+                except KeyError:
+                    pass
+        finally:
+            self.changes = changes
+
+    def subset(self, rows):
+        """Return a GtdStore of the events at rows (indices or a mask).
+
+        The string tables and histograms are shared with this store.
+
+        """
+        self._flush()
+        columns = {name: getattr(self, name)[rows] for name in EVENT_COLUMNS}
+        selection = GtdStore()
+        selection.__dict__.update(self.__dict__)
+        selection._pending = []
+        selection._title_counts = None
+        selection._pending_histograms = list(self._pending_histograms)
+        selection._pending_thumbnail_filenames = list(self._pending_thumbnail_filenames)
+        selection._lazy = dict(self._lazy)
+        for name in selection._lazy:
+            del selection.__dict__[name]
+        selection._drop_indexes()
+        selection._codes = {}
+        selection._keys = None
+        selection.changes = None
+        selection.partitions = None
+        for name, column in columns.items():
+            setattr(selection, name, column)
+        return selection
+
+    def days(self, first_day=None, last_day=None):
+        """Return a GtdStore (see subset()) of the events from first_day to last_day.
+
+        Days are local dates, as numpy datetime64[D] (or anything that
+        converts to one), and both are included.  None means no limit.
+        With a partition catalog, only the rows of those days are
+        touched.
+
+        """
+        self._flush()
+        first_day, last_day = day_range(first_day, last_day)
+        rows = slice(None)
+        if self.partitions is not None:
+            rows = partition_rows(self.partitions, first_day, last_day)
+        selection = self.subset(rows)
+        dates = selection.event_info()['date']
+        in_range = (dates >= first_day) & (dates <= last_day)
+        if in_range.all():
+            return selection
+        return selection.subset(in_range)
+
+    def partition_catalog(self):
+        """Return the partition catalog of the store.
+
+        That's a dict of parallel arrays: the days (datetime64[D]) and
+        the start and stop rows of their events.  Local dates aren't
+        quite monotonic in time (a change to or from summer time can
+        happen at midnight), so the events of a day are within its
+        rows, but not all the events in its rows need be of that day.
+
+        """
+        self._flush()
+        dates = self.event_info()['date']
+        days, starts = np.unique(dates, return_index=True)
+        _, stops_reversed = np.unique(dates[::-1], return_index=True)
+        return {'days': days,
+                'starts': starts.astype(np.int64),
+                'stops': (len(dates) - stops_reversed).astype(np.int64)}
+
+    def day_catalog(self, days):
+        """Return a partition catalog (see partition_catalog()) of just days.
+
+        Days are local dates, as for days().  Each day's rows are found
+        by binary search for its local midnights, so the cost doesn't
+        depend on how much history we have.  Days without events are
+        left out.
+
+        """
+        self._flush()
+        days = np.unique(np.asarray(days, dtype='datetime64[D]'))
+        starts = np.searchsorted(self.timestamp, [local_timestamp(day) for day in days])
+        stops = np.searchsorted(self.timestamp, [local_timestamp(day + 1) for day in days])
+        has_events = stops > starts
+        return {'days': days[has_events],
+                'starts': starts[has_events].astype(np.int64),
+                'stops': stops[has_events].astype(np.int64)}
+
+    def histogram_matrix(self):
+        """Return the rows of the events with thumbnails and their histograms.
+
+        The histograms are an array of shape (len(rows), 3, bins), in
+        the same order as rows.  For a store read from disk, that's
+        the memory-mapped array itself, nothing is copied, and titles
+        and such are not read.
+
+        """
+        self._flush()
+        rows = np.flatnonzero(self.thumbnail != NO_VALUE)
+        if self.histograms is None:
+            return rows, np.zeros((0, 3, 0), dtype=np.float32)
+        codes = self.thumbnail[rows]
+        if len(codes) == len(self.histograms) and \
+           np.array_equal(codes, np.arange(len(codes))):
+            return rows, self.histograms
+        return rows, self.histograms[codes]
+
+    def event_info(self, rows=slice(None)):
+        """Return event_info_arrays() for the events at rows.
+        """
+        self._flush()
+        return event_info_arrays(self.timestamp[rows])
+
+    def event(self, row, info=None, histograms=True):
+        """Return the event at row as a dict, as described in gtd_read().
+
+        Info, if provided, is a dict of the event's time fields.  If
+        not histograms, the event has no histograms, which then needn't
+        be loaded.
+
+        """
+        if info is None:
+            info = basic_event_info(None, int(self.timestamp[row]))
+        event = dict(info)
+        event['host_class'] = get_host_class(self.hosts[self.host[row]])
+        for name, field in (('title', 'window_title'),
+                            ('thumbnail', 'window_thumbnail_filename'),
+                            ('title_label', 'ground_truth_window_title_label'),
+                            ('thumbnail_label', 'ground_truth_window_thumbnail_label')):
+            value_code = getattr(self, name)[row]
+            if value_code != NO_VALUE:
+                event[field] = getattr(self, COLUMN_TABLES[name])[value_code]
+        thumbnail = self.thumbnail[row]
+        if thumbnail != NO_VALUE and histograms:
+            # As float32 and of shape (bins, 1), as cv2.calcHist() gives them.
+            histograms = self.histograms[thumbnail].astype(np.float32)[:, :, np.newaxis]
+            event['red_histogram'] = histograms[0]
+            event['green_histogram'] = histograms[1]
+            event['blue_histogram'] = histograms[2]
+            event['histogram_mode'] = self.histogram_mode
+        return event
+
+    def iteritems(self):
+        """Yield ((hostname, timestamp), event dict) for each event.
+        """
+        self._flush()
+        batch = 1 << 16
+        for start in range(0, len(self.timestamp), batch):
+            rows = slice(start, start + batch)
+            info = self.event_info(rows)
+            # tolist() gives us datetime.datetime, datetime.date and int.
+            info_columns = [info[name].tolist() for name in EVENT_INFO_FIELDS]
+            for offset, info_row in enumerate(zip(*info_columns)):
+                row = start + offset
+                yield ((self.hosts[self.host[row]], int(self.timestamp[row])),
+                       self.event(row, zip(EVENT_INFO_FIELDS, info_row)))
+
+    def iterkeys(self):
+        """Yield (hostname, timestamp) for each event.
+        """
+        self._flush()
+        for host, timestamp in zip(self.host.tolist(), self.timestamp.tolist()):
+            yield (self.hosts[host], timestamp)
+
+    def itervalues(self):
+        """Yield the event dict of each event.
+        """
+        for _, event in self.iteritems():
+            yield event
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        self._flush()
+        return len(self.timestamp)
+
+    def __contains__(self, key):
+        return self.find_rows(key[0], [key[1]])[0] != NO_VALUE
+
+    def __getitem__(self, key):
+        row = self.find_rows(key[0], [key[1]])[0]
+        if row == NO_VALUE:
+            raise KeyError(key)
+        return self.event(row)
+
+    def write(self, directory, codec=None, level=None):
+        """Write the store to directory (see lib_gtd_store), which must not exist.
+
+        If codec is given, the arrays are compressed with it at level.
+
+        """
+        self._flush()
+        arrays = {name: getattr(self, name) for name in EVENT_COLUMNS}
+        arrays['title_counts'] = self.title_counts()
+        for name, array in self.index().items():
+            arrays['index_' + name] = array
+        thumbnail_filenames = self.thumbnail_filenames
+        if self.histograms is not None:
+            # Number thumbnails in event order, dropping any no event has.
+            rows, histograms = self.histogram_matrix()
+            if histograms is not self.histograms:
+                thumbnail_filenames = [self.thumbnail_filenames[code]
+                                       for code in self.thumbnail[rows]]
+                arrays['thumbnail'] = np.array(self.thumbnail)
+                arrays['thumbnail'][rows] = np.arange(len(rows))
+            arrays['histograms'] = lib_gtd_store.compact_counts(histograms)
+        partitions = self.partition_catalog()
+        for name, array in partitions.items():
+            arrays['partition_' + name] = array
+        days = partitions['days'].astype(datetime.date).tolist()
+        lib_gtd_store.write_arrays(
+            directory, arrays,
+            dict({name: getattr(self, name) for name in STRING_TABLES},
+                 thumbnail_filenames=thumbnail_filenames),
+            {'num_events': len(self.timestamp),
+             'histogram_mode': self.histogram_mode,
+             'first_day': days[0].isoformat() if days else None,
+             'last_day': days[-1].isoformat() if days else None},
+            codec, level, delta=('timestamp', 'partition_starts', 'partition_stops'))
+
+    @classmethod
+    def read(cls, directory, mmap=True, first_day=None, last_day=None):
+        """Return the GtdStore written to directory by write().
+
+        If mmap, the arrays are memory mapped rather than read (unless
+        compressed).
+
+        If first_day or last_day is given, we only read the partitions
+        holding those days, and the histograms and thumbnail filenames
+        of their events.  The store may still have events of other
+        days; see days().
+
+        The histograms and thumbnail filenames are only read when first
+        used, though their files are opened now, in case compaction
+        removes the segment meanwhile.
+
+        """
+        reader = lib_gtd_store.StoreReader(directory, mmap)
+        header = reader.header
+        rows = slice(None)
+        if (first_day is not None or last_day is not None) and \
+           'partition_days' in header['arrays']:
+            partitions = {name: reader.array('partition_' + name)
+                          for name in ('days', 'starts', 'stops')}
+            rows = partition_rows(partitions, *day_range(first_day, last_day))
+        store = cls()
+        for name in EVENT_COLUMNS:
+            setattr(store, name, reader.array(name, rows.start, rows.stop))
+        for name in ('hosts', 'titles', 'labels'):
+            setattr(store, name, reader.table(name))
+        reader.hold('thumbnail_filenames')
+        store._set_lazy('_thumbnail_filenames',
+                        functools.partial(reader.table, 'thumbnail_filenames'))
+        store.histogram_mode = header['histogram_mode']
+        if 'histograms' in header['arrays']:
+            reader.hold('histograms')
+            if rows == slice(None):
+                store._set_lazy('_histograms', functools.partial(reader.array, 'histograms'))
+            else:
+                # Thumbnails are numbered in event order, so those of
+                # these rows are a range.
+                has_thumbnail = store.thumbnail != NO_VALUE
+                codes = store.thumbnail[has_thumbnail]
+                start = int(codes.min()) if len(codes) else 0
+                stop = int(codes.max()) + 1 if len(codes) else 0
+                store._set_lazy('_histograms', functools.partial(
+                    reader.array, 'histograms', start, stop))
+                store._set_lazy('_thumbnail_filenames', functools.partial(
+                    reader.table, 'thumbnail_filenames', start, stop))
+                store.thumbnail = np.where(has_thumbnail, store.thumbnail - start,
+                                           store.thumbnail).astype(np.int32)
+        if rows == slice(None) and 'partition_days' in header['arrays']:
+            store.partitions = {name: reader.array('partition_' + name)
+                                for name in ('days', 'starts', 'stops')}
+        store._title_counts = None
+        if rows == slice(None) and 'title_counts' in header['arrays']:
+            store._title_counts = reader.array('title_counts')
+        index_names = [name for name in header['arrays'] if name.startswith('index_')]
+        store._indexes = None
+        if rows == slice(None) and index_names:
+            reader.hold(*index_names)
+            store._set_lazy('_indexes', lambda: {
+                name[len('index_'):]: reader.array(name) for name in index_names})
+        return store
+
+    @classmethod
+    def read_segments(cls, directories, mmap=True, first_day=None, last_day=None):
+        """Return the GtdStore of segments written by write(), oldest first.
+
+        Events in later segments update those in earlier ones.  The
+        first segment, usually by far the largest, is memory mapped if
+        mmap; the others are merged into it when we first need the
+        columns.
+
+        If first_day or last_day is given, only the events of those
+        days are read (see days()), and merged into a new store.
+
+        """
+        if first_day is None and last_day is None:
+            if not directories:
+                return cls()
+            store = cls.read(directories[0], mmap)
+            for directory in directories[1:]:
+                store.merge(cls.read(directory, mmap))
+            return store
+        selections = [cls.read(directory, mmap, first_day, last_day)
+                      .days(first_day, last_day) for directory in directories]
+        if len(selections) == 1:
+            return selections[0]
+        store = cls()
+        for selection in selections:
+            store.merge(selection)
+        return store
+
+    def write_hdf5(self, filename):
+        """Write the store to a new HDF5 file filename (see lib_gtd_store).
+
+        Histograms are stored as uint32, since later refreshes append
+        to them in place.
+
+        """
+        self._flush()
+        with lib_gtd_store.hdf5_open(filename, 'w') as h5_file:
+            h5_file.attrs['format_version'] = lib_gtd_store.FORMAT_VERSION
+            h5_file.attrs['histogram_mode'] = self.histogram_mode or ''
+            for name in EVENT_COLUMNS:
+                lib_gtd_store.hdf5_create(h5_file, name, getattr(self, name))
+            for name in STRING_TABLES:
+                lib_gtd_store.hdf5_create_strings(h5_file, name, getattr(self, name))
+            if self.histograms is not None:
+                lib_gtd_store.hdf5_create(h5_file, 'histograms',
+                                          self.histograms.astype(np.uint32))
+
+    @classmethod
+    def read_hdf5(cls, filename, first_day=None, last_day=None):
+        """Return the GtdStore in the HDF5 file filename, written by write_hdf5().
+
+        If first_day or last_day is given, we only read the rows of
+        events near those days (found by bisecting the timestamps), and
+        the thumbnails of those events.  The store may still have
+        events of other days; see days().
+
+        The histograms and thumbnail filenames are only read when first
+        used.  hdf5_apply_changes() only appends thumbnails, so they
+        are still where we expect them then.  It also appends titles
+        and labels the file may have already, and we merge the copies.
+
+        """
+        store = cls()
+        # Computed when first asked for.
+        store._title_counts = None
+        with lib_gtd_store.hdf5_open(filename) as h5_file:
+            rows = slice(None)
+            if first_day is not None or last_day is not None:
+                first_timestamp, last_timestamp = day_timestamps(first_day, last_day)
+                rows = slice(
+                    lib_gtd_store.hdf5_bisect(h5_file['timestamp'], first_timestamp),
+                    lib_gtd_store.hdf5_bisect(h5_file['timestamp'], last_timestamp + 1))
+            for name in EVENT_COLUMNS:
+                setattr(store, name, h5_file[name][rows])
+            for name in ('hosts', 'titles', 'labels'):
+                setattr(store, name, lib_gtd_store.hdf5_read_strings(h5_file[name]))
+            store.histogram_mode = h5_file.attrs['histogram_mode'] or None
+            has_histograms = 'histograms' in h5_file
+        for table_name in ('titles', 'labels'):
+            table, translate = deduplicated_strings(getattr(store, table_name))
+            if translate is None:
+                continue
+            setattr(store, table_name, table)
+            for name in EVENT_COLUMNS[2:]:
+                if COLUMN_TABLES[name] == table_name:
+                    setattr(store, name, translate[getattr(store, name)])
+        codes = None
+        if rows != slice(None):
+            # Just the thumbnails of these rows, renumbered.
+            has_thumbnail = store.thumbnail != NO_VALUE
+            codes = np.unique(store.thumbnail[has_thumbnail])
+            store.thumbnail[has_thumbnail] = np.searchsorted(
+                codes, store.thumbnail[has_thumbnail])
+        store._set_lazy('_thumbnail_filenames', functools.partial(
+            lib_gtd_store.hdf5_read, filename, 'thumbnail_filenames', codes))
+        if has_histograms:
+            store._set_lazy('_histograms', functools.partial(
+                lib_gtd_store.hdf5_read, filename, 'histograms', codes))
+        return store
+
+    @classmethod
+    def from_dict(cls, gtd_data):
+        """Return a GtdStore of the events in a dict made by an older gtd_read().
+        """
+        store = cls()
+        by_host = {}
+        for (hostname, timestamp), event in gtd_data.items():
+            by_host.setdefault(hostname, []).append((timestamp, event))
+        for hostname, events in by_host.items():
+            store.add_events(hostname, [timestamp for timestamp, _ in events],
+                             [event.get('window_title') for _, event in events])
+        for hostname, events in by_host.items():
+            with_thumbnail = [(timestamp, event) for timestamp, event in events
+                              if 'red_histogram' in event]
+            for mode in set(event.get('histogram_mode', FULL_HISTOGRAM_MODE)
+                            for _, event in with_thumbnail):
+                in_mode = [(timestamp, event) for timestamp, event in with_thumbnail
+                           if event.get('histogram_mode', FULL_HISTOGRAM_MODE) == mode]
+                store.add_thumbnails(
+                    hostname, [timestamp for timestamp, _ in in_mode],
+                    [event['window_thumbnail_filename'] for _, event in in_mode],
+                    [(event['red_histogram'], event['green_histogram'],
+                      event['blue_histogram']) for _, event in in_mode],
+                    mode)
+            for timestamp, event in events:
+                for kind in LABEL_COLUMNS:
+                    field = 'ground_truth_window_{kind}_label'.format(kind=kind)
+                    if field in event:
+                        store.set_label((hostname, timestamp), kind, event[field])
+        return store
+
+def deduplicated_strings(strings):
+    """Return the list strings with each string once, and how codes translate.
+
+    That's an array mapping each code of strings, and NO_VALUE, to the
+    code of the same string in the new list, or None if strings had
+    no duplicates (and is returned as it is).
+
+    """
+    codes = {}
+    unique = []
+    translate = np.empty(len(strings) + 1, dtype=np.int32)
+    for index, value in enumerate(strings):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(unique)
+            unique.append(value)
+        translate[index] = code
+    if len(unique) == len(strings):
+        return strings, None
+    # So that NO_VALUE (-1) translates to NO_VALUE.
+    translate[-1] = NO_VALUE
+    return unique, translate
+
+def code_translation(*columns):
+    """Return the codes columns use, sorted, and a table to translate them.
+
+    The table maps each code to NO_VALUE until the caller fills in
+    those used.  It is sized by the codes used rather than by the
+    string table, which then needn't be loaded if none are, and has
+    one more entry, so that NO_VALUE (-1) translates to NO_VALUE.
+
+    """
+    used = np.unique(np.concatenate(columns))
+    used = used[used != NO_VALUE]
+    translate = np.full((int(used[-1]) + 1 if len(used) else 0) + 1,
+                        NO_VALUE, dtype=np.int32)
+    return used, translate
+
+def title_bincount(codes, size):
+    """Return how many of the title codes are each of range(size).
+    """
+    codes = np.asarray(codes)
+    return np.bincount(codes[codes != NO_VALUE], minlength=size).astype(np.int64)
+
+def code_index(column, counts):
+    """Return the rows of column grouped by code, and where each code's start.
+
+    Counts is the number of rows with each code.  Within a code, rows
+    are in order.
+
+    """
+    has_code = np.flatnonzero(column != NO_VALUE)
+    rows = has_code[np.argsort(column[has_code], kind='mergesort')]
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return rows.astype(np.int64), offsets
+
+def code_index_positions(rows, offsets, codes, new_rows):
+    """Return where (code, row) pairs go among the rows of a code_index().
+
+    Codes and new_rows are parallel, sorted by code and then row.
+
+    """
+    positions = np.zeros(len(codes), dtype=np.int64)
+    if len(codes) == 0:
+        return positions
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    stops = np.append(starts[1:], len(codes))
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        first, last = offsets[codes[start]], offsets[codes[start] + 1]
+        positions[start:stop] = first + np.searchsorted(rows[first:last],
+                                                        new_rows[start:stop])
+    return positions
+
+def code_index_inserted(rows, offsets, size, codes, new_rows):
+    """Return the rows and offsets of a code_index() with new_rows of codes added.
+
+    Size is the number of codes there now are, and codes NO_VALUE are
+    left out.  Also return where in rows the new rows went, and in
+    what order they were taken (see numpy.insert()).
+
+    """
+    if len(offsets) < size + 1:
+        offsets = np.concatenate((offsets, np.full(size + 1 - len(offsets), offsets[-1])))
+    has_code = np.flatnonzero(codes != NO_VALUE)
+    order = has_code[np.lexsort((new_rows[has_code], codes[has_code]))]
+    codes, new_rows = codes[order], new_rows[order]
+    positions = code_index_positions(rows, offsets, codes, new_rows)
+    counts = np.bincount(codes, minlength=size)
+    offsets = offsets + np.concatenate(([0], np.cumsum(counts)))
+    return np.insert(rows, positions, new_rows), offsets, positions, order
+
+def code_index_removed(rows, offsets, codes, old_rows):
+    """Return the rows and offsets of a code_index() without old_rows of codes.
+    """
+    order = np.lexsort((old_rows, codes))
+    codes, old_rows = codes[order], old_rows[order]
+    positions = code_index_positions(rows, offsets, codes, old_rows)
+    counts = np.bincount(codes, minlength=len(offsets) - 1)
+    offsets = offsets - np.concatenate(([0], np.cumsum(counts)))
+    return np.delete(rows, positions), offsets
+
+def local_timestamp(value):
+    """Return value, a local time as for GtdStore.rows_between(), in seconds since the epoch.
+    """
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    local = np.datetime64(value, 's').astype(datetime.datetime)
+    return int(time.mktime(local.timetuple()))
+
+def resized_counts(counts, size):
+    """Return counts padded with zeros to size.
+    """
+    if len(counts) >= size:
+        return counts
+    return np.concatenate((counts, np.zeros(size - len(counts), dtype=np.int64)))
+
+def day_range(first_day=None, last_day=None):
+    """Return first_day and last_day as numpy datetime64[D].
+
+    None means no limit.
+
+    """
+    return (np.datetime64(first_day if first_day is not None else
+                          np.iinfo(np.int32).min, 'D'),
+            np.datetime64(last_day if last_day is not None else
+                          np.iinfo(np.int32).max, 'D'))
+
+def day_timestamps(first_day=None, last_day=None):
+    """Return bounds on the timestamps of events from first_day to last_day.
+
+    Days are local dates, as for GtdStore.days(), and we don't know the
+    time zone, so the bounds allow for any.
+
+    """
+    first_day, last_day = day_range(first_day, last_day)
+    return (first_day.astype('datetime64[s]').astype(np.int64) - 14 * 3600,
+            (last_day + 1).astype('datetime64[s]').astype(np.int64) + 12 * 3600)
+
+def partition_rows(partitions, first_day, last_day):
+    """Return the slice of rows holding days first_day to last_day.
+
+    Partitions is a catalog from GtdStore.partition_catalog().
+
+    """
+    days = partitions['days']
+    in_range = (days >= first_day) & (days <= last_day)
+    if not in_range.any():
+        return slice(0, 0)
+    return slice(int(partitions['starts'][in_range].min()),
+                 int(partitions['stops'][in_range].max()))
+
+def event_keys(host_codes, timestamps):
+    """Return int64 keys that sort events by timestamp and then host.
+    """
+    return (np.asarray(timestamps, dtype=np.int64) << HOST_BITS) | \
+        np.asarray(host_codes, dtype=np.int64)
+
+def collapse_duplicates(keys, columns):
+    """Return keys and columns (a dict of EVENT_COLUMNS) with each key once.
+
+    Keys are sorted, and of events with the same key, the last is the
+    one we keep, with any field it doesn't have carried forward from
+    those before it.
+
+    """
+    duplicate = keys[1:] == keys[:-1]
+    if not duplicate.any():
+        return keys, columns
+    run_start = np.concatenate(([True], ~duplicate))
+    run_end = np.concatenate((~duplicate, [True]))
+    positions = np.arange(len(keys))
+    columns = dict(columns)
+    for name in EVENT_COLUMNS[2:]:
+        column = columns[name]
+        source = np.where((column != NO_VALUE) | run_start, positions, 0)
+        np.maximum.accumulate(source, out=source)
+        columns[name] = column[source]
+    return keys[run_end], {name: column[run_end] for name, column in columns.items()}
+
+def shifted_rows(rows, insert_at):
+    """Return where rows move to when rows are inserted before insert_at.
+
+    Insert_at is sorted, as for numpy.insert(); rows needn't be.  Only
+    rows after the first insert move, and if none do (new rows are
+    usually appended), rows is returned as it is.
+
+    """
+    if len(rows) == 0 or len(insert_at) == 0:
+        return rows
+    moved = np.flatnonzero(rows >= insert_at[0])
+    if len(moved) == 0:
+        return rows
+    rows = np.array(rows)
+    rows[moved] += np.searchsorted(insert_at, rows[moved], side='right')
+    return rows
+
+class ColumnMerge(object):
+    """A column with rows inserted and updated, merged when called.
+
+    GtdStore._flush() merges events into the columns other than
+    timestamp and host this way, so that a column no one looks at is
+    never copied.  A flush adds its inserts and updates to the merge
+    the last one left (see then()), rather than wrapping it, so
+    however many flushes there are before the column is used, there
+    is one merge to do, and each inserted value is held once.
+
+    """
+
+    def __init__(self, load):
+        # Load() returns the column before the merge.  New_rows are
+        # the rows of the merged column that are inserted, and
+        # updated_rows those then set to updated_values.
+        self.load = load
+        self.new_rows = np.zeros(0, dtype=np.int64)
+        self.new_values = np.zeros(0, dtype=np.int32)
+        self.updated_rows = np.zeros(0, dtype=np.int64)
+        self.updated_values = np.zeros(0, dtype=np.int32)
+
+    def then(self, insert_at, inserts, update_rows, updates):
+        """Return this merge followed by inserts and updates of its result.
+
+        Inserts go before the rows insert_at, as for numpy.insert().
+        Updates (where not NO_VALUE) replace the values at update_rows,
+        numbered as before the inserts.
+
+        """
+        merge = ColumnMerge(self.load)
+        old_rows = shifted_rows(self.new_rows, insert_at)
+        merge.new_rows = np.concatenate((old_rows, insert_at + np.arange(len(insert_at))))
+        merge.new_values = np.concatenate((self.new_values, inserts))
+        if len(old_rows) and len(insert_at) and insert_at[0] <= old_rows[-1]:
+            order = np.argsort(merge.new_rows, kind='mergesort')
+            merge.new_rows = merge.new_rows[order]
+            merge.new_values = merge.new_values[order]
+        has_value = updates != NO_VALUE
+        merge.updated_rows = shifted_rows(self.updated_rows, insert_at)
+        merge.updated_values = self.updated_values
+        if has_value.any():
+            updated_rows = np.concatenate((merge.updated_rows,
+                                           shifted_rows(update_rows[has_value], insert_at)))
+            updated_values = np.concatenate((merge.updated_values, updates[has_value]))
+            # Of updates to the same row, the last wins.
+            merge.updated_rows, last = np.unique(updated_rows[::-1], return_index=True)
+            merge.updated_values = updated_values[::-1][last]
+        return merge
+
+    def __call__(self):
+        """Return the merged column.
+
+        If the merge changes nothing, that's the column as it was, not
+        a copy.
+
+        """
+        column = self.load()
+        if len(self.new_rows):
+            column = np.insert(column, self.new_rows - np.arange(len(self.new_rows)),
+                               self.new_values)
+        elif len(self.updated_rows):
+            column = np.array(column)
+        if len(self.updated_rows):
+            column[self.updated_rows] = self.updated_values
+        return column
+
+def decode_window_title(raw_title):
+    """Decode a window title read from disk.
+
+    Titles are mostly utf-8, but some hosts wrote iso-8859-15.  We
+    decide line by line, so one odd line doesn't affect its neighbours.
+
+    """
+    try:
+        return raw_title.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw_title.decode('iso-8859-15')
+
+TITLE_BATCH_LINES = 1 << 16
+def read_window_titles_one_file(filename, hostname, gtd_data, offset=0):
+    """Read a single file and insert its data in gtd_data, a GtdStore.
+
+    The file format should be time (in seconds since the epoch), a
+    space, and then text (which may contain spaces) representing the
+    window title.
+
+    We start reading at byte offset and only consume complete lines,
+    so a line that is still being written is left for next time.
+    Return the offset just past the last line consumed.
+
+    Lines are read through a buffer and added in batches of
+    TITLE_BATCH_LINES, so memory use doesn't depend on the size of the
+    file.  A title repeats many times, so we decode each once, and
+    its events share the one string until add_events() codes them.
+
+    """
+    timestamps = []
+    titles = []
+    decoded = {}
+    with open(filename, 'rb', 1 << 20) as file_read_ptr:
+        file_read_ptr.seek(offset)
+        for line in file_read_ptr:
+            if not line.endswith(b'\n'):
+                # A partial line, still being written.
+                break
+            offset += len(line)
+            fields = line[:-1].split(b' ', 1)
+            if fields == [b'']:
+                continue
+            timestamps.append(int(fields[0]))
+            raw_title = fields[1] if len(fields) > 1 else b''
+            title = decoded.get(raw_title)
+            if title is None:
+                title = decoded[raw_title] = decode_window_title(raw_title)
+            titles.append(title)
+            if len(timestamps) == TITLE_BATCH_LINES:
+                gtd_data.add_events(hostname, timestamps, titles)
+                timestamps = []
+                titles = []
+    gtd_data.add_events(hostname, timestamps, titles)
+    return offset
+
+# A histogram mode notes how thumbnails were reduced before computing
+# their histograms: decoded at 1/scale of their size, and binned into
+# bins bins per channel.  OpenCV can decode at reduced scale directly.
+REDUCED_IMREAD_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+def histogram_mode_name(scale=1, bins=256):
+    """Return the name of the histogram mode with the given scale and bins.
+    """
+    if scale not in REDUCED_IMREAD_FLAGS:
+        raise ValueError('Histogram scale must be one of {s}'.format(
+            s=sorted(REDUCED_IMREAD_FLAGS)))
+    if bins < 1 or 256 % bins != 0:
+        raise ValueError('Histogram bins must divide 256')
+    return 'scale={s},bins={b}'.format(s=scale, b=bins)
+
+def parse_histogram_mode(mode):
+    """Return the (scale, bins) of a name made by histogram_mode_name().
+    """
+    fields = dict(field.split('=') for field in mode.split(','))
+    return int(fields['scale']), int(fields['bins'])
+
+FULL_HISTOGRAM_MODE = histogram_mode_name()
+
+def store_histogram_mode(gtd_data, mode=None):
+    """Return the histogram mode in which to add thumbnails to gtd_data.
+
+    That's the mode of the histograms gtd_data already has, if any,
+    else mode, else FULL_HISTOGRAM_MODE.  A store holds histograms of
+    one mode, so if mode is given and differs from that of gtd_data,
+    raise ValueError: changing mode means rebuilding the store.
+
+    """
+    if gtd_data is None or gtd_data.histogram_mode is None:
+        return mode or FULL_HISTOGRAM_MODE
+    if mode is not None and mode != gtd_data.histogram_mode:
+        raise ValueError(
+            'The database has histograms in mode {old}, not {new}.  '
+            'Rebuild it (remove it and its manifest) to change mode.'.format(
+                old=gtd_data.histogram_mode, new=mode))
+    return gtd_data.histogram_mode
+
+def add_ingest_arguments(named_args, compact_after):
+    """Add the options of refresh.py and follow.py to named_args, an argparse group.
+
+    That's --jobs, --digest, --histogram-scale, --histogram-bins and
+    --compact-after, whose default is compact_after.
+
+    """
+    named_args.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of processes with which to decode thumbnails')
+    named_args.add_argument('--digest', action='store_true',
+                            help='Also look up thumbnail histograms by content digest')
+    named_args.add_argument('--histogram-scale', type=int,
+                            help='Decode thumbnails at 1/scale size (1, 2, 4, or 8), '
+                            'by default as the database has them, else 1')
+    named_args.add_argument('--histogram-bins', type=int,
+                            help='Number of histogram bins per colour channel, '
+                            'by default as the database has them, else 256')
+    named_args.add_argument('--compact-after', type=int, default=compact_after,
+                            help='Compact the database when it has this many segments')
+
+def ingest_histogram_mode(parser, args, gtd_data):
+    """Return the histogram mode in which to add thumbnails to gtd_data.
+
+    Args are those parsed by parser, with the options of
+    add_ingest_arguments().  If they ask for a mode that isn't valid
+    or that gtd_data can't take (see store_histogram_mode()), that's
+    a parser error.
+
+    """
+    histogram_mode = None
+    try:
+        if args.histogram_scale is not None or args.histogram_bins is not None:
+            histogram_mode = histogram_mode_name(args.histogram_scale or 1,
+                                                 args.histogram_bins or 256)
+        return store_histogram_mode(gtd_data, histogram_mode)
+    except ValueError as error:
+        parser.error(str(error))
+
+def image_to_histograms(image_filename, mode=FULL_HISTOGRAM_MODE):
+    """Read an image, return a triple of histograms.
+
+    The histograms are linear histograms of red, green, and blue
+    intensities respectively, computed as described by mode (see
+    histogram_mode_name()).
+
+    """
+    scale, bins = parse_histogram_mode(mode)
+    image = cv2.imread(image_filename, REDUCED_IMREAD_FLAGS[scale])
+    red   = cv2.calcHist([image], channels=[0], mask=None, histSize=[bins], ranges=[0, 256])
+    green = cv2.calcHist([image], channels=[1], mask=None, histSize=[bins], ranges=[0, 256])
+    blue  = cv2.calcHist([image], channels=[2], mask=None, histSize=[bins], ranges=[0, 256])
+    return (red, green, blue)
 
-    If n is 0, select today's tasks.
+def init_histogram_worker():
+    """Prepare a pool process to compute histograms.
 
-    Return the first day in the selection and the selection itself as
-    a new dict.  Note that we are not making a deep copy of the slice
-    we return, so clients should not modify the dict values.
+    OpenCV would otherwise start its own threads in every process,
+    which only fight with each other.
 
     """
-    first_day = np.datetime64(datetime.date.today()) - \
-                np.timedelta64(num_days - 1, 'D')
-    # Strangely, numpy.datetime64.tolist() returns a datetime.date.
-    restricted_data = {k: v for k, v in data_gtd.iteritems()
-                       if v['date'] >= first_day.tolist()}
-    return first_day, restricted_data
+    cv2.setNumThreads(1)
 
-def get_window_title_filenames(path):
-    """Return a list of all data files participating in gtd window titles.
-    """
-    print('path', path)
-    all_filenames = glob(path + '/*')
-    # Technically, we probably don't need to do anything more here.
-    # But it's maybe interesting to know how many hosts if it doesn't
-    # cost too much.
-    host_pattern = re.compile('{p}/([a-z]*)__(.*)'.format(p=path))
-    hosts = set()
-    for filename in all_filenames:
-        host_match = re.match(host_pattern, filename)
-        if host_match is not None:
-            hosts.add(host_match.groups()[0])
-    hosts.discard('gtd')
-    print('Got {n} window title filenames and {h} hostnames'.format(
-        n=len(all_filenames), h=len(hosts)))
-    print('Hostnames={h}'.format(h=', '.join(hosts)))
-    return all_filenames
+def compute_histograms(image_filenames, jobs=1, mode=FULL_HISTOGRAM_MODE):
+    """Yield the histogram triple of each image in image_filenames, in order.
+
+    If jobs is more than one, decode and histogram images in a pool of
+    that many processes, handing them out in batches.
 
-host_map = {
-    'lorax': 'laptop',
-    'nantes': 'laptop',
-    'birdsong': 'desktop',
-    'starshine': 'laptop',
-    'siegfried': 'desktop'
-}
-def get_host_class(hostname):
-    """Return laptop or desktop.
     """
+    if jobs <= 1:
+        for image_filename in image_filenames:
+            yield image_to_histograms(image_filename, mode)
+        return
+    pool = multiprocessing.Pool(jobs, initializer=init_histogram_worker)
     try:
-        return host_map[hostname]
-    except KeyError:
-        return 'unknown_host_class'
+        chunk_size = max(1, min(256, len(image_filenames) // (4 * jobs)))
+        for histograms in pool.imap(
+                functools.partial(image_to_histograms, mode=mode),
+                image_filenames, chunk_size):
+            yield histograms
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
-def get_image_filenames(path):
-    """Return a list of all image filenames participating in gtd.
+def image_digest(image_filename):
+    """Return a digest of the contents of an image file.
     """
-    all_filenames = glob(path + '/*png')
-    print('Got {n} image filenames'.format(n=len(all_filenames)))
-    return all_filenames
+    with open(image_filename, 'rb') as image_file:
+        return hashlib.sha1(image_file.read()).hexdigest()
+
+class HistogramCache(object):
+    """Thumbnail histograms, looked up by file or by contents.
+
+    By file, the key is (path, size, mtime, mode), and by contents,
+    (digest, mode), the digest being image_digest() of the file.  The
+    mode is that of the histograms (see histogram_mode_name()).
+
+    On disk, the cache is a directory of segments (see lib_gtd_store),
+    each holding the histograms of one mode added by one refresh,
+    with their paths, sizes, mtimes and digests.  Segments are only
+    added, so saving costs what was added, and loading maps the
+    histograms into memory and only reads the keys.  Nothing is ever
+    dropped, so however much history there is, rebuilding the store
+    decodes no thumbnail twice.  So that segments don't pile up, the
+    newest are merged once they add up to as many entries as the one
+    before them, which rewrites each entry a few times in all.
 
-def basic_event_info(host_class, timestamp_int):
-    """Return a dict with basic event info.
     """
-    bei = {}
-    timestamp = datetime.datetime.fromtimestamp(timestamp_int)
-    bei['timestamp'] = timestamp
-    bei['weekday'] = timestamp.isoweekday()
-    bei['hours'] = timestamp.hour
-    bei['minutes'] = timestamp.hour * 60 + timestamp.minute
-    bei['seconds'] = timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
-    bei['date'] = timestamp.date()
-    bei['host_class'] = host_class
-    return bei
 
-def read_window_titles_one_file(filename, hostname, gtd_data):
-    """Read a single file and insert its data in gtd_data.
+    def __init__(self):
+        self.by_file = {}
+        self.by_digest = {}
+        # Histogram arrays of shape (entries, 3, bins), which the maps
+        # index as (block, row).
+        self._blocks = []
+        # The entries added since loading: (file key, digest key, block).
+        self._added = []
 
-    The file format should be time (in seconds since the epoch), a
-    space, and then text (which may contain spaces) representing the
-    window title.
+    def _lookup(self, entries, key):
+        """Return the histograms of key in entries, a map, or None.
+        """
+        location = entries.get(key)
+        if location is None:
+            return None
+        block, row = location
+        return self._blocks[block][row]
+
+    def lookup_file(self, file_key):
+        """Return the (3, bins) histograms of file_key, or None.
+        """
+        return self._lookup(self.by_file, file_key)
+
+    def lookup_digest(self, digest_key):
+        """Return the (3, bins) histograms of digest_key, or None.
+        """
+        return self._lookup(self.by_digest, digest_key)
+
+    def add(self, file_key, digest_key, stacked):
+        """Add the (3, bins) histograms stacked under file_key and digest_key.
+
+        Either key may be None.
+
+        """
+        block = len(self._blocks)
+        self._blocks.append(stacked[np.newaxis])
+        if file_key is not None:
+            self.by_file[file_key] = (block, 0)
+        if digest_key is not None:
+            self.by_digest[digest_key] = (block, 0)
+        self._added.append((file_key, digest_key, block))
+
+    def _add_segment(self, reader):
+        """Add the entries of a segment, from a lib_gtd_store.StoreReader.
+        """
+        mode = reader.header['mode']
+        block = len(self._blocks)
+        self._blocks.append(reader.array('histograms'))
+        sizes = reader.array('sizes').tolist()
+        mtimes = reader.array('mtimes').tolist()
+        for row, (path, size, mtime, digest) in enumerate(zip(
+                reader.table('paths'), sizes, mtimes, reader.table('digests'))):
+            if path:
+                self.by_file[(path, size, mtime, mode)] = (block, row)
+            if digest:
+                self.by_digest[(digest, mode)] = (block, row)
+
+    @classmethod
+    def load(cls, directory, attempts=3):
+        """Return the cache saved in directory by save().
+
+        A merge (see save()) may remove segments while we read them; if
+        so, we look again.
+
+        """
+        for attempt in range(attempts):
+            cache = cls()
+            try:
+                for _, _, path in lib_gtd_store.list_segments(directory):
+                    reader = lib_gtd_store.StoreReader(path)
+                    reader.hold('histograms')
+                    cache._add_segment(reader)
+                return cache
+            except (IOError, OSError):
+                if attempt == attempts - 1:
+                    raise
+
+    def save(self, directory):
+        """Add what was added since loading to directory as new segments.
+
+        One per mode, usually just one.  Then merge the newest
+        segments, if small enough (see recent_histogram_segments()).
+        Return the number of entries written.
+
+        """
+        by_mode = collections.OrderedDict()
+        for file_key, digest_key, block in self._added:
+            mode = (file_key or digest_key)[-1]
+            by_mode.setdefault(mode, []).append((file_key, digest_key, block))
+        for mode, entries in by_mode.items():
+            lib_gtd_store.write_segment(directory, functools.partial(
+                write_histogram_segment, entries=[
+                    (file_key, digest_key, self._blocks[block][0])
+                    for file_key, digest_key, block in entries], mode=mode))
+        num_added = len(self._added)
+        self._added = []
+        if num_added:
+            lib_gtd_store.compact_segments(
+                directory, merge_histogram_segments, select=recent_histogram_segments)
+        return num_added
+
+def write_histogram_segment(directory, entries, mode):
+    """Write a histogram cache segment (see HistogramCache) to directory.
+
+    Entries are (file key, digest key, histograms) triples, of mode,
+    either key possibly None.
 
     """
-    host_class = get_host_class(hostname)
-    with open(filename, 'rb') as file_read_ptr:
-        contents = file_read_ptr.read()
-    try:
-        lines = contents.decode('utf-8').split('\n')
-    except UnicodeDecodeError:
-        lines = contents.decode('iso-8859-15').split('\n')
-    field_array = [line.split(' ', 1) for line in lines]
-    fields = [{'time': fields[0], 'window_title': fields[1] if len(fields) > 1 else ''}
-              for fields in field_array
-              if fields != ['']]
-    for field in fields:
-        timestamp_int = int(field['time'])
-        bei = basic_event_info(host_class, timestamp_int)
-        bei['window_title'] = field['window_title']
-        key = (hostname, timestamp_int)
-        if key in gtd_data:
-            gtd_data[key].update(bei)
-        else:
-            gtd_data[key] = bei
+    lib_gtd_store.write_arrays(
+        directory,
+        {'histograms': lib_gtd_store.compact_counts(
+            np.array([stacked for _, _, stacked in entries], dtype=np.float32)),
+         'sizes': np.array([-1 if file_key is None else file_key[1]
+                            for file_key, _, _ in entries], dtype=np.int64),
+         'mtimes': np.array([0 if file_key is None else file_key[2]
+                             for file_key, _, _ in entries], dtype=np.float64)},
+        {'paths': ['' if file_key is None else file_key[0]
+                   for file_key, _, _ in entries],
+         'digests': ['' if digest_key is None else digest_key[0]
+                     for _, digest_key, _ in entries]},
+        {'mode': mode, 'num_entries': len(entries)})
 
-def image_to_histograms(image_filename):
-    """Read an image, return a triple of histograms.
+def merge_histogram_segments(directories, directory):
+    """Write the histogram cache segments in directories, of one mode, as one.
+    """
+    arrays = collections.defaultdict(list)
+    tables = collections.defaultdict(list)
+    for path in directories:
+        reader = lib_gtd_store.StoreReader(path)
+        for name in ('histograms', 'sizes', 'mtimes'):
+            arrays[name].append(reader.array(name))
+        for name in ('paths', 'digests'):
+            tables[name].extend(reader.table(name))
+    lib_gtd_store.write_arrays(
+        directory,
+        {name: np.concatenate(parts) for name, parts in arrays.items()},
+        tables,
+        {'mode': reader.header['mode'], 'num_entries': len(tables['paths'])})
 
-    The histograms are linear histograms of red, green, and blue
-    intensities respectively.
+def recent_histogram_segments(segments):
+    """Return the newest of segments that HistogramCache.save() should merge.
+
+    That's those of the newest's mode, back to the last segment with
+    no more entries than those after it, so that segments grow
+    geometrically and there are few of them.
 
     """
-    image = cv2.imread(image_filename)
-    red   = cv2.calcHist([image], channels=[0], mask=None, histSize=[256], ranges=[0, 256])
-    green = cv2.calcHist([image], channels=[1], mask=None, histSize=[256], ranges=[0, 256])
-    blue  = cv2.calcHist([image], channels=[2], mask=None, histSize=[256], ranges=[0, 256])
-    return (red, green, blue)
+    headers = [lib_gtd_store.read_header(path) for _, _, path in segments]
+    selected = []
+    num_entries = 0
+    for segment, header in reversed(list(zip(segments, headers))):
+        if selected and (header['mode'] != headers[-1]['mode'] or
+                         header['num_entries'] > num_entries):
+            break
+        selected.insert(0, segment)
+        num_entries += header['num_entries']
+    return selected
+
+def cached_histograms(image_filenames, cache, jobs=1, use_digest=False,
+                      mode=FULL_HISTOGRAM_MODE):
+    """Return a list of histogram triples for image_filenames, in order.
 
-def scan_window_thumbnails(image_filenames, gtd_data):
-    """Scan window images (thumbnails) and annotate gtd_data.
+    The cache is a HistogramCache, in which images are looked up by
+    file, and if use_digest is set also by the digest of their
+    contents, which catches renamed files and identical screenshots.
+    Only images not found in the cache are decoded, by
+    compute_histograms(), and added to the cache.
+
+    Return the histograms and the number of cache hits and misses.
 
     """
-    num_found = 0
-    num_found_minus = 0
-    num_missed = 0
-    num_parse_errors = 0
-    host_time_pattern = re.compile('^.*/([a-z]*)_([0-9]*)\\.[a-z]*$')
-    for image_name in image_filenames:
-        host_time_match = re.match(host_time_pattern, image_name)
-        if host_time_match is None:
-            print('Failed to parse filename: {fn}'.format(fn=image_name))
-            num_parse_errors += 1
+    histograms = []
+    miss_index = []
+    miss_keys = []
+    for image_filename in image_filenames:
+        image_stat = os.stat(image_filename)
+        file_key = (image_filename, image_stat.st_size, image_stat.st_mtime, mode)
+        digest = None
+        stacked = cache.lookup_file(file_key)
+        if stacked is None and use_digest:
+            digest = (image_digest(image_filename), mode)
+            stacked = cache.lookup_digest(digest)
+            if stacked is not None:
+                cache.add(file_key, None, stacked)
+        if stacked is None:
+            miss_index.append(len(histograms))
+            miss_keys.append((file_key, digest))
+            histograms.append(None)
         else:
-            image_host = host_time_match.groups()[0]
-            image_time = int(host_time_match.groups()[1])
-            red, green, blue = image_to_histograms(image_name)
-            hist = {'red_histogram': red,
-                    'green_histogram': green,
-                    'blue_histogram': blue,
-                    'window_thumbnail_filename': image_name}
-
-            key = (image_host, image_time)
-            if key in gtd_data:
-                num_found += 1
-                gtd_data[key].update(hist)
-            else:
-                # Maybe the snapshot happened a smidgeon after the
-                # window label was recorded.  This race condition can
-                # no longer happen, but it used to be able to happen.
-                key2 = (image_host, image_time - 1)
-                if key2 in gtd_data:
-                    num_found_minus += 1
-                    gtd_data[key2].update(hist)
-                else:
-                    num_missed += 1
-                    bei = basic_event_info(get_host_class(image_host), image_time)
-                    hist.update(bei)
-                    gtd_data[key] = hist
+            histograms.append(tuple(stacked))
+    computed = compute_histograms(
+        [image_filenames[index] for index in miss_index], jobs, mode)
+    for index, (file_key, digest), triple in zip(miss_index, miss_keys, computed):
+        cache.add(file_key, digest, np.stack([np.ravel(hist) for hist in triple]))
+        histograms[index] = triple
+    num_misses = len(miss_index)
+    return histograms, len(histograms) - num_misses, num_misses
+
+def scan_window_thumbnails(image_files, gtd_data, manifest=None, jobs=1,
+                           histogram_cache=None, use_digest=False,
+                           mode=FULL_HISTOGRAM_MODE, verbose=True):
+    """Scan window images (thumbnails) and annotate gtd_data, a GtdStore.
+
+    Image_files is a list of ImageFile, from index_image_files().
+    Return the number of images scanned.
+
+    If manifest is provided, skip images we have already read, and
+    note those we read.  That's the timestamps of each host's images,
+    as a sorted array, rather than the newest, so that an image that
+    turns up late (copied from another machine, say) is still read.
+    Manifests written before then only noted the newest image of each
+    host, and we take the images before it as read.
+
+    The images are decoded in jobs processes (see
+    compute_histograms()), but gtd_data is only modified here.
+
+    If histogram_cache is provided, images found in it are not decoded
+    at all (see cached_histograms()).
+
+    Histograms are computed as described by mode (see
+    histogram_mode_name()), which the store records.
+
+    Unless verbose, we only print when there were images to scan.
+
+    """
+    num_skipped = 0
+    if manifest is None:
+        manifest = {}
+    read_images = manifest.setdefault('image_timestamps', {})
+    watermarks = manifest.get('image_watermarks', {})
+    by_host = {}
+    for image_file in image_files:
+        by_host.setdefault(image_file.host, []).append(image_file)
+    images = []
+    unseen = {}
+    for image_host in sorted(by_host):
+        host_images = by_host[image_host]
+        timestamps = np.array([image.timestamp for image in host_images],
+                              dtype=np.int64)
+        seen = np.isin(timestamps, read_images.get(image_host, [])) | \
+            (timestamps <= watermarks.get(image_host, -1))
+        num_skipped += int(seen.sum())
+        unseen[image_host] = timestamps[~seen]
+        images.extend(image for image, image_seen in zip(host_images, seen)
+                      if not image_seen)
+
+    image_names = [image.path for image in images]
+    if histogram_cache is None:
+        all_histograms = compute_histograms(image_names, jobs, mode)
+        num_hits = 0
+        num_misses = len(image_names)
+    else:
+        all_histograms, num_hits, num_misses = cached_histograms(
+            image_names, histogram_cache, jobs, use_digest, mode)
+    # All hosts in one go, so that the store merges pending events once.
+    num_found, num_found_minus, num_missed = gtd_data.add_thumbnails(
+        [image.host for image in images], [image.timestamp for image in images],
+        image_names, all_histograms, mode)
+    for image_host, timestamps in unseen.items():
+        read_images[image_host] = np.union1d(
+            read_images.get(image_host, np.zeros(0, dtype=np.int64)), timestamps)
+    if not verbose and not images:
+        return 0
     print('Image thumbnails: found ' +
-          '{f} at first, {p} more at -1, {m} missed, {pe} parse errors'.format(
-              f=num_found, p=num_found_minus, m=num_missed, pe=num_parse_errors))
+          '{f} at first, {p} more at -1, {m} missed, '
+          '{s} already seen, {ch} cache hits, {cm} cache misses'.format(
+              f=num_found, p=num_found_minus, m=num_missed,
+              s=num_skipped, ch=num_hits, cm=num_misses))
+    return len(images)
+
+TAIL_DIGEST_BYTES = 4096
+def file_tail_digest(filename, offset):
+    """Return a digest of the TAIL_DIGEST_BYTES bytes of filename before offset.
+    """
+    start = max(offset - TAIL_DIGEST_BYTES, 0)
+    with open(filename, 'rb') as file_read_ptr:
+        file_read_ptr.seek(start)
+        return hashlib.sha1(file_read_ptr.read(offset - start)).hexdigest()
 
-def read_window_titles(filenames, gtd_data):
+def read_window_titles(title_files, gtd_data, manifest=None, verbose=True):
     """Read the host__time (window title) files.
 
-    Filenames is an array of filenames containing timestamped window
-    titles.
+    Title_files is a list of TitleFile, from index_window_title_files().
 
-    The dict gtd_data maps (hostname, timestamp) to keys as described
-    in gtd_read().
+    The events are added to gtd_data, a GtdStore.
 
-    We modify gtd_data in place.
+    If manifest is provided, it records for each file the size, mtime,
+    inode, and byte offset up to which we have already read, and a
+    digest of the bytes just before that offset.  Files that have not
+    changed are skipped, and files that have grown are only read from
+    the recorded offset.  The files are append-only, so a file that
+    has shrunk, has another inode (rsync replaces the files it
+    updates), or no longer has the bytes we read before the offset has
+    been replaced and is read from the start.
+
+    We modify gtd_data and manifest in place, and return the number of
+    files from which we read anything.  Unless verbose, we only print
+    when there was something to read.
 
     """
-    task_pattern = re.compile('^.*/([^/]*)__(.*)')
-    for filename in filenames:
-        task_match = re.match(task_pattern, filename)
-        if task_match is not None:
-            hostname = task_match.groups()[0]
-            # And task_match.groups()[1] is the session start time
-            read_window_titles_one_file(filename, hostname, gtd_data)
+    if manifest is None:
+        manifest = {}
+    manifest_files = manifest.setdefault('title_files', {})
+    num_skipped = 0
+    num_read = 0
+    for title_file in title_files:
+        filename = title_file.path
+        file_stat = os.stat(filename)
+        entry = manifest_files.get(filename)
+        offset = 0
+        if entry is not None and \
+           entry.get('inode', file_stat.st_ino) == file_stat.st_ino:
+            if entry['size'] == file_stat.st_size and \
+               entry['mtime'] == file_stat.st_mtime:
+                num_skipped += 1
+                continue
+            # Manifests written before we noted digests have none.
+            if entry['offset'] <= file_stat.st_size and \
+               entry.get('tail') in (None,
+                                     file_tail_digest(filename, entry['offset'])):
+                offset = entry['offset']
+        start = offset
+        offset = read_window_titles_one_file(
+            filename, title_file.host, gtd_data, offset)
+        if offset > start:
+            num_read += 1
+        manifest_files[filename] = {'size': file_stat.st_size,
+                                    'mtime': file_stat.st_mtime,
+                                    'inode': file_stat.st_ino,
+                                    'offset': offset,
+                                    'tail': file_tail_digest(filename, offset)}
+    if verbose or num_read:
+        print('Read {r} window title files, skipped {n} unchanged'.format(
+            r=num_read, n=num_skipped))
+    return num_read
 
-def gtd_read(data_dir, image_data_dir, gtd_data):
+def gtd_read(data_dir, image_data_dir, gtd_data, manifest=None, jobs=1,
+             histogram_cache=None, use_digest=False, histogram_mode=None):
     """Read all the gtd data available.
 
     The directory in which gtd data files live is data_dir (for
@@ -218,8 +2312,20 @@ def gtd_read(data_dir, image_data_dir, gtd_data):
     external activity.  We modify gtd_data in place but return it in
     case it was absent.
 
-    Return a dictionary whose keys are (hostname, timestamp) and whose
-    values are dictionaries with these keys:
+    If present, manifest (see gtd_manifest_load()) notes how much of
+    the raw data has already been read into gtd_data, and we only read
+    what is new.  We update it in place.  If gtd_data is empty, the
+    manifest is meaningless and we start over.
+
+    Thumbnails are decoded in jobs parallel processes, unless found in
+    histogram_cache (see cached_histograms()).  Their histograms are
+    computed as described by histogram_mode (see histogram_mode_name()),
+    by default that of gtd_data (see store_histogram_mode(), which
+    raises ValueError, before we read anything, if they differ).
+
+    Return a GtdStore.  For compatibility, it also behaves as a
+    dictionary whose keys are (hostname, timestamp) and whose values
+    are dictionaries with these keys:
 
       host_class  (laptop or desktop)
       window_title
@@ -227,7 +2333,8 @@ def gtd_read(data_dir, image_data_dir, gtd_data):
       window_thumbnail_red_histogram
       window_thumbnail_green_histogram
       window_thumbnail_blue_histogram
-        (the histograms are not normalised)
+        (each of shape (bins, 1), as cv2.calcHist() gives them, not normalised)
+      histogram_mode  (how the histograms were computed)
       timestamp_int  (seconds since the epoch)
       timestamp  (datetime.datetime)
       weekday
@@ -238,51 +2345,939 @@ def gtd_read(data_dir, image_data_dir, gtd_data):
 
     """
     if gtd_data is None:
-        gtd_data = {}
-    filenames = get_window_title_filenames(data_dir)
-    read_window_titles(filenames, gtd_data)
+        gtd_data = GtdStore()
+    histogram_mode = store_histogram_mode(gtd_data, histogram_mode)
+    if manifest is None:
+        manifest = {}
+    if not gtd_data:
+        manifest.clear()
+    title_files = index_window_title_files(data_dir)
+    read_window_titles(title_files, gtd_data, manifest)
     print('We have {num_wn} points after reading window titles'.format(
         num_wn=len(gtd_data)))
 
-    image_filenames = get_image_filenames(image_data_dir)
-    scan_window_thumbnails(image_filenames, gtd_data)
+    image_files = index_image_files(image_data_dir)
+    scan_window_thumbnails(image_files, gtd_data, manifest, jobs,
+                           histogram_cache, use_digest, histogram_mode)
     print('We have {num_wn} points after reading window contents'.format(
         num_wn=len(gtd_data)))
 
     return gtd_data
 
 def gtd_dump(filename, gtd_data):
-    """Dump a pickled dictionary of the data structure from gtd_read().
+    """Write the GtdStore from gtd_read() to filename.
+
+    If filename ends in .pickle, pickle it (the old format).  If it
+    ends in .h5, it is an HDF5 file, to which we apply what changed
+    since gtd_load() in place (see hdf5_apply_changes()), or which we
+    replace with the whole store if we didn't note changes.
+    Otherwise filename is a directory of segments (see lib_gtd_store),
+    and we add a segment holding what changed since gtd_load(), if it
+    noted changes, or else the whole store.  Earlier segments are not
+    touched, so the cost is that of the changes, and a crash while
+    writing loses at most them.  After writing, we note changes anew,
+    so the next gtd_dump() only writes what changes after this one.
 
-    Note that we do nothing to protect against race conditions.  Only
-    one gtd analytics process at a time should be running.
+    Segments accumulate; see gtd_compact().
 
     """
     start_time = time.time()
-    print('Writing {n} objects to {fn}'.format(n=len(gtd_data), fn=filename))
-    pickle.dump(gtd_data, open(filename, 'wb'))
+    if filename.endswith('.pickle'):
+        print('Writing {n} objects to {fn}'.format(n=len(gtd_data), fn=filename))
+        pickle.dump(gtd_data, open(filename, 'wb'), pickle.HIGHEST_PROTOCOL)
+    elif filename.endswith(HDF5_SUFFIX):
+        if gtd_data.changes is None or not os.path.exists(filename):
+            print('Writing {n} objects to {fn}'.format(n=len(gtd_data), fn=filename))
+            new_filename = filename + '.new'
+            gtd_data.write_hdf5(new_filename)
+            os.rename(new_filename, filename)
+        else:
+            print('Writing {n} new or changed objects to {fn}'.format(
+                n=len(gtd_data.changes), fn=filename))
+            hdf5_apply_changes(filename, gtd_data.changes)
+        gtd_data.changes = GtdStore()
+    else:
+        delta = gtd_data if gtd_data.changes is None else gtd_data.changes
+        gtd_data.changes = GtdStore()
+        if not delta:
+            print('Nothing new to write to {fn}'.format(fn=filename))
+            return
+        print('Writing {n} new or changed objects to {fn}'.format(
+            n=len(delta), fn=filename))
+        filename = lib_gtd_store.write_segment(filename, delta.write)
     time_diff = time.time() - start_time
     print('Wrote {fn} in {t:.2f} seconds'.format(fn=filename, t=time_diff))
 
-def gtd_load(filename):
-    """Load a pickled file written via gtd_dump() and return it.
+def gtd_load(filename, first_day=None, last_day=None):
+    """Load a store written via gtd_dump() and return the GtdStore.
+
+    A store directory is memory mapped, so this is quick and only the
+    columns we use are read from disk, though each segment beyond the
+    first costs a merge.  An HDF5 file (filename ending in .h5) and
+    a pickle file are read in full.  If there is
+    no filename but there is filename.pickle, we read that: it is the
+    file gtd_data_store() used to name.  Files written when gtd_read()
+    returned a dict are converted.
 
-    Note that we do nothing to protect against race conditions.  Only
-    one gtd analytics process at a time should be running.
+    If first_day or last_day (local dates, as for GtdStore.days()) is
+    given, we only load the events of those days.  For a store
+    directory, only the segments and partitions holding those days
+    are read, so this costs the same however much history there is.
+
+    Labels saved with gtd_save_label() are joined to the events.
 
     """
+    label_log = label_log_path(filename)
     try:
         start_time = time.time()
         print('Reading {fn}...'.format(fn=filename))
-        gtd_data = pickle.load(open(filename, 'rb'))
+        if os.path.isdir(filename):
+            gtd_data = read_segments(filename, first_day, last_day)
+        elif filename.endswith(HDF5_SUFFIX):
+            gtd_data = GtdStore.read_hdf5(filename, first_day, last_day)
+            if first_day is not None or last_day is not None:
+                gtd_data = gtd_data.days(first_day, last_day)
+            gtd_data.changes = GtdStore()
+        else:
+            if not os.path.exists(filename) and \
+               os.path.exists(filename + '.pickle'):
+                filename = filename + '.pickle'
+                print('Reading {fn} instead...'.format(fn=filename))
+            gtd_data = pickle.load(open(filename, 'rb'))
+            if isinstance(gtd_data, dict):
+                gtd_data = GtdStore.from_dict(gtd_data)
+            if first_day is not None or last_day is not None:
+                gtd_data = gtd_data.days(first_day, last_day)
+        gtd_data.join_labels(lib_gtd_store.read_records(label_log))
         time_diff = time.time() - start_time
         print('Read {fn}, got {n} objects in {t:.2f} seconds'.format(
             fn=filename, n=len(gtd_data), t=time_diff))
         return gtd_data
     except IOError:
         print('Failed to read {fn}, initialising to empty.'.format(fn=filename))
+    return GtdStore()
+
+LABEL_LOG = 'labels.jsonl'
+def label_log_path(filename):
+    """Return the path of the label log (see gtd_save_label()) of the store filename.
+
+    It's in the store's directory, or else beside the store's file.
+
+    """
+    if os.path.isdir(filename):
+        return os.path.join(filename, LABEL_LOG)
+    return filename + '.' + LABEL_LOG
+
+def gtd_save_label(filename, gtd_data, key, kind, label):
+    """Set a label, as GtdStore.set_label() does, and save it at once.
+
+    Gtd_data is the store loaded from filename.  The label is appended
+    to the store's label log rather than written to the store, so
+    this is quick, the label is safe as soon as we return, and it
+    doesn't matter if a refresh is writing to the store meanwhile.
+    gtd_load() joins the labels in the log to the events.
+
+    """
+    gtd_data.set_label(key, kind, label)
+    hostname, timestamp = key
+    lib_gtd_store.append_record(label_log_path(filename), {
+        'host': hostname, 'timestamp': int(timestamp), 'kind': kind, 'label': label})
+
+# Columns that gtd_load_dataframe() can build, as the plot scripts
+# have long called them: label is the window title, time the
+# timestamp (seconds since the epoch), datetime and date local.
+# day_number, day_of_month and iso_week are of the local date too.
+DATAFRAME_COLUMNS = ('hostname', 'host_class', 'label', 'datetime', 'date', 'time',
+                     'weekday', 'hours', 'minutes', 'seconds',
+                     'day_number', 'day_of_month', 'iso_week',
+                     'thumbnail_filename', 'title_label', 'thumbnail_label')
+# Columns of event_info_arrays() by their dataframe names.
+DATAFRAME_INFO_COLUMNS = {
+    'datetime': 'timestamp',
+    'date': 'date',
+    'weekday': 'weekday',
+    'hours': 'hours',
+    'minutes': 'minutes',
+    'seconds': 'seconds',
+}
+# Columns of calendar_arrays().
+DATAFRAME_CALENDAR_COLUMNS = ('day_number', 'day_of_month', 'iso_week')
+# Columns that are codes into string tables, by their dataframe names.
+DATAFRAME_CODED_COLUMNS = {
+    'hostname': 'host',
+    'label': 'title',
+    'thumbnail_filename': 'thumbnail',
+    'title_label': 'title_label',
+    'thumbnail_label': 'thumbnail_label',
+}
+
+def categorical(codes, table):
+    """Return a pandas Categorical of codes into table, a string table.
+
+    Only the strings that codes use become categories.  NO_VALUE
+    becomes NaN.
+
+    """
+    codes = np.asarray(codes)
+    present = codes != NO_VALUE
+    used = np.unique(codes[present])
+    category_codes = np.full(len(codes), -1, dtype=np.int32)
+    category_codes[present] = np.searchsorted(used, codes[present])
+    return pd.Categorical.from_codes(category_codes, [table[code] for code in used])
+
+def events_dataframe(gtd_data, columns=DATAFRAME_COLUMNS, start=None, end=None,
+                     hosts=None, host_classes=None, title_contains=None):
+    """Return a pandas DataFrame of the events of gtd_data (a GtdStore).
+
+    Columns are named in DATAFRAME_COLUMNS.  Events are selected
+    before any column is built: those at local time from start
+    (included) to end (excluded), anything numpy.datetime64 accepts;
+    those of the named hosts or host_classes; and those whose title
+    contains the string title_contains.  The title test is done once
+    per distinct title rather than once per event, the events of the
+    hosts and titles wanted are looked up in gtd_data.index(), and
+    the time range is found by binary search (see
+    GtdStore.rows_between()).
+
+    Hostnames, host classes, titles, and labels are categorical.
+
+    """
+    unknown = set(columns) - set(DATAFRAME_COLUMNS)
+    if unknown:
+        raise ValueError('Unknown columns: {c}'.format(c=', '.join(sorted(unknown))))
+    between = gtd_data.rows_between(start, end)
+    rows = None
+    if hosts is not None or host_classes is not None:
+        wanted = [code for code, hostname in enumerate(gtd_data.hosts)
+                  if (hosts is None or hostname in hosts) and
+                  (host_classes is None or get_host_class(hostname) in host_classes)]
+        rows = gtd_data.rows_of('host', wanted)
+    if title_contains is not None:
+        used = np.flatnonzero(gtd_data.title_counts())
+        wanted = [code for code in used if title_contains in gtd_data.titles[code]]
+        title_rows = gtd_data.rows_of('title', wanted)
+        rows = title_rows if rows is None else \
+            np.intersect1d(rows, title_rows, assume_unique=True)
+    if rows is None:
+        rows = np.arange(between.start, between.stop)
+    else:
+        rows = rows[np.searchsorted(rows, between.start):
+                    np.searchsorted(rows, between.stop)]
+    info = None
+    if any(column in DATAFRAME_INFO_COLUMNS or column in DATAFRAME_CALENDAR_COLUMNS
+           for column in columns):
+        info = gtd_data.event_info(rows)
+    if any(column in DATAFRAME_CALENDAR_COLUMNS for column in columns):
+        info.update(calendar_arrays(info['date']))
+
+    frame = collections.OrderedDict()
+    for column in columns:
+        if column in DATAFRAME_INFO_COLUMNS:
+            frame[column] = info[DATAFRAME_INFO_COLUMNS[column]]
+        elif column in DATAFRAME_CALENDAR_COLUMNS:
+            frame[column] = info[column]
+        elif column in DATAFRAME_CODED_COLUMNS:
+            name = DATAFRAME_CODED_COLUMNS[column]
+            frame[column] = categorical(getattr(gtd_data, name)[rows],
+                                        getattr(gtd_data, COLUMN_TABLES[name]))
+        elif column == 'host_class':
+            classes = sorted(set(get_host_class(hostname) for hostname in gtd_data.hosts))
+            class_codes = np.array([classes.index(get_host_class(hostname))
+                                    for hostname in gtd_data.hosts] + [NO_VALUE],
+                                   dtype=np.int32)
+            frame[column] = categorical(class_codes[gtd_data.host[rows]], classes)
+        elif column == 'time':
+            frame[column] = np.asarray(gtd_data.timestamp[rows])
+    return pd.DataFrame(frame)
+
+def gtd_load_dataframe(filename, columns=DATAFRAME_COLUMNS, start=None, end=None,
+                       hosts=None, host_classes=None, title_contains=None):
+    """Load the events of the store filename as a pandas DataFrame.
+
+    The arguments are those of events_dataframe().  If start or end is
+    given, only the days from start to end are loaded (see gtd_load()),
+    and only the columns we need are read.
+
+    """
+    first_day = None if start is None else np.datetime64(start, 'D')
+    last_day = None if end is None else np.datetime64(end, 'D')
+    gtd_data = gtd_load(filename, first_day, last_day)
+    dataframe = events_dataframe(gtd_data, columns, start, end,
+                                 hosts, host_classes, title_contains)
+    print('Selected {n} of {m} events'.format(n=len(dataframe), m=len(gtd_data)))
+    return dataframe
+
+# Gaps between events shorter than this (minutes) may just be clock
+# error, and longer ones are time away rather than pauses.
+PAUSE_MIN_MINUTES = 2
+PAUSE_MAX_MINUTES = 60
+PAUSE_HISTOGRAM_BINS = 10
+
+def pause_stats(timestamps, dates, min_pause=PAUSE_MIN_MINUTES,
+                max_pause=PAUSE_MAX_MINUTES, bins=PAUSE_HISTOGRAM_BINS):
+    """Return the pauses of each day of events at timestamps on local dates.
+
+    A pause is the gap between an event and the next of the same day,
+    whatever their hosts, if longer than min_pause minutes and shorter
+    than max_pause.  Return a dict of arrays parallel to days, the
+    days with events in order: max and sum, the longest and total
+    pause in minutes (0 if none), and histogram, of shape
+    (len(days), bins), counting pauses in bins equal bins from
+    min_pause to max_pause.
+
+    That's one sort, then reductions over each day's run of gaps.
+
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    order = np.lexsort((timestamps, dates.astype(np.int64)))
+    timestamps, dates = timestamps[order], dates[order]
+    days, day_index = np.unique(dates, return_inverse=True)
+    minutes = np.diff(timestamps) / 60.0
+    is_pause = (dates[1:] == dates[:-1]) & (minutes > min_pause) & (minutes < max_pause)
+    minutes = minutes[is_pause]
+    # The day of each pause, in order, so each day's pauses are a run.
+    pause_days = day_index[1:][is_pause]
+    maxima = np.zeros(len(days))
+    sums = np.zeros(len(days))
+    if len(minutes):
+        runs, run_starts = np.unique(pause_days, return_index=True)
+        maxima[runs] = np.maximum.reduceat(minutes, run_starts)
+        sums[runs] = np.add.reduceat(minutes, run_starts)
+    pause_bins = ((minutes - min_pause) * bins / (max_pause - min_pause)).astype(np.int64)
+    histogram = np.bincount(pause_days * bins + np.clip(pause_bins, 0, bins - 1),
+                            minlength=len(days) * bins).reshape(len(days), bins)
+    return {'days': days, 'max': maxima, 'sum': sums, 'histogram': histogram}
+
+# Odd constants of the splitmix64 finalizer, with which row_digests()
+# mixes bits.
+DIGEST_MULTIPLIERS = (np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb))
+
+def row_digests(*columns):
+    """Return a uint64 digest of each row of the parallel integer columns.
+    """
+    digests = np.zeros(len(columns[0]), dtype=np.uint64)
+    for column in columns:
+        digests ^= np.asarray(column).astype(np.uint64)
+        digests ^= digests >> np.uint64(30)
+        digests *= DIGEST_MULTIPLIERS[0]
+        digests ^= digests >> np.uint64(27)
+        digests *= DIGEST_MULTIPLIERS[1]
+        digests ^= digests >> np.uint64(31)
+    return digests
+
+def partition_keys(catalog, digests_of):
+    """Return a key of the content of each partition of catalog.
+
+    Catalog is as from GtdStore.partition_catalog().  Digests_of(rows),
+    rows being a slice, returns a digest of each row, as from
+    row_digests().  A partition's key is its number of rows and the
+    sum of their digests, so it changes when they do, not only when
+    their number does.
+
+    """
+    starts, stops = catalog['starts'], catalog['stops']
+    if len(starts) == 0:
+        return []
+    first = int(starts.min())
+    digests = digests_of(slice(first, int(stops.max())))
+    sums = np.zeros(len(digests) + 1, dtype=np.uint64)
+    # Sums of uint64 wrap around, which is what we want.
+    np.cumsum(digests, out=sums[1:])
+    return list(zip((stops - starts).tolist(),
+                    (sums[stops - first] - sums[starts - first]).tolist()))
+
+def catalog_day_rows(gtd_data, catalog, partitions):
+    """Return the rows of the events of partitions of catalog, and their dates.
+
+    Partitions are numbers of partitions of catalog, as from
+    GtdStore.partition_catalog(), of the events of gtd_data.  A day's
+    rows may hold a few events of its neighbours, which we leave out.
+    Dates are local, one per row returned.
+
+    """
+    rows = np.unique(np.concatenate(
+        [np.arange(catalog['starts'][num], catalog['stops'][num]) for num in partitions]))
+    dates = gtd_data.event_info(rows)['date']
+    wanted = np.isin(dates, catalog['days'][partitions])
+    return rows[wanted], dates[wanted]
+
+def gtd_day_pauses(gtd_data, min_pause=PAUSE_MIN_MINUTES, max_pause=PAUSE_MAX_MINUTES,
+                   bins=PAUSE_HISTOGRAM_BINS, cache=None):
+    """Return pause_stats() of the events of gtd_data, a GtdStore.
+
+    If cache, a dict (see pause_cache_load()), is given, days are
+    taken from it when the timestamps of their partitions (see
+    GtdStore.partition_catalog() and partition_keys()) are as when
+    cached, and only the events of the other days are looked at.
+    Those are then added to the cache.
+
+    """
+    catalog = gtd_data.partitions
+    if catalog is None:
+        catalog = gtd_data.partition_catalog()
+    days = catalog['days'].astype(datetime.date).tolist()
+    keys = partition_keys(catalog, lambda rows: row_digests(gtd_data.timestamp[rows]))
+    settings = (min_pause, max_pause, bins)
+    cache = {} if cache is None else cache
+    stale = [num for num, day in enumerate(days)
+             if cache.get((day, settings), (None,))[0] != keys[num]]
+    if stale:
+        rows, dates = catalog_day_rows(gtd_data, catalog, stale)
+        fresh = pause_stats(gtd_data.timestamp[rows], dates, min_pause, max_pause, bins)
+        day_keys = dict(zip(days, keys))
+        for num, day in enumerate(fresh['days'].astype(datetime.date).tolist()):
+            cache[(day, settings)] = (day_keys[day], fresh['max'][num],
+                                      fresh['sum'][num], fresh['histogram'][num])
+    cached = [cache[(day, settings)] for day in days]
+    return {'days': catalog['days'],
+            'max': np.array([entry[1] for entry in cached]),
+            'sum': np.array([entry[2] for entry in cached]),
+            'histogram': np.array([entry[3] for entry in cached]).reshape(-1, bins)}
+
+class SubstringMatcher(object):
+    """Find which of several strings a text contains, in one pass over it.
+
+    That's the Aho-Corasick automaton of the strings: a trie of them,
+    with a link from each state to that of its longest proper suffix in
+    the trie, followed when the next character goes nowhere.
+
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        # The trie's transitions, and the patterns (a bitmask) found on
+        # reaching each state.
+        self._goto = [{}]
+        self._found = [0]
+        for num, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._found.append(0)
+                state = self._goto[state][char]
+            self._found[state] |= 1 << num
+        # Suffix links, breadth first so that a state's link is done before its children's.
+        self._fail = [0] * len(self._goto)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                link = self._fail[state]
+                while link and char not in self._goto[link]:
+                    link = self._fail[link]
+                if state:
+                    self._fail[child] = self._goto[link].get(char, 0)
+                self._found[child] |= self._found[self._fail[child]]
+                queue.append(child)
+
+    def search(self, text):
+        """Return the bitmask of the patterns text contains (bit n for the n'th).
+        """
+        goto, fail, found = self._goto, self._fail, self._found
+        state = 0
+        mask = found[0]
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            mask |= found[state]
+        return mask
+
+    def match_table(self, texts):
+        """Return whether each of texts contains each pattern.
+
+        That's a bool array of shape (len(texts), len(patterns)).
+
+        """
+        masks = np.array([self.search(text) for text in texts], dtype=object)
+        table = np.zeros((len(masks), len(self.patterns)), dtype=bool)
+        for num in range(len(self.patterns)):
+            table[:, num] = (masks >> num) & 1
+        return table
+
+# The columns of a rollup table, one row per (date, host, title).
+ROLLUP_COLUMNS = ('date', 'host', 'title', 'count', 'first', 'last', 'gap_max', 'gap_sum')
+
+def rollup_stats(timestamps, dates, hosts, titles):
+    """Return the rollup of events at timestamps on local dates, by host and title.
+
+    Hosts and titles are parallel arrays of codes (titles may be
+    NO_VALUE).  Return a dict of the ROLLUP_COLUMNS, one row for each
+    (date, host, title) with events, in that order: count, the number
+    of events, first and last, their first and last timestamps, and
+    gap_max and gap_sum, the longest and total gap in minutes between
+    consecutive ones (0 if just one).
+
+    That's one sort, then reductions over each key's run of events
+    (see pause_stats()).
+
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    hosts = np.asarray(hosts, dtype=np.int32)
+    titles = np.asarray(titles, dtype=np.int32)
+    order = np.lexsort((timestamps, titles, hosts, dates.astype(np.int64)))
+    timestamps, dates, hosts, titles = \
+        timestamps[order], dates[order], hosts[order], titles[order]
+    same_key = (dates[1:] == dates[:-1]) & (hosts[1:] == hosts[:-1]) & \
+               (titles[1:] == titles[:-1])
+    is_start = np.ones(len(timestamps), dtype=bool)
+    is_start[1:] = ~same_key
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(timestamps)))
+    # The key of each gap, in order, so each key's gaps are a run.
+    gap_keys = np.cumsum(~same_key)[same_key]
+    minutes = np.diff(timestamps)[same_key] / 60.0
+    gap_max = np.zeros(len(starts))
+    gap_sum = np.zeros(len(starts))
+    if len(minutes):
+        runs, run_starts = np.unique(gap_keys, return_index=True)
+        gap_max[runs] = np.maximum.reduceat(minutes, run_starts)
+        gap_sum[runs] = np.add.reduceat(minutes, run_starts)
+    return {'date': dates[starts], 'host': hosts[starts], 'title': titles[starts],
+            'count': counts.astype(np.int64),
+            'first': timestamps[starts], 'last': timestamps[starts + counts - 1],
+            'gap_max': gap_max, 'gap_sum': gap_sum}
+
+def empty_rollups():
+    """Return rollups (see gtd_day_rollups()) of no events.
+    """
+    rollups = rollup_stats([], [], [], [])
+    rollups.update({'hosts': [], 'host_classes': [], 'titles': [], 'day_keys': {}})
+    return rollups
+
+def string_digests(table, codes):
+    """Return a uint64 digest of the string each of codes has in table.
+
+    Unlike the codes, the digests don't depend on the order of the
+    table, which compaction or an HDF5 load may change.  NO_VALUE has
+    digest 0.
+
+    """
+    used, inverse = np.unique(codes, return_inverse=True)
+    digests = np.array([0 if code == NO_VALUE else
+                        zlib.crc32(table[code].encode('utf-8')) & 0xffffffff
+                        for code in used.tolist()], dtype=np.uint64)
+    return digests[inverse]
+
+def rollup_codes(table, store_table, codes):
+    """Return the codes in table, a list, of the strings of codes into store_table.
+
+    Strings table doesn't have yet are appended to it.  NO_VALUE stays
+    NO_VALUE.
+
+    """
+    used, inverse = np.unique(codes, return_inverse=True)
+    lookup = {value: code for code, value in enumerate(table)}
+    used_codes = []
+    for store_code in used.tolist():
+        if store_code == NO_VALUE:
+            used_codes.append(NO_VALUE)
+            continue
+        value = store_table[store_code]
+        if value not in lookup:
+            lookup[value] = len(table)
+            table.append(value)
+        used_codes.append(lookup[value])
+    return np.array(used_codes, dtype=np.int32)[inverse]
+
+def gtd_day_rollups(gtd_data, rollups=None, days=None):
+    """Return the daily rollup table of the events of gtd_data, a GtdStore.
+
+    That's a dict: the ROLLUP_COLUMNS (see rollup_stats()), keyed by
+    date, host and title, and the tables their codes index: hosts,
+    host_classes (parallel to hosts) and titles.  Codes are the
+    rollups' own, so they outlive compaction of the store.
+
+    If rollups, a dict (see rollup_load()), is given, it is brought up
+    to date as gtd_day_pauses() does its cache: only days whose
+    timestamps, hosts and titles have changed since they were rolled
+    up (see partition_keys()) are looked at.
+
+    If days (local dates) is given, only those days are looked at,
+    found by GtdStore.day_catalog(); refresh.py passes the days of
+    the events it added.  The rows returned are those of the days
+    looked at.
+
+    """
+    if days is not None:
+        catalog = gtd_data.day_catalog(days)
+    else:
+        catalog = gtd_data.partitions
+        if catalog is None:
+            catalog = gtd_data.partition_catalog()
+    days = catalog['days'].astype(datetime.date).tolist()
+    keys = partition_keys(catalog, lambda rows: row_digests(
+        gtd_data.timestamp[rows], string_digests(gtd_data.hosts, gtd_data.host[rows]),
+        string_digests(gtd_data.titles, gtd_data.title[rows])))
+    rollups = {} if rollups is None else rollups
+    # Rollups written before they were keyed on content have day_sizes,
+    # which would never match, so we drop them.
+    rollups.pop('day_sizes', None)
+    for name, value in empty_rollups().items():
+        rollups.setdefault(name, value)
+    stale = [num for num, day in enumerate(days)
+             if rollups['day_keys'].get(day) != keys[num]]
+    if stale:
+        rows, dates = catalog_day_rows(gtd_data, catalog, stale)
+        fresh = rollup_stats(gtd_data.timestamp[rows], dates,
+                             gtd_data.host[rows], gtd_data.title[rows])
+        fresh['host'] = rollup_codes(rollups['hosts'], gtd_data.hosts, fresh['host'])
+        fresh['title'] = rollup_codes(rollups['titles'], gtd_data.titles, fresh['title'])
+        rollups['host_classes'].extend(get_host_class(hostname) for hostname in
+                                       rollups['hosts'][len(rollups['host_classes']):])
+        keep = ~np.isin(rollups['date'], catalog['days'][stale])
+        order = np.argsort(np.concatenate((rollups['date'][keep], fresh['date'])),
+                           kind='mergesort')
+        for column in ROLLUP_COLUMNS:
+            rollups[column] = np.concatenate((rollups[column][keep], fresh[column]))[order]
+        for num in stale:
+            rollups['day_keys'][days[num]] = keys[num]
+    selected = np.isin(rollups['date'], catalog['days'])
+    selection = {column: rollups[column][selected] for column in ROLLUP_COLUMNS}
+    selection.update({name: rollups[name] for name in ('hosts', 'host_classes', 'titles')})
+    return selection
+
+def gtd_day_activities(rollups, activities):
+    """Return how many events of each day have a title containing each activity.
+
+    That's a dict: days, the days with events in order, and counts,
+    of shape (len(days), len(activities)).
+
+    Events are counted from rollups, the daily rollups that
+    gtd_day_rollups() returns or refresh.py keeps (see rollup_load()),
+    so no event need be loaded.  Each of their titles is searched once
+    for all the activities (see SubstringMatcher), so more activities
+    cost little.
+
+    """
+    titles = rollups['title']
+    has_title = titles != NO_VALUE
+    used = np.unique(titles[has_title])
+    matches = np.zeros((len(rollups['titles']), len(activities)), dtype=bool)
+    matches[used] = SubstringMatcher(activities).match_table(
+        [rollups['titles'][code] for code in used])
+    days, day_index = np.unique(rollups['date'], return_inverse=True)
+    counts = np.zeros((len(days), len(activities)), dtype=np.int64)
+    for num in range(len(activities)):
+        counts[:, num] = np.bincount(
+            day_index[has_title],
+            weights=rollups['count'][has_title] * matches[titles[has_title], num],
+            minlength=len(days))
+    return {'days': days, 'counts': counts}
+
+def segment_has_days(directory, first_day=None, last_day=None):
+    """Return true if the segment in directory may have events in the range of days.
+    """
+    header = lib_gtd_store.read_header(directory)
+    if header.get('first_day') is None and header['num_events'] > 0:
+        # Written before segments noted their days.
+        return True
+    return header['num_events'] > 0 and \
+        (first_day is None or
+         np.datetime64(header['last_day']) >= np.datetime64(first_day, 'D')) and \
+        (last_day is None or
+         np.datetime64(header['first_day']) <= np.datetime64(last_day, 'D'))
+
+def read_segments(filename, first_day=None, last_day=None, attempts=3):
+    """Return the GtdStore of the segments in directory filename.
+
+    If first_day or last_day is given, only the segments with events
+    of those days are read, and only those events.
+
+    The store notes its changes, for gtd_dump().  A compaction may
+    remove segments while we read them; if so, we look again.
+
+    """
+    for attempt in range(attempts):
+        segments = lib_gtd_store.list_segments(filename)
+        try:
+            directories = [path for _, _, path in segments]
+            if first_day is not None or last_day is not None:
+                directories = [directory for directory in directories
+                               if segment_has_days(directory, first_day, last_day)]
+            gtd_data = GtdStore.read_segments(directories, True, first_day, last_day)
+            break
+        except (IOError, OSError):
+            if attempt == attempts - 1:
+                raise
+    print('Read {n} of {m} segments'.format(n=len(directories), m=len(segments)))
+    gtd_data.changes = GtdStore()
+    return gtd_data
+
+# When the changes have events at no more than this many timestamps
+# we already have rows for, we find each by bisection; otherwise we
+# read the rows from the first of them on.
+HDF5_BISECT_TIMESTAMPS = 64
+
+def hdf5_find_keys(h5_file, keys):
+    """Return where the sorted keys are or would go among the rows of h5_file.
+
+    Keys are as from event_keys(), with the file's host codes.  Return
+    the rows and whether each key is there.  Only the rows with the
+    keys' timestamps are read, or, if there are many timestamps, the
+    rows from the first on.
+
+    """
+    timestamp_dataset = h5_file['timestamp']
+    timestamps = keys >> HOST_BITS
+    distinct = np.unique(timestamps)
+    if len(distinct) > HDF5_BISECT_TIMESTAMPS:
+        spans = [(lib_gtd_store.hdf5_bisect(timestamp_dataset, distinct[0]),
+                  len(timestamp_dataset), 0, len(keys))]
+    else:
+        firsts = np.searchsorted(timestamps, distinct)
+        lasts = np.searchsorted(timestamps, distinct, side='right')
+        spans = [(lib_gtd_store.hdf5_bisect(timestamp_dataset, timestamp),
+                  lib_gtd_store.hdf5_bisect(timestamp_dataset, timestamp + 1),
+                  first, last)
+                 for timestamp, first, last in zip(distinct, firsts, lasts)]
+    rows = np.zeros(len(keys), dtype=np.int64)
+    found = np.zeros(len(keys), dtype=bool)
+    for start, stop, first, last in spans:
+        span_keys = event_keys(h5_file['host'][start:stop],
+                               timestamp_dataset[start:stop])
+        positions = np.searchsorted(span_keys, keys[first:last])
+        rows[first:last] = start + positions
+        in_span = positions < len(span_keys)
+        found[first:last][in_span] = \
+            span_keys[positions[in_span]] == keys[first:last][in_span]
+    return rows, found
+
+def hdf5_apply_changes(filename, changes):
+    """Apply changes, a GtdStore, to the store in the HDF5 file filename.
+
+    Fields of events we have are overwritten where they are, the
+    strings and histograms of the changes are appended, and new
+    events are merged into the rows from the first of them on.  Since
+    new events are mostly more recent than all we have, that is
+    usually an append.  Of the file we read the hosts, the last row,
+    and the rows near the changes' older events, so the cost is that
+    of the changes, not of the history.
+
+    Titles and labels are appended without looking for them in the
+    file, so a string may be there more than once; read_hdf5() merges
+    the copies.
+
+    Unlike segments, this isn't safe against crashes: HDF5 files
+    modified in place can be corrupted if we die in the middle.
+
+    """
+    if not changes:
+        return
+    with lib_gtd_store.hdf5_open(filename, 'r+') as h5_file:
+        events = {'timestamp': changes.timestamp}
+        hosts = lib_gtd_store.hdf5_read_strings(h5_file['hosts'])
+        host_codes = dict(zip(hosts, range(len(hosts))))
+        new_hosts = [hostname for hostname in changes.hosts
+                     if hostname not in host_codes]
+        host_codes.update(zip(new_hosts, range(len(hosts), len(hosts) + len(new_hosts))))
+        lib_gtd_store.hdf5_append_strings(h5_file['hosts'], new_hosts)
+        events['host'] = np.array([host_codes[hostname] for hostname in changes.hosts],
+                                  dtype=np.int32)[changes.host]
+        for table_name in ('titles', 'labels', 'thumbnail_filenames'):
+            names = [name for name in EVENT_COLUMNS[2:]
+                     if COLUMN_TABLES[name] == table_name]
+            columns = [getattr(changes, name) for name in names]
+            used, translate = code_translation(*columns)
+            if len(used):
+                dataset = h5_file[table_name]
+                translate[used] = np.arange(len(dataset), len(dataset) + len(used))
+                table = getattr(changes, table_name)
+                lib_gtd_store.hdf5_append_strings(dataset, [table[code] for code in used])
+            if table_name == 'thumbnail_filenames' and len(used):
+                h5_file.attrs['histogram_mode'] = changes.histogram_mode
+                histograms = np.asarray(changes.histograms[used]).astype(np.uint32)
+                if 'histograms' in h5_file:
+                    lib_gtd_store.hdf5_write_rows(
+                        h5_file['histograms'], len(h5_file['histograms']), histograms)
+                else:
+                    lib_gtd_store.hdf5_create(h5_file, 'histograms', histograms)
+            for name, column in zip(names, columns):
+                events[name] = translate[column]
+        # Sorted as the file's rows, by the file's host codes.
+        keys = event_keys(events['host'], events['timestamp'])
+        order = np.argsort(keys)
+        keys = keys[order]
+        events = {name: column[order] for name, column in events.items()}
+
+        num_rows = len(h5_file['timestamp'])
+        rows = np.full(len(keys), num_rows, dtype=np.int64)
+        found = np.zeros(len(keys), dtype=bool)
+        if num_rows:
+            last_key = event_keys(h5_file['host'][num_rows - 1],
+                                  h5_file['timestamp'][num_rows - 1])
+            old = int(np.searchsorted(keys, last_key, side='right'))
+            if old:
+                rows[:old], found[:old] = hdf5_find_keys(h5_file, keys[:old])
+        for name in EVENT_COLUMNS[2:]:
+            has_field = found & (events[name] != NO_VALUE)
+            if has_field.any():
+                h5_file[name][rows[has_field].tolist()] = events[name][has_field]
+        if found.all():
+            return
+        first_new = int(rows[~found][0])
+        for name in EVENT_COLUMNS:
+            tail = np.insert(h5_file[name][first_new:], rows[~found] - first_new,
+                             events[name][~found])
+            lib_gtd_store.hdf5_write_rows(h5_file[name], first_new, tail)
+
+def write_merged_segments(directories, directory, codec=None, level=None):
+    """Write the GtdStore of the segments in directories to directory.
+
+    If codec is given, compress it with codec at level.
+
+    """
+    GtdStore.read_segments(directories, mmap=codec is None).write(
+        directory, codec, level)
+
+def gtd_compact(filename, codec=None, level=None):
+    """Merge the segments of the store directory filename into one.
+
+    Loading costs a merge per segment, so this is worth doing when
+    segments accumulate.  It is safe to run while other processes
+    read the store or add segments to it.  Return false if another
+    compaction was already running, or if filename is not a directory
+    of segments: HDF5 and pickle stores are a single file, which
+    gtd_dump() keeps whole, so there is nothing to compact.
+
+    If codec (see lib_gtd_store.CODECS) is given, the merged segment
+    is compressed with it at level.  Titles and timestamps compress
+    several times over, but the segment can then not be memory
+    mapped, so loading all of it means decompressing all of it.
+    Loading a few days (see gtd_load()) only decompresses their blocks.
+    If codec is None, we keep the codec and level of the oldest
+    segment, and 'none' means not to compress.
+
+    """
+    if not os.path.isdir(filename):
+        print('{fn} is not a directory of segments, nothing to compact.'.format(
+            fn=filename))
+        return False
+    start_time = time.time()
+    segments = lib_gtd_store.list_segments(filename)
+    num_segments = len(segments)
+    if codec is None and segments:
+        header = lib_gtd_store.read_header(segments[0][2])
+        codec, level = header.get('codec'), header.get('level')
+    elif codec == 'none':
+        codec, level = None, None
+    compacted = lib_gtd_store.compact_segments(
+        filename, functools.partial(write_merged_segments, codec=codec, level=level))
+    time_diff = time.time() - start_time
+    print('Compacted {n} segments of {fn} in {t:.2f} seconds'.format(
+        n=num_segments, fn=filename, t=time_diff))
+    return compacted
+
+def start_compaction(filename, min_segments):
+    """Run compact.py in the background if filename has min_segments segments.
+
+    Its output goes to compact.log next to filename.  HDF5 and pickle
+    stores have no segments (see gtd_compact()), so are left alone.
+
+    """
+    if not os.path.isdir(filename) or \
+       len(lib_gtd_store.list_segments(filename)) < min_segments:
+        return
+    log_filename = os.path.join(os.path.dirname(filename), 'compact.log')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compact.py')
+    print('Compacting {fn} in the background, see {log}'.format(
+        fn=filename, log=log_filename))
+    with open(log_filename, 'a') as log_file:
+        subprocess.Popen([sys.executable, script, '--store', filename],
+                         stdout=log_file, stderr=subprocess.STDOUT)
+
+def gtd_manifest_dump(filename, manifest):
+    """Dump the ingestion manifest maintained by gtd_read().
+
+    The manifest should be written after the data it describes, so
+    that a crash in between costs us a re-read, not lost data.
+
+    """
+    pickle.dump(manifest, open(filename, 'wb'))
+
+def gtd_manifest_load(filename):
+    """Load an ingestion manifest written via gtd_manifest_dump().
+
+    If there is none, return an empty manifest, which means that
+    gtd_read() will read everything.
+
+    """
+    try:
+        return pickle.load(open(filename, 'rb'))
+    except IOError:
+        print('Failed to read {fn}, will read all raw data.'.format(fn=filename))
+    return {}
+
+def histogram_cache_dump(filename, cache):
+    """Save what was added to the thumbnail histogram cache, a HistogramCache.
+
+    Filename is the cache's directory.
+
+    """
+    start_time = time.time()
+    num_added = cache.save(filename)
+    if num_added:
+        time_diff = time.time() - start_time
+        print('Wrote {n} histograms to {fn} in {t:.2f} seconds'.format(
+            n=num_added, fn=filename, t=time_diff))
+
+def histogram_cache_load(filename):
+    """Load a HistogramCache saved via histogram_cache_dump().
+
+    If there is none, return an empty cache.  The cache used to be a
+    pickle, filename.pickle, of dicts mapping the same keys to
+    histograms; if we find one, its entries are added to the cache,
+    to be saved with it.
+
+    """
+    cache = HistogramCache.load(filename)
+    if not os.path.isdir(filename) and os.path.exists(filename + '.pickle'):
+        print('Reading {fn} instead...'.format(fn=filename + '.pickle'))
+        entries = pickle.load(open(filename + '.pickle', 'rb'))
+        for file_key, stacked in entries.get('by_file', {}).items():
+            cache.add(file_key, None, np.reshape(stacked, (3, -1)))
+        for digest_key, stacked in entries.get('by_digest', {}).items():
+            cache.add(None, digest_key, np.reshape(stacked, (3, -1)))
+    return cache
+
+def pause_cache_dump(filename, cache):
+    """Dump the per-day pause cache maintained by gtd_day_pauses().
+    """
+    pickle.dump(cache, open(filename, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+def pause_cache_load(filename):
+    """Load a pause cache written via pause_cache_dump().
+
+    If there is none, return an empty cache.
+
+    """
+    try:
+        return pickle.load(open(filename, 'rb'))
+    except IOError:
+        print('Failed to read {fn}, starting with an empty pause cache.'.format(
+            fn=filename))
     return {}
 
+def rollup_dump(filename, rollups):
+    """Dump the daily rollups maintained by gtd_day_rollups().
+    """
+    pickle.dump(rollups, open(filename, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+def rollup_load(filename):
+    """Load daily rollups written via rollup_dump().
+
+    If there are none, return empty rollups.
+
+    """
+    try:
+        return pickle.load(open(filename, 'rb'))
+    except IOError:
+        print('Failed to read {fn}, starting with empty rollups.'.format(fn=filename))
+    return empty_rollups()
+
 def gtd_data_directory():
     """Return the name of the canonical data directory.
     """
@@ -297,23 +3292,64 @@ def gtd_data_img_directory():
         return '/vagrant/data_copy/gtd-img'
     return '{home}/data/gtd-img'.format(home=getenv('HOME'))
 
-def gtd_data_store():
-    """Return the path to the file where we store features.
+def gtd_data_store(backend=None):
+    """Return the path to the directory where we store features.
+
+    Backend, one of STORE_BACKENDS, says how: 'segments' (see
+    lib_gtd_store), 'hdf5', or 'pickle'.  The default is
+    $GTD_STORE_BACKEND, or else segments.
+
+    Bug: no one creates the parent directory nor (better) checks for
+    its existence.
 
-    Bug: no one creates the directory nor (better) checks for its
-    existence.
+    """
+    if backend is None:
+        backend = getenv('GTD_STORE_BACKEND', 'segments')
+    if backend not in STORE_BACKENDS:
+        raise ValueError('Unknown store backend {b}, expected one of {bs}'.format(
+            b=backend, bs=', '.join(STORE_BACKENDS)))
+    return '{home}/.gtd_analysis/data{suffix}'.format(
+        home=getenv('HOME'), suffix=STORE_BACKENDS[backend])
+
+# Backend name to the suffix of the store's path.
+STORE_BACKENDS = collections.OrderedDict((
+    ('segments', ''),
+    ('hdf5', '.h5'),
+    ('pickle', '.pickle'),
+))
+HDF5_SUFFIX = STORE_BACKENDS['hdf5']
+
+def gtd_manifest_store():
+    """Return the path to the file where we note what raw data we've read.
+    """
+    return '{home}/.gtd_analysis/manifest.pickle'.format(home=getenv('HOME'))
+
+def gtd_histogram_cache_store():
+    """Return the path to the directory where we cache thumbnail histograms.
+    """
+    return '{home}/.gtd_analysis/histogram_cache'.format(home=getenv('HOME'))
+
+def gtd_pause_cache_store():
+    """Return the path to the file where we cache each day's pauses.
+    """
+    return '{home}/.gtd_analysis/pause_cache.pickle'.format(home=getenv('HOME'))
 
+def gtd_rollup_store():
+    """Return the path to the file where we keep the daily rollups.
     """
-    return '{home}/.gtd_analysis/data.pickle'.format(home=getenv('HOME'))
+    return '{home}/.gtd_analysis/rollups.pickle'.format(home=getenv('HOME'))
 
 def main():
     """The main section is not particularly useful except as documentation."""
     filename = gtd_data_store()
+    manifest_filename = gtd_manifest_store()
     data_dir = gtd_data_directory()
     data_img_dir = gtd_data_img_directory()
     gtd_data = gtd_load(filename)
-    gtd_data = gtd_read(data_dir, data_img_dir, gtd_data)
+    manifest = gtd_manifest_load(manifest_filename)
+    gtd_data = gtd_read(data_dir, data_img_dir, gtd_data, manifest)
     gtd_dump(filename, gtd_data)
+    gtd_manifest_dump(manifest_filename, manifest)
     print(('Read {num_objects} objects.').format(
         num_objects=len(gtd_data)))
 
@@ -0,0 +1,629 @@
+#!/usr/bin/env python
+
+"""On-disk format of the gtd event store.
+
+A store is a directory holding one .npy file per array and a small
+header (header.json) saying what is there.  Strings are stored as a
+table: the utf-8 encoded strings one after the other in a uint8 array,
+and an int64 array of offsets into it.
+
+Loading maps the .npy files into memory rather than reading them, so
+it takes about the same time whatever the size of the store, pages are
+only read from disk when touched, and processes reading the same store
+share the operating system's page cache.
+
+A store may instead be written compressed, with zlib or (in python 3)
+lzma.  Each array is then cut into blocks of rows, of about
+BLOCK_BYTES each, compressed independently one after the other in a
+.blocks file, with the byte offset of each block in an .index.npy
+file.  Monotonic arrays (timestamps, string offsets) are delta encoded
+first.  Compressed stores can't be memory mapped, but reading a range
+of rows only decompresses the blocks that hold them.
+
+The database itself is a directory of such stores, called segments,
+each holding the events added or changed by one refresh or labeling
+session.  Segments are never modified once written: a new one is
+written under a temporary name and renamed into place, so a crash can
+only lose the segment being written.  Segments are named
+FIRST-LAST, for the range of sequence numbers they cover.  A new
+segment covers just its own; compacting the database merges segments
+FIRST...LAST into one named FIRST-LAST, and then removes them.  If
+we crash before they are removed, the covering segment hides them.
+
+Small, frequent updates that must not wait for a segment (labels
+typed by hand, say) can go to a record log instead: a file of JSON
+records, one per line, only ever appended to and flushed to disk
+after each record.  See append_record().
+
+There is also an HDF5 backend, if h5py is installed: one file holding
+a chunked dataset per array, resizable along its first axis so that we
+can append to it in place, and a variable length string dataset per
+string table.  See the hdf5_ functions.
+
+This module knows nothing of what the arrays mean; see GtdStore in
+lib_gtd for that.
+
+"""
+
+from __future__ import print_function
+import errno
+import json
+import numpy as np
+import os
+import re
+import shutil
+import time
+import zlib
+try:
+    import lzma
+except ImportError:
+    # Python 2.
+    lzma = None
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+FORMAT_VERSION = 1
+HEADER_FILENAME = 'header.json'
+BLOCK_BYTES = 1 << 18
+HDF5_CHUNK_BYTES = 1 << 16
+HDF5_STRING_CHUNK = 1 << 10
+
+# Codec name to (compress(data, level), decompress(data)).
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, 6 if level is None else level),
+             zlib.decompress),
+}
+if lzma is not None:
+    CODECS['lzma'] = (
+        lambda data, level: lzma.compress(data, preset=6 if level is None else level),
+        lzma.decompress)
+
+class StringTable(object):
+    """A read-only list of strings stored as a blob and offsets.
+
+    Strings are decoded when asked for, so a table of millions of
+    titles costs nothing until we look at them.
+
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return self.blob[self.offsets[index]:self.offsets[index + 1]] \
+            .tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+def encode_strings(strings):
+    """Return the (blob, offsets) pair storing strings.
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+def compact_counts(array):
+    """Return array in the smallest unsigned integer type that holds it.
+
+    That's if it holds counts, non-negative integers, whatever its
+    type.  Otherwise return it as it is.
+
+    """
+    if len(array) == 0 or array.min() < 0 or \
+       not np.array_equal(np.floor(array), array):
+        return array
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if array.max() <= np.iinfo(dtype).max:
+            return array.astype(dtype)
+    return array
+
+def array_path(directory, name):
+    """Return the path of the file holding the named array.
+    """
+    return os.path.join(directory, name + '.npy')
+
+def load_array(path, mmap=True):
+    """Load a .npy file, memory mapped if mmap.
+    """
+    if not mmap:
+        return np.load(path)
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Older numpy can't map an empty array.
+        return np.load(path)
+
+def write_blocks(directory, name, array, codec, level, delta):
+    """Write array compressed in blocks (see above), delta encoded if delta.
+
+    Return its description for the header.
+
+    """
+    array = np.ascontiguousarray(array)
+    row_bytes = max(array[:1].nbytes, 1)
+    block_rows = max(BLOCK_BYTES // row_bytes, 1)
+    compress = CODECS[codec][0]
+    offsets = [0]
+    with open(os.path.join(directory, name + '.blocks'), 'wb') as blocks_file:
+        for start in range(0, len(array), block_rows):
+            block = array[start:start + block_rows]
+            if delta:
+                # Each block starts from 0, so it decodes on its own.
+                block = np.diff(block, prepend=block.dtype.type(0))
+            data = compress(block.tobytes(), level)
+            blocks_file.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(array_path(directory, name + '.index'), np.array(offsets, dtype=np.int64))
+    return {'dtype': array.dtype.str, 'shape': list(array.shape),
+            'block_rows': block_rows, 'delta': delta, 'codec': codec}
+
+def write_arrays(directory, arrays, tables, metadata, codec=None, level=None,
+                 delta=()):
+    """Write a store to directory, which must not exist.
+
+    Arrays maps names to numpy arrays, tables maps names to lists of
+    strings, and metadata is a dict of anything json can encode, which
+    read_header() returns as part of the header.  The header is written
+    last, so a directory without one is incomplete.
+
+    If codec (a key of CODECS) is given, the arrays are compressed in
+    blocks at level (the codec's default if None), and those named in
+    delta, as well as string offsets, are delta encoded.
+
+    """
+    os.makedirs(directory)
+    all_arrays = dict(arrays)
+    delta = set(delta)
+    for name, strings in tables.items():
+        blob, offsets = encode_strings(strings)
+        all_arrays[name + '.blob'] = blob
+        all_arrays[name + '.offsets'] = offsets
+        delta.add(name + '.offsets')
+    blocks = {}
+    for name, array in all_arrays.items():
+        if codec is None:
+            np.save(array_path(directory, name), np.ascontiguousarray(array))
+        else:
+            blocks[name] = write_blocks(directory, name, array, codec, level,
+                                        name in delta)
+    header = dict(metadata)
+    header['format_version'] = FORMAT_VERSION
+    header['arrays'] = sorted(arrays)
+    header['tables'] = sorted(tables)
+    if codec is not None:
+        header['codec'] = codec
+        header['level'] = level
+        header['blocks'] = blocks
+    with open(os.path.join(directory, HEADER_FILENAME), 'w') as header_file:
+        json.dump(header, header_file, indent=1, sort_keys=True)
+
+def read_header(directory):
+    """Return the header of the store in directory.
+    """
+    with open(os.path.join(directory, HEADER_FILENAME)) as header_file:
+        header = json.load(header_file)
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError('{d} has format version {v}, expected {e}'.format(
+            d=directory, v=header['format_version'], e=FORMAT_VERSION))
+    return header
+
+class StoreReader(object):
+    """Read the arrays and tables of a store written by write_arrays().
+
+    Arrays are memory mapped, and so read-only, if mmap and the store
+    isn't compressed.  Either way, we only read what is asked for.
+
+    """
+
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        self.mmap = mmap
+        self.header = read_header(directory)
+        self._indexes = {}
+        self._held = {}
+
+    def hold(self, *names):
+        """Open the named arrays and tables without reading them.
+
+        They can then be read later, even if the store has since been
+        removed (by compaction, say).
+
+        """
+        for name in names:
+            if name in self.header['tables']:
+                self.hold(name + '.offsets', name + '.blob')
+            elif name in self._held:
+                continue
+            elif name in self.header.get('blocks', {}):
+                self._indexes[name] = np.load(array_path(self.directory, name + '.index'))
+                self._held[name] = open(os.path.join(self.directory, name + '.blocks'), 'rb')
+            else:
+                self._held[name] = load_array(array_path(self.directory, name))
+
+    def array(self, name, start=None, stop=None):
+        """Return the named array, or its rows from start to stop.
+        """
+        blocks = self.header.get('blocks', {}).get(name)
+        if blocks is None:
+            held = self._held.get(name)
+            if held is None:
+                return load_array(array_path(self.directory, name), self.mmap)[start:stop]
+            return held[start:stop] if self.mmap else np.array(held[start:stop])
+        num_rows = blocks['shape'][0]
+        start, stop, _ = slice(start, stop).indices(num_rows)
+        stop = max(start, stop)
+        if name not in self._indexes:
+            self._indexes[name] = np.load(array_path(self.directory, name + '.index'))
+        index = self._indexes[name]
+        block_rows = blocks['block_rows']
+        first_block = start // block_rows
+        last_block = (stop + block_rows - 1) // block_rows
+        dtype = np.dtype(str(blocks['dtype']))
+        decompress = CODECS[blocks['codec']][1]
+        decoded = []
+        blocks_file = self._held.get(name)
+        if blocks_file is None:
+            blocks_file = open(os.path.join(self.directory, name + '.blocks'), 'rb')
+        try:
+            blocks_file.seek(index[first_block])
+            for block in range(first_block, last_block):
+                data = blocks_file.read(index[block + 1] - index[block])
+                values = np.frombuffer(decompress(data), dtype=dtype)
+                if blocks['delta']:
+                    values = np.cumsum(values, dtype=dtype)
+                decoded.append(values.reshape([-1] + blocks['shape'][1:]))
+        finally:
+            if name not in self._held:
+                blocks_file.close()
+        if not decoded:
+            return np.zeros([0] + blocks['shape'][1:], dtype=dtype)
+        array = np.concatenate(decoded)
+        offset = first_block * block_rows
+        return array[start - offset:stop - offset]
+
+    def table(self, name, start=None, stop=None):
+        """Return the named StringTable, or its strings from start to stop.
+        """
+        offsets = self.array(name + '.offsets',
+                             start, None if stop is None else stop + 1)
+        if len(offsets) == 0:
+            return StringTable(np.zeros(0, dtype=np.uint8), np.zeros(1, dtype=np.int64))
+        blob = self.array(name + '.blob', int(offsets[0]), int(offsets[-1]))
+        if offsets[0] != 0:
+            offsets = offsets - offsets[0]
+        return StringTable(blob, offsets)
+
+SEGMENT_PATTERN = re.compile('^([0-9]{8})-([0-9]{8})$')
+TEMPORARY_PREFIX = 'tmp-'
+COMPACTION_LOCK = 'compact.lock'
+
+def segment_name(first, last):
+    """Return the name of the segment covering sequence numbers first to last.
+    """
+    return '{f:08d}-{l:08d}'.format(f=first, l=last)
+
+def all_segments(directory):
+    """Return (first, last, path) of every segment in directory.
+
+    A store written directly to directory (by the version of gtd_dump()
+    before segments) counts as segment 0.
+
+    """
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    if os.path.exists(os.path.join(directory, HEADER_FILENAME)):
+        segments.append((0, 0, directory))
+    for name in os.listdir(directory):
+        segment_match = SEGMENT_PATTERN.match(name)
+        if segment_match is not None:
+            segments.append((int(segment_match.group(1)), int(segment_match.group(2)),
+                             os.path.join(directory, name)))
+    return segments
+
+def list_segments(directory):
+    """Return (first, last, path) of the live segments in directory, oldest first.
+
+    Segments covered by a compacted segment are left out.
+
+    """
+    segments = sorted(all_segments(directory),
+                      key=lambda segment: (segment[0], -segment[1]))
+    live = []
+    for segment in segments:
+        if live and segment[1] <= live[-1][1]:
+            continue
+        live.append(segment)
+    return live
+
+def fsync_path(path):
+    """Flush a file or directory to disk.
+    """
+    file_descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+def fsync_tree(directory):
+    """Flush directory and the files in it to disk.
+    """
+    for name in os.listdir(directory):
+        fsync_path(os.path.join(directory, name))
+    fsync_path(directory)
+
+def temporary_path(directory):
+    """Return a fresh path in directory at which to write a segment.
+    """
+    return os.path.join(directory, '{p}{pid}-{t:.6f}'.format(
+        p=TEMPORARY_PREFIX, pid=os.getpid(), t=time.time()))
+
+def publish_segment(temporary, directory, first=None, last=None):
+    """Rename the complete segment at temporary into place in directory.
+
+    If first and last are None, the segment gets the next sequence
+    number.  Return the path of the segment.
+
+    """
+    fsync_tree(temporary)
+    while True:
+        if first is None:
+            sequence = max([segment[1] for segment in all_segments(directory)] + [0]) + 1
+            name = segment_name(sequence, sequence)
+        else:
+            name = segment_name(first, last)
+        path = os.path.join(directory, name)
+        try:
+            os.rename(temporary, path)
+            break
+        except OSError as error:
+            # Someone else took that sequence number.
+            if first is not None or \
+               error.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+    fsync_path(directory)
+    return path
+
+def write_segment(directory, write):
+    """Add a segment to directory, creating it if need be.
+
+    Write is a function that writes a store to the path it is given
+    (which it must create).  Return the path of the new segment.
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = temporary_path(directory)
+    write(temporary)
+    return publish_segment(temporary, directory)
+
+def remove_segment(path, directory):
+    """Remove the segment at path from the database in directory.
+    """
+    if path != directory:
+        shutil.rmtree(path)
+        return
+    # The pre-segment store, whose files are directly in directory.
+    # Remove the header first, so it's never half there.
+    header = read_header(directory)
+    os.remove(os.path.join(directory, HEADER_FILENAME))
+    names = list(header['arrays'])
+    for name in header['tables']:
+        names.extend([name + '.blob', name + '.offsets'])
+    for name in names:
+        if name in header.get('blocks', {}):
+            os.remove(os.path.join(directory, name + '.blocks'))
+            os.remove(array_path(directory, name + '.index'))
+        else:
+            os.remove(array_path(directory, name))
+
+def lock_is_stale(lock_path):
+    """Return true if the process holding the lock at lock_path is gone.
+    """
+    try:
+        with open(lock_path) as lock_file:
+            pid = int(lock_file.read().strip() or 0)
+        os.kill(pid, 0)
+    except (IOError, OSError, ValueError):
+        return True
+    return False
+
+def take_lock(lock_path):
+    """Try to take the lock at lock_path.  Return true if we got it.
+    """
+    for _ in range(2):
+        try:
+            file_descriptor = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+            if not lock_is_stale(lock_path):
+                return False
+            os.remove(lock_path)
+            continue
+        os.write(file_descriptor, str(os.getpid()).encode('ascii'))
+        os.close(file_descriptor)
+        return True
+    return False
+
+def compact_segments(directory, merge, select=None):
+    """Merge the live segments of the database in directory into one.
+
+    Merge is a function taking a list of segment paths, oldest first,
+    and a path at which to write their merged store.  If select is
+    given, it is a function taking the live segments, as from
+    list_segments(), and returning those to merge, which must follow
+    each other.  Segments written while we work are left alone.  Only
+    one compaction runs at a time; return false if another is running.
+
+    We also clean up what crashes leave behind: segments already
+    covered by another, and old temporary segments.
+
+    """
+    lock_path = os.path.join(directory, COMPACTION_LOCK)
+    if not take_lock(lock_path):
+        print('Another compaction is running.')
+        return False
+    try:
+        segments = list_segments(directory)
+        if select is not None:
+            segments = select(segments)
+        if len(segments) > 1:
+            temporary = temporary_path(directory)
+            merge([segment[2] for segment in segments], temporary)
+            publish_segment(temporary, directory, segments[0][0], segments[-1][1])
+        live = set(segment[2] for segment in list_segments(directory))
+        for segment in all_segments(directory):
+            if segment[2] not in live:
+                remove_segment(segment[2], directory)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(TEMPORARY_PREFIX) and \
+               os.path.getmtime(path) < time.time() - 86400:
+                shutil.rmtree(path)
+    finally:
+        os.remove(lock_path)
+    return True
+
+def append_record(path, record):
+    """Append record, a dict, to the record log at path, creating it if need be.
+
+    The record is on disk when we return.  Records are short single
+    writes to a file opened for appending, so processes may append to
+    the same log at once.
+
+    """
+    created = not os.path.exists(path)
+    line = json.dumps(record, sort_keys=True) + '\n'
+    if not created and os.path.getsize(path):
+        with open(path, 'rb') as log_file:
+            log_file.seek(-1, os.SEEK_END)
+            if log_file.read(1) != b'\n':
+                # Don't run on from a record we crashed while writing.
+                line = '\n' + line
+    with open(path, 'a') as log_file:
+        log_file.write(line)
+        log_file.flush()
+        os.fsync(log_file.fileno())
+    if created:
+        fsync_path(os.path.dirname(os.path.abspath(path)))
+
+def read_records(path):
+    """Return the records of the record log at path, oldest first.
+
+    A record we crashed while writing is ignored.
+
+    """
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path) as log_file:
+        for line in log_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def hdf5_open(filename, mode='r'):
+    """Open the HDF5 file filename, as h5py.File does.
+    """
+    if h5py is None:
+        raise ImportError('The HDF5 store needs h5py.')
+    return h5py.File(filename, mode)
+
+def hdf5_string_dtype():
+    """Return the h5py type of variable length utf-8 strings.
+    """
+    if hasattr(h5py, 'string_dtype'):
+        return h5py.string_dtype('utf-8')
+    return h5py.special_dtype(vlen=type(u''))
+
+def hdf5_create(group, name, array):
+    """Create a chunked dataset in group holding array, resizable along its first axis.
+    """
+    array = np.asarray(array)
+    row_bytes = max(int(np.prod(array.shape[1:], dtype=np.int64)) *
+                    array.dtype.itemsize, 1)
+    chunk_rows = max(HDF5_CHUNK_BYTES // row_bytes, 1)
+    return group.create_dataset(name, data=array, maxshape=(None,) + array.shape[1:],
+                                chunks=(chunk_rows,) + array.shape[1:])
+
+def hdf5_write_rows(dataset, start, array):
+    """Replace the rows of dataset from start on with array.
+    """
+    dataset.resize(start + len(array), axis=0)
+    if len(array):
+        dataset[start:start + len(array)] = array
+
+def hdf5_create_strings(group, name, strings):
+    """Create a resizable dataset in group holding the list strings.
+    """
+    return group.create_dataset(name, data=np.array(list(strings), dtype=object),
+                                dtype=hdf5_string_dtype(), maxshape=(None,),
+                                chunks=(HDF5_STRING_CHUNK,))
+
+def hdf5_append_strings(dataset, strings):
+    """Append the list strings to a dataset made by hdf5_create_strings().
+    """
+    if strings:
+        hdf5_write_rows(dataset, len(dataset), np.array(list(strings), dtype=object))
+
+def hdf5_read_strings(dataset, indices=None):
+    """Return the strings of a dataset made by hdf5_create_strings() as a list.
+
+    If indices (increasing) is given, only those strings.
+
+    """
+    if indices is None:
+        values = dataset[:]
+    elif len(indices):
+        values = dataset[list(indices)]
+    else:
+        values = []
+    return [value.decode('utf-8') if isinstance(value, bytes) else value
+            for value in values]
+
+def hdf5_read(filename, name, indices=None):
+    """Return the named dataset of the HDF5 file filename, or its rows at indices.
+
+    Strings (see hdf5_create_strings()) come back as a list.  Indices,
+    if given, must be increasing.
+
+    """
+    with hdf5_open(filename) as h5_file:
+        dataset = h5_file[name]
+        if dataset.dtype.kind == 'O':
+            return hdf5_read_strings(dataset, indices)
+        if indices is None:
+            return dataset[:]
+        return dataset[list(indices)] if len(indices) else dataset[:0]
+
+def hdf5_bisect(dataset, value):
+    """Return the first row of the sorted one dimensional dataset not below value.
+
+    Only the rows we look at are read.
+
+    """
+    low, high = 0, len(dataset)
+    while low < high:
+        middle = (low + high) // 2
+        if dataset[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
@@ -3,7 +3,8 @@
 """Generate a plot of time spent in activities maching string by day.
 """
 
-from lib_gtd import gtd_load
+from lib_gtd import gtd_load, gtd_data_store, gtd_day_activities, gtd_day_rollups
+from lib_gtd import gtd_rollup_store, rollup_load
 import argparse
 import datetime
 import matplotlib.cm as cm
@@ -12,36 +13,38 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 def plot_history(input_filename, output_filename, width, height,
-                 activities):
-    """Generate an activity plot showing time spent in activity
+                 activities, use_rollups=True):
+    """Generate an activity plot showing time spent in activities
 
     The horizontal axis is time (days), the vertical axis is minutes
-    in activity (as determined by text match).
+    in each activity (as determined by text match), one line per
+    activity.  See gtd_day_activities().  We count from the daily
+    rollups that refresh.py keeps, without loading any event, unless
+    not use_rollups, when we load input_filename and roll it up anew.
 
     """
 
     print(activities)
-    activity = activities[0]    # TODO.  For the moment, just handle one.
-    print(activity)
-    tasks = gtd_load(input_filename, 'tasks')
-    print('Dataframe loaded')
-    x_dates = []
-    y_minutes = []
-    date_groups = tasks.groupby(['date'])
-    for group_date, group_df in date_groups:
-        count = group_df.loc[group_df.label.str.contains(activity)].time.count()
-        x_dates.append(group_date)
-        y_minutes.append(count)
-
+    if use_rollups:
+        rollups = rollup_load(gtd_rollup_store())
+        if not rollups.get('day_keys'):
+            print('No rollups yet: run refresh.py, or use --no-rollups.')
+    else:
+        rollups = gtd_day_rollups(gtd_load(input_filename))
+    day_activities = gtd_day_activities(rollups, activities)
+    print('Activities counted')
+    x_dates = day_activities['days'].astype(datetime.date)
+    colors = cm.rainbow(np.linspace(0, 1, len(activities)))
     legend = []
-    plt.plot(x_dates, y_minutes, '-r')
-    legend.append(mpatches.Patch(color='g',
-                                 label='Minutes using {activity}'.format(
-                                     activity=activity)))
+    for num, activity in enumerate(activities):
+        plt.plot(x_dates, day_activities['counts'][:, num], '-', color=colors[num])
+        legend.append(mpatches.Patch(color=colors[num],
+                                     label='Minutes using {activity}'.format(
+                                         activity=activity)))
 
     plt.legend(handles=legend)
-    plt.title('Minutes in {activity} by day'.format(
-        activity=activity))
+    plt.title('Minutes in {activities} by day'.format(
+        activities=', '.join(activities)))
     fig = plt.gcf()
     fig.set_size_inches(width, height)
     plt.savefig(output_filename, dpi=100)
@@ -54,14 +57,17 @@ def main():
     parser = argparse.ArgumentParser()
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-i', '--input-filename', type=str,
-                            default='/tmp/gtd-data',
-                            help='Path and filename prefix to pickled data file')
+                            default=gtd_data_store(),
+                            help='Path to the database, read only with --no-rollups')
     named_args.add_argument('-o', '--output-filename', type=str,
                             default='/tmp/gtd-activity.png',
                             help='Name of image file to output')
     named_args.add_argument('--activity', type=str,
                             help='A comma-separated list of activities to plot.  ' +
                             'An event is an activity if the window title contains this string.')
+    named_args.add_argument('--no-rollups', dest='use_rollups', action='store_false',
+                            help='Load the database and count every day anew '
+                            'rather than use the daily rollups')
     named_args.add_argument('-W', '--width', default=20,
                             help='Width in pixels/100 for output image')
     named_args.add_argument('-H', '--height', default=10,
@@ -70,7 +76,7 @@ def main():
     args = parser.parse_args()
     plot_history(args.input_filename, args.output_filename,
                  args.width, args.height,
-                 args.activity.split(','))
+                 args.activity.split(','), args.use_rollups)
 
 if __name__ == '__main__':
     main()
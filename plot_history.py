@@ -3,9 +3,8 @@
 """Generate a plot of my time usage at my computer by day.
 """
 
-from lib_gtd import gtd_load
+from lib_gtd import gtd_load_dataframe, gtd_data_store
 import argparse
-import datetime
 import matplotlib.cm as cm
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
@@ -19,29 +18,27 @@ def plot_history(input_filename, output_filename, width, height,
     spent at my computer per day.
 
     """
-    tasks = gtd_load(input_filename, 'tasks')
+    columns = ['date', 'day_number', 'day_of_month', 'minutes']
+    if color_host:
+        columns.append('hostname')
+    elif color_host_class:
+        columns.append('host_class')
+    tasks = gtd_load_dataframe(input_filename, columns)
     print('Dataframe loaded')
-    # Express as a date rather than datetime so that we don't cut days
-    # in two at the first recorded time each day.
-    first_task_date = datetime.date.fromtimestamp(
-        (min(tasks.datetime).to_datetime()
-         - datetime.datetime.utcfromtimestamp(0)).total_seconds())
-    tasks['day_index'] = tasks.apply(
-        lambda row: (row['date'] - first_task_date).days, axis=1)
-    print('Got days')
-    tasks['day_of_month'] = tasks.apply(
-        lambda row: row['datetime'].day, axis=1)
-    print('Got first of month')
+    # Count in (local) days rather than from the first recorded time so
+    # that we don't cut days in two.
+    tasks['day_index'] = tasks.day_number - tasks.day_number.min()
 
     x_points = tasks.day_index
     y_points = 1440 - tasks.minutes
-    plt.xlim(0, max(x_points))
+    plt.xlim(0, x_points.max())
     plt.ylim(0, 1440)
     fig, ax = plt.subplots(1, 1)
-    first_days = tasks.loc[tasks['day_of_month'] == 1]
-    ax.set_xticks(sorted(first_days.day_index.unique()))
+    first_days = tasks.loc[tasks.day_of_month == 1, ['day_index', 'date']] \
+                      .drop_duplicates('day_index').sort_values('day_index')
+    ax.set_xticks(first_days.day_index)
     ax.set_xticklabels(['{m}-{y}'.format(m=x.month, y=x.year)
-                        for x in sorted(first_days.date.unique())])
+                        for x in first_days.date])
     ax.set_yticks(np.linspace(0, 1440, 9))
     ax.set_yticklabels(['midnight', 21, 18, 15, 'noon', 9, 6, 3, 'midnight'])
     print('Scattering points...')
@@ -50,19 +47,14 @@ def plot_history(input_filename, output_filename, width, height,
             column = 'hostname'
         else:
             column = 'host_class'
-        names = tasks[column].unique()
-        name_map = {names[index]: index
-                    for index in range(len(names))}
-        print(names)
-        colors = cm.rainbow(np.linspace(0, 1, len(names)))
+        # One pass to split the points by name.
+        groups = tasks.groupby(column, observed=True)
+        print(list(groups.groups))
+        colors = cm.rainbow(np.linspace(0, 1, groups.ngroups))
         legend = []
-        for name in names:
-            name_tasks = tasks.loc[tasks[column] == name]
-            name_x_points = name_tasks.day_index
-            name_y_points = 1440 - name_tasks.minutes
-            name_color = colors[name_map[name]]
-            plt.scatter(name_x_points, name_y_points, color=name_color,
-                        s=1, edgecolors='none')
+        for name_color, (name, name_tasks) in zip(colors, groups):
+            plt.scatter(name_tasks.day_index, 1440 - name_tasks.minutes,
+                        color=name_color, s=1, edgecolors='none')
             legend.append(mpatches.Patch(color=name_color, label=name))
         plt.legend(handles=legend)
     else:
@@ -79,8 +71,8 @@ def main():
     parser = argparse.ArgumentParser()
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-i', '--input-filename', type=str,
-                            default='/tmp/gtd-data',
-                            help='Path and filename prefix to pickled data file')
+                            default=gtd_data_store(),
+                            help='Path to the database')
     named_args.add_argument('-o', '--output-filename', type=str,
                             default='/tmp/gtd-activity.png',
                             help='Name of image file to output')
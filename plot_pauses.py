@@ -4,43 +4,30 @@
 """
 
 from __future__ import print_function
-from lib_gtd import gtd_load
+from lib_gtd import gtd_load, gtd_data_store, gtd_day_pauses, gtd_pause_cache_store, \
+    pause_cache_dump, pause_cache_load, PAUSE_MIN_MINUTES, PAUSE_MAX_MINUTES
 import argparse
 import datetime
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
 
 def plot_pauses(input_filename, output_filename, width, height,
-                max_pause, sum_pauses):
+                min_pause, max_pause, sum_pauses, use_cache=True):
     """Generate an activity plot showing pauses
 
     The horizontal axis is time (days), the vertical axis is minutes
-    of pause (maximum or cumulative).
+    of pause (maximum or cumulative).  See gtd_day_pauses(), which
+    caches each day's pauses unless not use_cache.
 
     """
-    tasks = gtd_load(input_filename, 'tasks')
-    print('Dataframe loaded')
-    x_dates = []
-    y_sums = []
-    y_max = []
-    date_groups = tasks.groupby(['date'])
-    for group_date, group_df in date_groups:
-        last_time = None
-        max_interval = 0
-        sum_interval = 0
-        for row in group_df.sort_values(by=['time']).itertuples():
-            this_time = int(row.time)
-            if last_time is not None:
-                interval_minutes = (this_time - last_time) / 60
-                # Pauses should last at least a couple minutes,
-                # otherwise maybe it's clock error.
-                if 2 < interval_minutes and interval_minutes < max_pause:
-                    sum_interval += interval_minutes
-                    max_interval = max(interval_minutes, max_interval)
-            last_time = this_time
-        x_dates.append(group_date)
-        y_sums.append(sum_interval)
-        y_max.append(max_interval)
+    gtd_data = gtd_load(input_filename)
+    cache = pause_cache_load(gtd_pause_cache_store()) if use_cache else None
+    pauses = gtd_day_pauses(gtd_data, min_pause, max_pause, cache=cache)
+    if use_cache:
+        pause_cache_dump(gtd_pause_cache_store(), cache)
+    x_dates = pauses['days'].astype(datetime.date)
+    y_sums = pauses['sum']
+    y_max = pauses['max']
 
     legend = []
     plt.plot(x_dates, y_max, '-g')
@@ -63,15 +50,19 @@ def main():
     parser = argparse.ArgumentParser()
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-i', '--input-filename', type=str,
-                            default='/tmp/gtd-data',
-                            help='Path and filename prefix to pickled data file')
+                            default=gtd_data_store(),
+                            help='Path to the database')
     named_args.add_argument('-o', '--output-filename', type=str,
                             default='/tmp/gtd-activity.png',
                             help='Name of image file to output')
-    named_args.add_argument('--max-pause', type=int, default=60,
+    named_args.add_argument('--min-pause', type=int, default=PAUSE_MIN_MINUTES,
+                            help='Minimum pause length in minutes below which to ignore')
+    named_args.add_argument('--max-pause', type=int, default=PAUSE_MAX_MINUTES,
                             help='Maximum pause length in minutes above which to ignore')
     named_args.add_argument('--sum', action='store_true',
                             help="Show sum of day's pauses rather than maximum")
+    named_args.add_argument('--no-cache', dest='use_cache', action='store_false',
+                            help='Compute every day anew rather than use the pause cache')
     named_args.add_argument('-W', '--width', default=20,
                             help='Width in pixels/100 for output image')
     named_args.add_argument('-H', '--height', default=10,
@@ -81,7 +72,7 @@ def main():
 
     plot_pauses(args.input_filename, args.output_filename,
                 args.width, args.height,
-                args.max_pause, args.sum)
+                args.min_pause, args.max_pause, args.sum, args.use_cache)
 
 if __name__ == '__main__':
     main()
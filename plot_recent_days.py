@@ -7,12 +7,11 @@ history to show.  The default is ten.
 
 """
 
-from lib_gtd import gtd_load, filter_n_last_days
+from lib_gtd import gtd_load, gtd_data_store, first_of_n_last_days, get_host_class
 import argparse
 import datetime
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 
 def plot_recent_days(input_filename, output_filename, num_days,
                      width, height):
@@ -20,31 +19,29 @@ def plot_recent_days(input_filename, output_filename, num_days,
 
     Show num_days days (wall time, even for days with no activity) with
     the most recent at the bottom.
-    """
-    dataframe = gtd_load(
-        input_filename, 'tasks').loc[:, ['date', 'datetime', 'host_class']]
 
-    # We'll first filter to a bit more than the range we want so that
-    # we have less data, then append a date field and do the precise
-    # filter.
-    dataframe = dataframe[dataframe.datetime >
-                          np.datetime64(datetime.datetime.now()) -
-                          np.timedelta64(num_days + 1, 'D')]
-    dataframe['time'] = pd.Series(
-        [val.to_datetime().time() for val in dataframe.datetime],
-        index=dataframe.index)
-    first_day, dataframe = filter_n_last_days(dataframe, num_days)
+    Only those days are loaded (see gtd_load()), so this costs the same
+    however much history the store has, and each day's events are
+    found by binary search (see GtdStore.events_between()).
+    """
+    first_day = first_of_n_last_days(num_days)
+    gtd_data = gtd_load(input_filename, first_day)
+    host_classes = np.array([get_host_class(hostname) for hostname in gtd_data.hosts],
+                            dtype=object)
 
     fig, ax = plt.subplots(num_days, sharex=True, sharey=True)
     for day_num in range(num_days):
         # TODO(jeff@purple.com): Should plot each host at a different y value.
-        this_day = dataframe[dataframe.date == (first_day + day_num).tolist()]
-        desktop = this_day[this_day.host_class == 'desktop']
-        laptop = this_day[this_day.host_class == 'laptop']
-        ax[day_num].plot(desktop.time.as_matrix(),
+        day = first_day + day_num
+        day_data = gtd_data.events_between(day, day + 1)
+        seconds = day_data.event_info()['seconds']
+        host_class = host_classes[day_data.host]
+        desktop = seconds[host_class == 'desktop']
+        laptop = seconds[host_class == 'laptop']
+        ax[day_num].plot(desktop,
                          np.ones(len(desktop)),
                          '.b')
-        ax[day_num].plot(laptop.time.as_matrix(),
+        ax[day_num].plot(laptop,
                          np.ones(len(laptop)),
                          '.r')
         ax[day_num].set_ylabel(
@@ -71,8 +68,8 @@ def main():
     parser = argparse.ArgumentParser()
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-i', '--input-filename', type=str,
-                            default='/tmp/gtd-data',
-                            help='Path and filename prefix to pickled data file')
+                            default=gtd_data_store(),
+                            help='Path to the database')
     named_args.add_argument('-o', '--output-filename', type=str,
                             default='/tmp/gtd-activity.png',
                             help='Name of image file to output')
@@ -7,7 +7,7 @@ history to show.  The default is ten.
 
 """
 
-from lib_gtd import gtd_load
+from lib_gtd import gtd_load, gtd_data_store
 from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.manifold import MDS
 from sklearn.metrics.pairwise import cosine_similarity
@@ -19,9 +19,8 @@ def plot_similar(input_filename, output_filename, target, width, height):
     """Find some phrases similar to target.
 
     """
-    dataframe = gtd_load(
-        input_filename, 'tasks')
-    labels = dataframe.label.unique()
+    titles, _ = gtd_load(input_filename).used_titles()
+    labels = np.array(titles, dtype=object)
     print('Got {n} labels.'.format(n=len(labels)))
     labels = np.random.choice(labels, 1000, False)
     if target not in labels:
@@ -75,8 +74,8 @@ def main():
     parser = argparse.ArgumentParser()
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-i', '--input-filename', type=str,
-                            default='/tmp/gtd-data',
-                            help='Path and filename prefix to pickled data file')
+                            default=gtd_data_store(),
+                            help='Path to the database')
     named_args.add_argument('-o', '--output-filename', type=str,
                             default='/tmp/gtd-activity.png',
                             help='Name of image file to output')
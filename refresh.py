@@ -4,23 +4,64 @@
 already have in the database.  We create the database if necessary.
 
 Using the word "database" is grandiose.  At the moment, this is simply
-a file with an (enormous) pickled dictionary in it.  Not
-computationally efficient, but efficient with my development time for
-the moment.
+a directory of segments, each a directory of numpy arrays, one per
+field, with titles and such as codes into string tables (see GtdStore
+and lib_gtd_store).  Each refresh adds a segment holding just what it
+found; when --compact-after segments have piled up, we start
+compact.py in the background to merge them.
+
+Alongside the database we keep a manifest of how far we have read
+each raw file, so a refresh only reads what was appended since the
+last one, and a cache of every thumbnail histogram computed so far,
+so that rebuilding the database doesn't mean decoding any
+thumbnail again.  We also bring
+the daily rollups (see gtd_day_rollups()) up to date, for the days
+that have new events.
 
 """
 
+from __future__ import print_function
 from lib_gtd import gtd_data_store, gtd_data_directory, gtd_data_img_directory
 from lib_gtd import gtd_load, gtd_read, gtd_dump
+from lib_gtd import gtd_manifest_store, gtd_manifest_load, gtd_manifest_dump
+from lib_gtd import gtd_histogram_cache_store, histogram_cache_load, histogram_cache_dump
+from lib_gtd import gtd_rollup_store, rollup_load, rollup_dump, gtd_day_rollups
+from lib_gtd import add_ingest_arguments, ingest_histogram_mode, start_compaction
+import argparse
+import numpy as np
 
 def main():
-    """The main section is not particularly useful except as documentation."""
+    """Bring the database up to date with the raw data."""
+    parser = argparse.ArgumentParser()
+    named_args = parser.add_argument_group('arguments')
+    add_ingest_arguments(named_args, compact_after=10)
+    args = parser.parse_args()
+
     filename = gtd_data_store()
+    manifest_filename = gtd_manifest_store()
     data_dir = gtd_data_directory()
     data_img_dir = gtd_data_img_directory()
     gtd_data = gtd_load(filename)
-    gtd_data = gtd_read(data_dir, data_img_dir, gtd_data)
+    histogram_mode = ingest_histogram_mode(parser, args, gtd_data)
+    manifest = gtd_manifest_load(manifest_filename)
+    cache_filename = gtd_histogram_cache_store()
+    histogram_cache = histogram_cache_load(cache_filename)
+    gtd_data = gtd_read(data_dir, data_img_dir, gtd_data, manifest,
+                        args.jobs, histogram_cache, args.digest, histogram_mode)
+    histogram_cache_dump(cache_filename, histogram_cache)
+    changes = gtd_data.changes
     gtd_dump(filename, gtd_data)
+    gtd_manifest_dump(manifest_filename, manifest)
+    rollups = rollup_load(gtd_rollup_store())
+    if changes is None or not rollups.get('day_keys'):
+        # We don't know what changed, or have no rollups yet.
+        changed_days = None
+    else:
+        changed_days = np.unique(changes.event_info()['date'])
+    if changed_days is None or len(changed_days):
+        gtd_day_rollups(gtd_data, rollups, changed_days)
+        rollup_dump(gtd_rollup_store(), rollups)
+    start_compaction(filename, args.compact_after)
     print(('Read {num_objects} objects.').format(
         num_objects=len(gtd_data)))
 
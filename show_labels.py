@@ -15,15 +15,14 @@ def print_points(filename):
     print('Loading data...')
     gtd_data = gtd_load(filename)
     print('Scanning...')
-    labeled_data = {k: v for k, v in gtd_data.iteritems()
-                    if 'ground_truth_window_title_label' in v
-                    or 'ground_truth_window_thumbnail_label' in v}
-    for k, v in labeled_data.iteritems():
+    # Rows are in time order.  The labeled rows are in the store's
+    # index, and histograms are never loaded.
+    for row in gtd_data.labeled_rows():
+        event = gtd_data.event(row, histograms=False)
         print('{when}: {label} / {img_label}'.format(
-            when=v['timestamp'],
-            label=v['ground_truth_window_title_label'],
-            img_label=v['ground_truth_window_thumbnail_label'] if
-            'ground_truth_window_thumbnail_label' in v else ''))
+            when=event['timestamp'],
+            label=event.get('ground_truth_window_title_label', ''),
+            img_label=event.get('ground_truth_window_thumbnail_label', '')))
 
 def main():
     """Pick a point at random and offer to label it.
@@ -35,7 +34,7 @@ def main():
     named_args = parser.add_argument_group('arguments')
     named_args.add_argument('-f', '--filename', type=str,
                             default=gtd_data_store(),
-                            help='Path and filename prefix to pickled data file')
+                            help='Path to the database')
     args = parser.parse_args()
     print_points(args.filename)
 
@@ -0,0 +1,522 @@
+"""Tests of lib_gtd: the event store, its on-disk formats, ingest and caches.
+
+Run with python -m pytest from this directory.
+
+"""
+
+from __future__ import print_function
+import datetime
+import os
+import shutil
+import time
+import cv2
+import numpy as np
+import pytest
+import lib_gtd
+import lib_gtd_store
+from lib_gtd import GtdStore
+
+MODE = lib_gtd.histogram_mode_name(1, 4)
+# Noon, local time, so that a few hours either way stay on the same day.
+BASE = lib_gtd.local_timestamp('2016-08-01T12:00')
+
+def histograms(value):
+    """Return a histogram triple in MODE whose bins are all value."""
+    return (np.full((4, 1), value, dtype=np.float32),) * 3
+
+def fields(store):
+    """Return the events of store as a list of comparable tuples."""
+    return [(key, event.get('window_title'), event.get('window_thumbnail_filename'),
+             event.get('ground_truth_window_title_label'),
+             event.get('ground_truth_window_thumbnail_label'),
+             float(event['red_histogram'][0, 0]) if 'red_histogram' in event else None)
+            for key, event in store.iteritems()]
+
+def counted_titles(store):
+    """Return a dict of the titles of store and their title_counts()."""
+    return dict(zip(*store.used_titles()))
+
+def recounted_titles(store):
+    """Return what counted_titles() should, counted from the events."""
+    counts = {}
+    for event in store.values():
+        if 'window_title' in event:
+            counts[event['window_title']] = counts.get(event['window_title'], 0) + 1
+    return counts
+
+def example_store():
+    """Return a store of two hosts, with thumbnails and a label."""
+    store = GtdStore()
+    store.add_events('lorax', [BASE + 20, BASE, BASE + 10], ['b', 'a', 'c'])
+    store.add_events('birdsong', [BASE + 10, BASE + 5], ['a', u'caf\xe9'])
+    store.add_thumbnails('lorax', [BASE, BASE + 11], ['l0.png', 'l11.png'],
+                         [histograms(1), histograms(2)], MODE)
+    store.set_label(('birdsong', BASE + 5), 'title', 'coffee')
+    return store
+
+def test_flush_orders_events():
+    store = GtdStore()
+    store.add_events('lorax', [BASE + 30, BASE + 10], ['late', 'early'])
+    store.add_events('birdsong', [BASE + 20, BASE + 10], ['b20', 'b10'])
+    assert len(store) == 4
+    assert list(store.timestamp) == [BASE + 10, BASE + 10, BASE + 20, BASE + 30]
+    assert store.keys() == [('lorax', BASE + 10), ('birdsong', BASE + 10),
+                            ('birdsong', BASE + 20), ('lorax', BASE + 30)]
+    # Appended after what we have, and then inserted in the middle.
+    store.add_events('lorax', [BASE + 40], ['later'])
+    store.add_events('lorax', [BASE + 25, BASE], ['middle', 'first'])
+    assert len(store) == 7
+    assert list(store.timestamp) == sorted(store.timestamp)
+    assert store[('lorax', BASE + 25)]['window_title'] == 'middle'
+    assert store[('lorax', BASE)]['window_title'] == 'first'
+
+def test_flush_updates_duplicates():
+    store = GtdStore()
+    store.add_events('lorax', [BASE, BASE + 10], ['old', 'kept'],
+                     labels={'title': ['work', None]})
+    len(store)
+    # The same events again, pending together: the last wins, and
+    # fields the later events don't have are kept.
+    store.add_events('lorax', [BASE], ['newer'])
+    store.add_events('lorax', [BASE, BASE + 10], ['newest', None])
+    assert len(store) == 2
+    assert store[('lorax', BASE)]['window_title'] == 'newest'
+    assert store[('lorax', BASE)]['ground_truth_window_title_label'] == 'work'
+    assert store[('lorax', BASE + 10)]['window_title'] == 'kept'
+    assert counted_titles(store) == {'newest': 1, 'kept': 1}
+
+def test_many_flushes():
+    # As follow.py would, polling for hours.
+    store = example_store()
+    for num in range(3000):
+        store.add_events('lorax', [BASE + 100 + num], ['poll {n}'.format(n=num % 7)])
+        len(store)
+    # An event we have, retitled, as when a title file is read again.
+    store.add_events('lorax', [BASE + 100], ['retitled'])
+    assert len(store) == 3005
+    assert store[('lorax', BASE + 100)]['window_title'] == 'retitled'
+    assert store[('lorax', BASE + 10)]['window_thumbnail_filename'] == 'l11.png'
+    assert store[('birdsong', BASE + 5)]['ground_truth_window_title_label'] == 'coffee'
+    assert counted_titles(store) == recounted_titles(store)
+
+def test_title_counts():
+    store = example_store()
+    assert counted_titles(store) == recounted_titles(store)
+    store.add_events('birdsong', [BASE + 10, BASE + 50], ['b', 'b'])
+    store.add_events('lorax', [BASE + 20], ['a'])
+    assert counted_titles(store) == recounted_titles(store)
+    assert counted_titles(store) == {'a': 2, 'b': 2, 'c': 1, u'caf\xe9': 1}
+
+def test_add_thumbnails():
+    store = example_store()
+    # Found at BASE + 20, at the second before BASE + 21, and missed.
+    found = store.add_thumbnails(
+        ['lorax', 'lorax', 'birdsong'], [BASE + 20, BASE + 21, BASE + 99],
+        ['l20.png', 'l21.png', 'b99.png'], [histograms(3)] * 3, MODE)
+    assert found == (1, 1, 1)
+    assert store[('lorax', BASE + 10)]['window_thumbnail_filename'] == 'l11.png'
+    assert store[('lorax', BASE + 20)]['window_thumbnail_filename'] == 'l21.png'
+    event = store[('birdsong', BASE + 99)]
+    assert event['window_thumbnail_filename'] == 'b99.png'
+    assert event['red_histogram'].shape == (4, 1)
+    assert event['histogram_mode'] == MODE
+
+def test_add_thumbnails_to_pending_events():
+    store = example_store()
+    len(store)
+    num_rows = len(store.timestamp)
+    # As a poll of follow.py adds them, before anything is merged.
+    store.add_events('lorax', [BASE + 40, BASE + 50], ['d', 'e'])
+    found = store.add_thumbnails(['lorax', 'lorax'], [BASE + 41, BASE + 20],
+                                 ['l41.png', 'l20.png'], [histograms(6)] * 2, MODE)
+    assert found == (1, 1, 0)
+    assert len(store.timestamp) == num_rows
+    assert len(store) == num_rows + 2
+    assert store[('lorax', BASE + 40)]['window_title'] == 'd'
+    assert store[('lorax', BASE + 40)]['window_thumbnail_filename'] == 'l41.png'
+    assert store[('lorax', BASE + 20)]['window_thumbnail_filename'] == 'l20.png'
+
+def test_segments_and_compaction(tmpdir):
+    directory = str(tmpdir.join('data'))
+    store = example_store()
+    lib_gtd.gtd_dump(directory, store)
+    loaded = lib_gtd.gtd_load(directory)
+    assert fields(loaded) == fields(store)
+    # A second segment, with new events and changes to old ones.
+    for changed in (store, loaded):
+        changed.add_events('lorax', [BASE + 5, BASE + 30], ['a', 'new'])
+        changed.add_thumbnails('birdsong', [BASE + 10], ['b10.png'], [histograms(4)], MODE)
+    lib_gtd.gtd_dump(directory, loaded)
+    assert len(lib_gtd_store.list_segments(directory)) == 2
+    loaded = lib_gtd.gtd_load(directory)
+    assert fields(loaded) == fields(store)
+    assert counted_titles(loaded) == recounted_titles(store)
+    assert lib_gtd.gtd_compact(directory)
+    assert len(lib_gtd_store.list_segments(directory)) == 1
+    assert fields(lib_gtd.gtd_load(directory)) == fields(store)
+    assert lib_gtd.gtd_compact(directory, 'zlib', 6)
+    compacted = lib_gtd.gtd_load(directory)
+    assert fields(compacted) == fields(store)
+    assert fields(lib_gtd.gtd_load(directory, '2016-08-01', '2016-08-01')) == fields(store)
+
+def test_compaction_of_single_file_stores(tmpdir, monkeypatch):
+    filename = str(tmpdir.join('data.pickle'))
+    lib_gtd.gtd_dump(filename, example_store())
+    tmpdir.join('data.h5').write('')
+    started = []
+    monkeypatch.setattr(lib_gtd.subprocess, 'Popen',
+                        lambda *args, **kwargs: started.append(args))
+    for filename in (filename, str(tmpdir.join('data.h5'))):
+        assert not lib_gtd.gtd_compact(filename)
+        lib_gtd.start_compaction(filename, 0)
+    assert started == []
+    assert sorted(os.listdir(str(tmpdir))) == ['data.h5', 'data.pickle']
+
+def rebuilt_index(store):
+    """Return the index of store, built from scratch."""
+    return store.subset(slice(None)).index()
+
+def test_index_updates(tmpdir):
+    directory = str(tmpdir.join('data'))
+    store = example_store()
+    store.labeled_rows('title')
+    # Only what was asked for.
+    assert sorted(store.index([])) == ['title_labeled_rows']
+    lib_gtd.gtd_dump(directory, store)
+    loaded = lib_gtd.gtd_load(directory)
+    # Among the events we have, retitled, and after them.
+    loaded.add_events('lorax', [BASE + 1, BASE + 10, BASE + 30], ['x', 'a', 'c'])
+    loaded.add_events('birdsong', [BASE + 40], ['d'], labels={'thumbnail': ['idle']})
+    loaded.set_label(('lorax', BASE), 'title', 'work')
+    lib_gtd.gtd_dump(directory, loaded)
+    loaded = lib_gtd.gtd_load(directory)
+    loaded.set_label(('lorax', BASE + 1), 'thumbnail', 'busy')
+    expected = rebuilt_index(loaded)
+    index = loaded.index()
+    assert sorted(index) == sorted(expected)
+    for name in expected:
+        assert np.array_equal(index[name], expected[name]), name
+    assert loaded.host_rows('birdsong').tolist() == [2, 4, 7]
+    assert [loaded.titles[code] for code in loaded.title[loaded.rows_of(
+        'title', [loaded.code('titles', 'a')])]] == ['a'] * 3
+
+def test_hdf5_apply_changes(tmpdir):
+    pytest.importorskip('h5py')
+    filename = str(tmpdir.join('data.h5'))
+    store = example_store()
+    lib_gtd.gtd_dump(filename, store)
+    loaded = lib_gtd.gtd_load(filename)
+    assert fields(loaded) == fields(store)
+    for changed in (store, loaded):
+        # Before, among, and after the events in the file.
+        changed.add_events('lorax', [BASE - 10, BASE + 15, BASE + 99],
+                           ['a', 'new', u'caf\xe9'])
+        changed.add_events('birdsong', [BASE + 5], ['b'])
+        changed.add_thumbnails('birdsong', [BASE + 11], ['b11.png'], [histograms(5)], MODE)
+        changed.set_label(('lorax', BASE + 10), 'thumbnail', 'editor')
+    lib_gtd.gtd_dump(filename, loaded)
+    loaded = lib_gtd.gtd_load(filename)
+    assert fields(loaded) == fields(store)
+    assert counted_titles(loaded) == recounted_titles(store)
+    # Titles appended twice come back once.
+    assert len(loaded.titles) == len(set(loaded.titles))
+
+def test_events_between_day_boundaries():
+    midnight = lib_gtd.local_timestamp('2016-08-02')
+    next_midnight = lib_gtd.local_timestamp('2016-08-03')
+    store = GtdStore()
+    timestamps = [midnight - 1, midnight, next_midnight - 1, next_midnight]
+    store.add_events('lorax', timestamps, ['before', 'first', 'last', 'after'])
+    store.add_events('birdsong', [midnight, next_midnight], ['other', 'other'])
+    day = store.events_between('2016-08-02', '2016-08-03')
+    assert [key[1] for key in day.keys()] == [midnight, midnight, next_midnight - 1]
+    lorax = store.events_between('2016-08-02', '2016-08-03', hosts=['lorax'])
+    assert lorax.keys() == [('lorax', midnight), ('lorax', next_midnight - 1)]
+    assert len(store.events_between(midnight, midnight)) == 0
+    assert len(store.events_between(None, '2016-08-02')) == 1
+    assert len(store.events_between('2016-08-03', None)) == 2
+    assert fields(store.days('2016-08-02', '2016-08-02')) == fields(day)
+
+def test_day_pauses_cache():
+    store = GtdStore()
+    store.add_events('lorax', [BASE + minute * 60 for minute in (0, 3, 10, 12, 40)],
+                     ['a'] * 5)
+    cache = {}
+    cached = lib_gtd.gtd_day_pauses(store, cache=cache)
+    assert cached['max'].tolist() == [28.0]
+    # Same number of events, different times.
+    store.add_events('lorax', [BASE + 45 * 60], ['a'])
+    len(store)
+    store = store.subset(store.timestamp != BASE + 40 * 60)
+    cached = lib_gtd.gtd_day_pauses(store, cache=cache)
+    uncached = lib_gtd.gtd_day_pauses(store)
+    assert cached['max'].tolist() == uncached['max'].tolist() == [33.0]
+    assert cached['sum'].tolist() == uncached['sum'].tolist()
+    assert np.array_equal(cached['histogram'], uncached['histogram'])
+
+def rollup_rows(rollups):
+    """Return the rows of rollups with hosts and titles as strings."""
+    return sorted(zip(rollups['date'].tolist(),
+                      [rollups['hosts'][code] for code in rollups['host']],
+                      [rollups['titles'][code] if code != lib_gtd.NO_VALUE else ''
+                       for code in rollups['title']],
+                      rollups['count'].tolist(), rollups['first'].tolist(),
+                      rollups['last'].tolist(), rollups['gap_sum'].tolist()))
+
+def test_day_rollups_cache():
+    store = example_store()
+    rollups = {}
+    assert rollup_rows(lib_gtd.gtd_day_rollups(store, rollups)) == \
+        rollup_rows(lib_gtd.gtd_day_rollups(store))
+    # A title replaced, so the day has as many events as before.
+    store.add_events('lorax', [BASE + 20], ['replaced'])
+    assert rollup_rows(lib_gtd.gtd_day_rollups(store, rollups)) == \
+        rollup_rows(lib_gtd.gtd_day_rollups(store))
+    # Only the days of the changes, as refresh.py does.
+    store.changes = GtdStore()
+    store.add_events('birdsong', [BASE + 86400], ['tomorrow'])
+    days = np.unique(store.changes.event_info()['date'])
+    changed = lib_gtd.gtd_day_rollups(store, rollups, days)
+    assert np.unique(changed['date']).tolist() == days.tolist()
+    assert rollup_rows(lib_gtd.gtd_day_rollups(store, rollups)) == \
+        rollup_rows(lib_gtd.gtd_day_rollups(store))
+
+def test_day_activities_from_saved_rollups(tmpdir):
+    store = example_store()
+    store.add_events('birdsong', [BASE + 86400], ['tomorrow a'])
+    # As refresh.py keeps them.
+    rollups = {}
+    lib_gtd.gtd_day_rollups(store, rollups)
+    filename = str(tmpdir.join('rollups.pickle'))
+    lib_gtd.rollup_dump(filename, rollups)
+    activities = lib_gtd.gtd_day_activities(lib_gtd.rollup_load(filename), ['a', 'caf'])
+    assert activities['days'].tolist() == [datetime.date(2016, 8, 1), datetime.date(2016, 8, 2)]
+    assert activities['counts'].tolist() == [[3, 1], [1, 0]]
+
+def write_raw_data(directory):
+    """Write raw data of two hosts under directory, as gtd writes it.
+
+    Return the title and image directories.
+
+    """
+    title_dir = os.path.join(directory, 'gtd')
+    image_dir = os.path.join(directory, 'gtd-img')
+    os.makedirs(title_dir)
+    os.makedirs(image_dir)
+    random = np.random.RandomState(1)
+    for num, hostname in enumerate(['lorax', 'birdsong']):
+        start = BASE + num
+        with open(os.path.join(title_dir, hostname + '__2016-08-01_120000'), 'wb') as title_file:
+            for second in range(0, 300, 10):
+                title_file.write('{t} {w}\n'.format(t=start + second, w='window {n}'.format(
+                    n=second // 100)).encode('utf-8'))
+        for second in range(0, 300, 60):
+            image = (random.rand(12, 16, 3) * 255).astype(np.uint8)
+            cv2.imwrite(os.path.join(image_dir, '{h}_{t}.png'.format(
+                h=hostname, t=start + second)), image)
+    return title_dir, image_dir
+
+def test_gtd_read_late_image(tmpdir):
+    title_dir, image_dir = write_raw_data(str(tmpdir))
+    late = os.path.join(image_dir, 'lorax_{t}.png'.format(t=BASE + 60))
+    held = str(tmpdir.join('held.png'))
+    shutil.move(late, held)
+    manifest = {}
+    store = lib_gtd.gtd_read(title_dir, image_dir, None, manifest, histogram_mode=MODE)
+    assert 'window_thumbnail_filename' not in store[('lorax', BASE + 60)]
+    # As if copied from another machine, older than images we have read.
+    shutil.move(held, late)
+    store = lib_gtd.gtd_read(title_dir, image_dir, store, manifest)
+    assert store[('lorax', BASE + 60)]['window_thumbnail_filename'] == late
+    assert fields(store) == fields(lib_gtd.gtd_read(title_dir, image_dir, None,
+                                                    histogram_mode=MODE))
+
+def test_gtd_read_replaced_title_file(tmpdir):
+    title_dir, image_dir = write_raw_data(str(tmpdir))
+    manifest = {}
+    store = lib_gtd.gtd_read(title_dir, image_dir, None, manifest, histogram_mode=MODE)
+    filename = os.path.join(title_dir, 'birdsong__2016-08-01_120000')
+    with open(filename, 'rb') as title_file:
+        content = title_file.read()
+    # Replaced by a larger file, as rsync does, whose start differs.
+    replacement = filename + '.new'
+    with open(replacement, 'wb') as title_file:
+        title_file.write(content.replace(b'window 0', b'renamed') +
+                         '{t} appended\n'.format(t=BASE + 1000).encode('utf-8'))
+    os.rename(replacement, filename)
+    store = lib_gtd.gtd_read(title_dir, image_dir, store, manifest)
+    assert store[('birdsong', BASE + 1)]['window_title'] == 'renamed'
+    assert store[('birdsong', BASE + 1000)]['window_title'] == 'appended'
+    assert fields(store) == fields(lib_gtd.gtd_read(title_dir, image_dir, None,
+                                                    histogram_mode=MODE))
+
+def test_gtd_read_histogram_mode(tmpdir):
+    title_dir, image_dir = write_raw_data(str(tmpdir))
+    store = lib_gtd.gtd_read(title_dir, image_dir, None, histogram_mode=MODE)
+    assert store.histogram_mode == MODE
+    assert lib_gtd.store_histogram_mode(store) == MODE
+    with pytest.raises(ValueError):
+        lib_gtd.gtd_read(title_dir, image_dir, store,
+                         histogram_mode=lib_gtd.FULL_HISTOGRAM_MODE)
+
+def test_histogram_cache(tmpdir):
+    _, image_dir = write_raw_data(str(tmpdir))
+    filenames = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))
+    directory = str(tmpdir.join('cache'))
+    cache = lib_gtd.histogram_cache_load(directory)
+    computed, num_hits, num_misses = lib_gtd.cached_histograms(
+        filenames, cache, use_digest=True, mode=MODE)
+    assert (num_hits, num_misses) == (0, 10)
+    lib_gtd.histogram_cache_dump(directory, cache)
+    # A copy, found by the digest of its contents.
+    copy = str(tmpdir.join('copy.png'))
+    shutil.copy(filenames[3], copy)
+    cache = lib_gtd.histogram_cache_load(directory)
+    cached, num_hits, num_misses = lib_gtd.cached_histograms(
+        filenames + [copy], cache, use_digest=True, mode=MODE)
+    assert (num_hits, num_misses) == (11, 0)
+    for triple, cached_triple in zip(computed + [computed[3]], cached):
+        assert np.array_equal(np.ravel(triple), np.ravel(cached_triple))
+    # Only by file, and in another mode, they are not.
+    _, num_hits, num_misses = lib_gtd.cached_histograms(
+        [copy, filenames[0]], lib_gtd.histogram_cache_load(directory), mode=MODE)
+    assert (num_hits, num_misses) == (1, 1)
+    _, num_hits, num_misses = lib_gtd.cached_histograms(
+        filenames[:2], cache, mode=lib_gtd.FULL_HISTOGRAM_MODE)
+    assert (num_hits, num_misses) == (0, 2)
+    lib_gtd.histogram_cache_dump(directory, cache)
+    # Saved a little at a time, segments are merged and nothing is dropped.
+    for num in range(20):
+        image = str(tmpdir.join('image{n}.png'.format(n=num)))
+        cv2.imwrite(image, np.full((4, 4, 3), num, dtype=np.uint8))
+        cache = lib_gtd.histogram_cache_load(directory)
+        lib_gtd.cached_histograms([image], cache, mode=MODE)
+        lib_gtd.histogram_cache_dump(directory, cache)
+    assert len(lib_gtd_store.list_segments(directory)) < 10
+    images = [str(tmpdir.join('image{n}.png'.format(n=num))) for num in range(20)]
+    _, num_hits, num_misses = lib_gtd.cached_histograms(
+        filenames + [copy] + images, lib_gtd.histogram_cache_load(directory), mode=MODE)
+    assert (num_hits, num_misses) == (31, 0)
+
+def test_label_log(tmpdir):
+    filename = str(tmpdir.join('store'))
+    store = example_store()
+    lib_gtd.gtd_save_label(filename, store, ('lorax', BASE + 20), 'title', 'work')
+    assert store[('lorax', BASE + 20)]['ground_truth_window_title_label'] == 'work'
+    log = lib_gtd.label_log_path(filename)
+    # A record we crashed while writing, which the next one mustn't run on from.
+    with open(log, 'a') as log_file:
+        log_file.write('{"host": "lorax", "ki')
+    lib_gtd.gtd_save_label(filename, store, ('lorax', BASE), 'thumbnail', 'editor')
+    records = lib_gtd_store.read_records(log)
+    assert [(record['timestamp'], record['label']) for record in records] == \
+        [(BASE + 20, 'work'), (BASE, 'editor')]
+    joined = example_store()
+    # Labels of events the store doesn't have are ignored.
+    joined.join_labels(records + [{'host': 'lorax', 'timestamp': BASE + 99,
+                                   'kind': 'title', 'label': 'lost'}])
+    assert fields(joined) == fields(store)
+    assert len(joined) == 5
+
+def test_substring_matcher():
+    patterns = ['he', 'she', 'his', 'hers', u'caf\xe9', 'a', 'aa']
+    texts = ['ushers', 'this', 'sh', '', u'un caf\xe9', 'aaa', 'ahishers', 'xyz']
+    matcher = lib_gtd.SubstringMatcher(patterns)
+    expected = np.array([[pattern in text for pattern in patterns] for text in texts])
+    assert np.array_equal(matcher.match_table(texts), expected)
+    random = np.random.RandomState(2)
+    texts = [''.join(random.choice(list('abc'), random.randint(0, 12)))
+             for _ in range(200)]
+    patterns = list(set(''.join(random.choice(list('abc'), random.randint(1, 4)))
+                        for _ in range(20)))
+    expected = np.array([[pattern in text for pattern in patterns] for text in texts])
+    assert np.array_equal(lib_gtd.SubstringMatcher(patterns).match_table(texts), expected)
+
+def test_calendar_arrays():
+    dates = np.arange(np.datetime64('2014-12-20'), np.datetime64('2017-01-10'))
+    calendar = lib_gtd.calendar_arrays(dates)
+    days = [date.astype(datetime.date) for date in dates]
+    assert list(calendar['day_number']) == [(day - datetime.date(1970, 1, 1)).days
+                                         for day in days]
+    assert list(calendar['day_of_month']) == [day.day for day in days]
+    assert list(calendar['iso_week']) == [day.isocalendar()[1] for day in days]
+
+def test_events_dataframe():
+    store = example_store()
+    store.add_events('lorax', [BASE + 30], ['a cafe'])
+    frame = lib_gtd.events_dataframe(store)
+    assert list(frame.columns) == list(lib_gtd.DATAFRAME_COLUMNS)
+    assert list(frame['time']) == [key[1] for key in store.keys()]
+    assert list(frame['label']) == [event['window_title'] for event in store.values()]
+    assert frame['hostname'].dtype.name == 'category'
+    assert set(frame['label'].cat.categories) == {'a', 'b', 'c', 'a cafe', u'caf\xe9'}
+    assert frame['title_label'].isnull().sum() == len(store) - 1
+    # Each predicate against the same selection made event by event.
+    for predicates in [{'hosts': ['lorax']}, {'title_contains': 'a'},
+                       {'hosts': ['birdsong'], 'title_contains': 'a'},
+                       {'start': BASE + 5, 'end': BASE + 20, 'title_contains': 'a'},
+                       {'start': '2016-08-01T12:00:10', 'hosts': ['lorax']},
+                       {'host_classes': ['laptop'], 'end': BASE + 10}]:
+        frame = lib_gtd.events_dataframe(store, ['hostname', 'time', 'label'], **predicates)
+        expected = [
+            (hostname, timestamp, event['window_title'])
+            for (hostname, timestamp), event in store.iteritems()
+            if hostname in predicates.get('hosts', [hostname]) and
+            lib_gtd.get_host_class(hostname) in
+            predicates.get('host_classes', ['laptop', 'desktop']) and
+            predicates.get('title_contains', '') in event['window_title'] and
+            lib_gtd.local_timestamp(predicates.get('start', BASE)) <= timestamp and
+            timestamp < lib_gtd.local_timestamp(predicates.get('end', BASE + 100))]
+        assert list(zip(frame['hostname'], frame['time'], frame['label'])) == expected
+    with pytest.raises(ValueError):
+        lib_gtd.events_dataframe(store, ['hostname', 'colour'])
+
+def test_compute_histograms_jobs(tmpdir):
+    _, image_dir = write_raw_data(str(tmpdir))
+    filenames = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))
+    serial = list(lib_gtd.compute_histograms(filenames, 1, MODE))
+    pooled = list(lib_gtd.compute_histograms(filenames, 2, MODE))
+    assert len(pooled) == len(filenames)
+    for one, other in zip(serial, pooled):
+        for histogram, same in zip(one, other):
+            assert np.array_equal(histogram, same)
+
+def test_read_window_titles_one_file(tmpdir):
+    filename = str(tmpdir.join('lorax__2016-08-01_120000'))
+    lines = [u'{t} caf\xe9'.format(t=BASE).encode('utf-8'),
+             u'{t} caf\xe9 \u20ac'.format(t=BASE + 10).encode('iso-8859-15'),
+             u'{t}'.format(t=BASE + 20).encode('utf-8'),
+             b'',
+             u'{t} caf\xe9 again'.format(t=BASE + 30).encode('utf-8')]
+    complete = b'\n'.join(lines) + b'\n'
+    with open(filename, 'wb') as title_file:
+        title_file.write(complete + '{t} still being wr'.format(t=BASE + 40).encode('utf-8'))
+    store = GtdStore()
+    # Each line decoded by itself: the iso-8859-15 one doesn't make
+    # its utf-8 neighbours mojibake.
+    offset = lib_gtd.read_window_titles_one_file(filename, 'lorax', store)
+    assert offset == len(complete)
+    assert [event['window_title'] for event in store.values()] == \
+        [u'caf\xe9', u'caf\xe9 \u20ac', u'', u'caf\xe9 again']
+    with open(filename, 'ab') as title_file:
+        title_file.write(b'itten\n')
+    lib_gtd.read_window_titles_one_file(filename, 'lorax', store, offset)
+    assert store[('lorax', BASE + 40)]['window_title'] == 'still being written'
+
+def test_event_info_arrays_across_dst(monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/Paris')
+    time.tzset()
+    try:
+        # Either side of the spring and autumn changes of 2016.
+        timestamps = np.concatenate([np.arange(1459033200, 1459047600, 599),
+                                     np.arange(1477782000, 1477796400, 599)])
+        info = lib_gtd.event_info_arrays(timestamps)
+        for num, timestamp in enumerate(timestamps.tolist()):
+            expected = lib_gtd.basic_event_info(None, timestamp)
+            assert info['timestamp'][num].astype(datetime.datetime) == expected['timestamp']
+            assert info['date'][num].astype(datetime.date) == expected['date']
+            for field in ('weekday', 'hours', 'minutes', 'seconds'):
+                assert info[field][num] == expected[field]
+    finally:
+        monkeypatch.undo()
+        time.tzset()